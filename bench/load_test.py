@@ -0,0 +1,477 @@
+"""
+端到端压测：在本地替身服务（bench/mock_services.py）之上启动 W.A.S.，
+按固定速率回放飞书 im.message.receive_v1 事件到 /event、并发创建 Web 工单，
+统计吞吐、端到端延迟分位数，以及服务端 /metrics 中各环节的耗时分解
+
+    python3 bench/load_test.py --events 300 --tickets 100 --rate 20
+    python3 bench/load_test.py --llm-latency 0.5 --feishu-error-rate 0.05 --stream
+    python3 bench/load_test.py --save-baseline bench/baseline.json
+    python3 bench/load_test.py --compare bench/baseline.json      # 回归超过阈值时退出码为 1
+
+事件的端到端延迟 = 事件发出 -> 替身飞书收到该用户的最终回复；
+工单的端到端延迟 = 创建请求发出 -> 工单中出现 AI 回复
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import httpx
+import uvicorn
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+from bench.mock_services import create_app, add_fault_arguments, faults_from_args
+
+TEXTS = [
+    "学生电脑打开客户端一直白屏怎么办",
+    "客户端双击没反应，任务管理器里也没有进程",
+    "上课时摄像头黑屏，其它软件可以正常使用",
+    "学生账号登录提示密码错误，但确认密码是对的",
+    "作品保存失败，提示网络异常",
+    "平板上课件加载到 99% 就卡住了",
+    "麦克风没有声音，系统设置里能看到设备",
+    "launcher 更新失败，提示文件被占用",
+    "人工",
+]
+TICKETS = [
+    ("客户端白屏", "学生端启动后整个窗口白屏，重装过一次也没用"),
+    ("无法登录", "账号登录一直转圈，最后提示请求超时"),
+    ("作品丢失", "学生说上周保存的作品今天打开看不到了"),
+    ("声音异常", "上课时老师能听到学生，学生听不到老师"),
+]
+STAGE_PATTERN = re.compile(r'^was_stage_seconds_(bucket|sum|count)\{(.*)\} (\S+)$')
+LABEL_PATTERN = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def percentile(samples, q: float):
+    """最近秩分位数；无样本时返回 None"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, math.ceil(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(samples) -> dict:
+    return {
+        "count": len(samples),
+        "mean": sum(samples) / len(samples) if samples else None,
+        "p50": percentile(samples, 50),
+        "p95": percentile(samples, 95),
+        "p99": percentile(samples, 99),
+        "max": max(samples) if samples else None,
+    }
+
+
+def feishu_event(open_id: str, text: str = None, image_key: str = None) -> dict:
+    """构造与线上一致的 Event 2.0 im.message.receive_v1 回调"""
+    if image_key:
+        message_type, content = "image", {"image_key": image_key}
+    else:
+        message_type, content = "text", {"text": text}
+    now_ms = str(int(time.time() * 1000))
+    return {
+        "schema": "2.0",
+        "header": {
+            "event_id": uuid.uuid4().hex,
+            "event_type": "im.message.receive_v1",
+            "create_time": now_ms,
+            "token": "mock-verification-token",
+            "app_id": "cli_mock",
+            "tenant_key": "mock-tenant",
+        },
+        "event": {
+            "sender": {
+                "sender_id": {"open_id": open_id, "union_id": f"on_{open_id[3:]}", "user_id": open_id[-8:]},
+                "sender_type": "user",
+                "tenant_key": "mock-tenant",
+            },
+            "message": {
+                "message_id": f"om_{uuid.uuid4().hex}",
+                "create_time": now_ms,
+                "chat_id": f"oc_{uuid.uuid4().hex[:16]}",
+                "chat_type": "p2p",
+                "message_type": message_type,
+                "content": json.dumps(content, ensure_ascii=False),
+            },
+        },
+    }
+
+
+def parse_stage_histograms(text: str) -> dict:
+    """从 Prometheus 文本中取出 was_stage_seconds：{stage: {"buckets": [(le, 累计数)], "sum", "count"}}"""
+    stages = {}
+    for line in text.splitlines():
+        m = STAGE_PATTERN.match(line)
+        if not m:
+            continue
+        kind, labels, value = m.group(1), dict(LABEL_PATTERN.findall(m.group(2))), float(m.group(3))
+        stage = stages.setdefault(labels.get("stage", ""), {"buckets": [], "sum": 0.0, "count": 0})
+        if kind == "bucket":
+            stage["buckets"].append((float(labels["le"]), value))
+        else:
+            stage[kind] = value
+    return stages
+
+
+def histogram_quantile(buckets, q: float):
+    """与 PromQL histogram_quantile 相同的桶内线性插值"""
+    total = buckets[-1][1] if buckets else 0
+    if total <= 0:
+        return None
+    rank = q * total
+    lower_bound, lower_count = 0.0, 0.0
+    for bound, count in buckets:
+        if count >= rank:
+            if bound == float("inf"):
+                return lower_bound
+            if count == lower_count:
+                return bound
+            return lower_bound + (bound - lower_bound) * (rank - lower_count) / (count - lower_count)
+        lower_bound, lower_count = bound, count
+    return lower_bound
+
+
+def stage_breakdown(before: dict, after: dict) -> dict:
+    """两次抓取之差即本轮压测期间各环节的耗时分布"""
+    result = {}
+    for stage, cur in sorted(after.items()):
+        prev = before.get(stage, {"buckets": [], "sum": 0.0, "count": 0})
+        prev_buckets = dict(prev["buckets"])
+        buckets = [(le, count - prev_buckets.get(le, 0)) for le, count in cur["buckets"]]
+        count = cur["count"] - prev["count"]
+        if count <= 0:
+            continue
+        result[stage] = {
+            "count": int(count),
+            "mean": (cur["sum"] - prev["sum"]) / count,
+            "p50": histogram_quantile(buckets, 0.50),
+            "p95": histogram_quantile(buckets, 0.95),
+            "p99": histogram_quantile(buckets, 0.99),
+        }
+    return result
+
+
+class MockServer:
+    """在后台线程里运行替身服务，压测进程直接读取其投递记录"""
+
+    def __init__(self, port: int, **kwargs):
+        self.app = create_app(**kwargs)
+        self.url = f"http://127.0.0.1:{port}"
+        self._server = uvicorn.Server(uvicorn.Config(self.app, host="127.0.0.1", port=port, log_level="warning"))
+        self._thread = threading.Thread(target=self._server.run, name="mock-services", daemon=True)
+
+    def start(self, timeout: float = 10.0):
+        self._thread.start()
+        deadline = time.time() + timeout
+        while not self._server.started:
+            if time.time() > deadline:
+                raise RuntimeError("mock services failed to start")
+            time.sleep(0.05)
+
+    def stop(self):
+        self._server.should_exit = True
+        self._thread.join(timeout=5)
+
+
+def spawn_service(port: int, mock_url: str, workdir: str, stream: bool) -> subprocess.Popen:
+    """以临时目录为 WAS_HOME 启动被测服务，会话库、任务队列、日志都写在那里，不会写进仓库"""
+    os.makedirs(os.path.join(workdir, "data"), exist_ok=True)
+    vector_db = os.path.join(ROOT, "data", "vector_store.db")
+    if os.path.exists(vector_db):
+        shutil.copy(vector_db, os.path.join(workdir, "data", "vector_store.db"))
+    env = dict(os.environ)
+    env.update({
+        "PYTHONPATH": ROOT + os.pathsep + env.get("PYTHONPATH", ""),
+        "WAS_HOME": workdir,
+        "KB_PATH": os.path.join(ROOT, "data", "walnut_kb.json"),
+        "GROQ_API_KEY": "mock-key",
+        "GROQ_BASE_URL": f"{mock_url}/openai/v1",
+        "FEISHU_BASE_URL": mock_url,
+        "FEISHU_APP_ID": "cli_mock",
+        "FEISHU_APP_SECRET": "mock-secret",
+        "WAS_STREAM_REPLY": "1" if stream else "0",
+        "KB_WATCH_INTERVAL": "0",
+    })
+    return subprocess.Popen([sys.executable, "-m", "uvicorn", "core.server:app", "--host", "127.0.0.1",
+                             "--port", str(port), "--log-level", "warning"],
+                            cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+
+
+async def wait_healthy(client: httpx.AsyncClient, timeout: float = 60.0):
+    """等到索引预热完成 (ready) 再开始计时，避免首批请求承担加载耗时"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            r = await client.get("/health")
+            if r.status_code == 200 and r.json().get("ready"):
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("service did not become healthy")
+
+
+async def replay_events(client: httpx.AsyncClient, deliveries, count: int, rate: float, image_ratio: float,
+                        duplicate_ratio: float, timeout: float, rng: random.Random) -> dict:
+    """开环回放：按固定速率发出事件，不等待上一条完成，避免协调遗漏掩盖排队延迟"""
+    sent, ack_latency, statuses = {}, [], {}
+
+    async def post(payload, open_id=None):
+        start = time.perf_counter()
+        if open_id:
+            sent[open_id] = start
+        try:
+            r = await client.post("/event", json=payload)
+            status = r.status_code
+        except httpx.HTTPError:
+            status = "error"
+        ack_latency.append(time.perf_counter() - start)
+        statuses[status] = statuses.get(status, 0) + 1
+
+    tasks = []
+    begin = time.perf_counter()
+    for i in range(count):
+        await asyncio.sleep(max(0.0, begin + i / rate - time.perf_counter()))
+        open_id = f"ou_{uuid.uuid4().hex}"
+        if rng.random() < image_ratio:
+            payload = feishu_event(open_id, image_key=f"img_v3_{uuid.uuid4().hex[:12]}")
+        else:
+            payload = feishu_event(open_id, text=rng.choice(TEXTS))
+        tasks.append(asyncio.create_task(post(payload, open_id)))
+        if rng.random() < duplicate_ratio:
+            # 飞书超时重投：同一事件再送一次，应被幂等层丢弃
+            tasks.append(asyncio.create_task(post(payload)))
+    await asyncio.gather(*tasks)
+
+    deadline = time.perf_counter() + timeout
+    accepted = [oid for oid in sent if oid not in deliveries.final]
+    while accepted and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+        accepted = [oid for oid in accepted if oid not in deliveries.final]
+
+    e2e = [deliveries.final[oid] - t for oid, t in sent.items() if oid in deliveries.final]
+    first = [deliveries.first[oid] - t for oid, t in sent.items() if oid in deliveries.first]
+    done = [deliveries.final[oid] for oid in sent if oid in deliveries.final]
+    elapsed = (max(done) - begin) if done else None
+    return {
+        "sent": len(sent),
+        "ack_status": {str(k): v for k, v in statuses.items()},
+        "delivered": len(e2e),
+        "timed_out": len(sent) - len(e2e),
+        "throughput_per_s": len(e2e) / elapsed if elapsed else 0.0,
+        "ack_latency": summarize(ack_latency),
+        "first_reply_latency": summarize(first),
+        "e2e_latency": summarize(e2e),
+    }
+
+
+async def replay_tickets(client: httpx.AsyncClient, count: int, rate: float, poll_interval: float,
+                         timeout: float, rng: random.Random) -> dict:
+    create_latency, e2e, statuses = [], [], {}
+    finished_at = []
+
+    async def one(i):
+        title, description = rng.choice(TICKETS)
+        start = time.perf_counter()
+        try:
+            r = await client.post("/api/tickets/create", json={
+                "user_id": f"teacher_{i % 50}", "title": title, "description": description})
+        except httpx.HTTPError:
+            statuses["error"] = statuses.get("error", 0) + 1
+            return
+        create_latency.append(time.perf_counter() - start)
+        statuses[r.status_code] = statuses.get(r.status_code, 0) + 1
+        if r.status_code != 200:
+            return
+        ticket = r.json()
+        etag = None
+        while len(ticket["messages"]) < 2 and time.perf_counter() - start < timeout:
+            await asyncio.sleep(poll_interval)
+            # 带 If-None-Match 轮询，未变化时服务端只回 304
+            resp = await client.get(f"/api/tickets/{ticket['id']}", headers={"If-None-Match": etag} if etag else None)
+            if resp.status_code == 200:
+                ticket, etag = resp.json(), resp.headers.get("etag")
+        if len(ticket["messages"]) >= 2:
+            now = time.perf_counter()
+            e2e.append(now - start)
+            finished_at.append(now)
+
+    tasks = []
+    begin = time.perf_counter()
+    for i in range(count):
+        await asyncio.sleep(max(0.0, begin + i / rate - time.perf_counter()))
+        tasks.append(asyncio.create_task(one(i)))
+    await asyncio.gather(*tasks)
+    elapsed = (max(finished_at) - begin) if finished_at else None
+    return {
+        "created": len(create_latency),
+        "create_status": {str(k): v for k, v in statuses.items()},
+        "answered": len(e2e),
+        "timed_out": len(create_latency) - len(e2e),
+        "throughput_per_s": len(e2e) / elapsed if elapsed else 0.0,
+        "create_latency": summarize(create_latency),
+        "e2e_latency": summarize(e2e),
+    }
+
+
+async def run(args) -> dict:
+    rng = random.Random(args.seed)
+    mock = MockServer(args.mock_port, token_delay=args.token_delay, faults=faults_from_args(args), seed=args.seed)
+    mock.start()
+    workdir = tempfile.mkdtemp(prefix="was-bench-")
+    process = None
+    target = args.target
+    if not target:
+        process = spawn_service(args.port, mock.url, workdir, args.stream)
+        target = f"http://127.0.0.1:{args.port}"
+    limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+    try:
+        async with httpx.AsyncClient(base_url=target, timeout=30.0, limits=limits) as client:
+            await wait_healthy(client)
+            before = parse_stage_histograms((await client.get("/metrics")).text)
+            started = time.perf_counter()
+            events, tickets = await asyncio.gather(
+                replay_events(client, mock.app.state.deliveries, args.events, args.rate, args.image_ratio,
+                              args.duplicate_ratio, args.timeout, rng),
+                replay_tickets(client, args.tickets, args.ticket_rate, args.poll_interval, args.timeout, rng),
+            )
+            wall = time.perf_counter() - started
+            after = parse_stage_histograms((await client.get("/metrics")).text)
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        mock.stop()
+    return {
+        "config": {k: v for k, v in vars(args).items() if k not in ("save_baseline", "compare", "output")},
+        "wall_seconds": wall,
+        "events": events,
+        "tickets": tickets,
+        "stages": stage_breakdown(before, after),
+        "upstream_calls": dict(mock.app.state.calls),
+    }
+
+
+def _ms(value) -> str:
+    return "-" if value is None else f"{value * 1000:.1f}"
+
+
+def print_report(report: dict):
+    events, tickets = report["events"], report["tickets"]
+    print(f"\n=== W.A.S. load test ({report['wall_seconds']:.1f}s) ===")
+    print(f"events : sent {events['sent']}, delivered {events['delivered']}, timed out {events['timed_out']}, "
+          f"acks {events['ack_status']}, {events['throughput_per_s']:.2f}/s")
+    print(f"tickets: created {tickets['created']}, answered {tickets['answered']}, timed out {tickets['timed_out']}, "
+          f"{tickets['throughput_per_s']:.2f}/s")
+    print(f"\n{'latency (ms)':<28}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    rows = [("event ack", events["ack_latency"]), ("event first reply", events["first_reply_latency"]),
+            ("event e2e", events["e2e_latency"]), ("ticket create", tickets["create_latency"]),
+            ("ticket e2e", tickets["e2e_latency"])]
+    for name, s in rows:
+        print(f"{name:<28}{_ms(s['p50']):>10}{_ms(s['p95']):>10}{_ms(s['p99']):>10}{_ms(s['max']):>10}")
+    print(f"\n{'stage (ms)':<28}{'count':>10}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for stage, s in report["stages"].items():
+        print(f"{stage:<28}{s['count']:>10}{_ms(s['mean']):>10}{_ms(s['p50']):>10}{_ms(s['p95']):>10}{_ms(s['p99']):>10}")
+    print(f"\nupstream calls: {report['upstream_calls']}")
+
+
+# 与基线比较的指标：(路径, 越大越好)
+COMPARED_METRICS = [
+    (("events", "throughput_per_s"), True),
+    (("events", "e2e_latency", "p50"), False),
+    (("events", "e2e_latency", "p95"), False),
+    (("events", "e2e_latency", "p99"), False),
+    (("events", "ack_latency", "p95"), False),
+    (("tickets", "throughput_per_s"), True),
+    (("tickets", "e2e_latency", "p95"), False),
+    (("tickets", "create_latency", "p95"), False),
+]
+
+
+def _lookup(report: dict, path):
+    for key in path:
+        report = (report or {}).get(key)
+    return report
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list:
+    """返回超出容忍度的回归项；同时打印逐项对比"""
+    regressions = []
+    # 负载或故障注入参数不同，数字就不可比
+    ignored = {"target", "port", "mock_port", "connections", "timeout", "poll_interval", "tolerance"}
+    differs = sorted(k for k, v in baseline.get("config", {}).items()
+                     if k not in ignored and report["config"].get(k) != v)
+    if differs:
+        print(f"\nWARNING: workload differs from baseline in {', '.join(differs)}; comparison may be meaningless.")
+    print(f"\n{'vs baseline':<32}{'baseline':>12}{'current':>12}{'change':>10}")
+    for path, higher_is_better in COMPARED_METRICS:
+        old, new = _lookup(baseline, path), _lookup(report, path)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        worse = -change if higher_is_better else change
+        flag = "  REGRESSION" if worse > tolerance else ""
+        print(f"{'.'.join(path):<32}{old:>12.4f}{new:>12.4f}{change:>+10.1%}{flag}")
+        if flag:
+            regressions.append(".".join(path))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load test against local Groq/Feishu stand-ins")
+    parser.add_argument("--target", default=None, help="压测已运行的服务（需自行把上游指向替身服务）；默认自动启动")
+    parser.add_argument("--port", type=int, default=18001, help="自动启动的被测服务端口")
+    parser.add_argument("--mock-port", type=int, default=18080)
+    parser.add_argument("--stream", action="store_true", help="被测服务使用流式回复 (WAS_STREAM_REPLY=1)")
+    parser.add_argument("--events", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=5.0, help="事件发送速率 (条/秒)")
+    parser.add_argument("--image-ratio", type=float, default=0.2, help="图片消息占比")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.05, help="模拟飞书重投的比例")
+    parser.add_argument("--tickets", type=int, default=50)
+    parser.add_argument("--ticket-rate", type=float, default=2.0, help="工单创建速率 (个/秒)")
+    parser.add_argument("--poll-interval", type=float, default=0.05)
+    parser.add_argument("--timeout", type=float, default=60.0, help="单个请求等待回复的上限 (秒)")
+    parser.add_argument("--connections", type=int, default=100)
+    parser.add_argument("--token-delay", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=42)
+    add_fault_arguments(parser)
+    # 默认给上游加上接近线上的延迟，基线数字才不至于被本机噪声主导
+    parser.set_defaults(llm_latency=0.3, llm_jitter=0.2, feishu_latency=0.03, feishu_jitter=0.02)
+    parser.add_argument("--output", default=None, help="把完整报告写成 JSON")
+    parser.add_argument("--save-baseline", default=None, help="把本次结果保存为基线")
+    parser.add_argument("--compare", default=None, help="与基线 JSON 比较")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允许的相对退化幅度")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            print(f"\nReport written to {path}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} metric(s) regressed beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
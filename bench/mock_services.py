@@ -0,0 +1,203 @@
+"""
+本地替身服务：模拟 Groq (OpenAI 兼容) chat-completions 接口（支持 SSE 流式输出），
+以及飞书鉴权、发送/编辑消息、下载消息图片接口；每个接口可单独配置延迟与错误率
+用于在不访问线上 API 的情况下测试 LLMClient / 流式回复链路，并作为 bench/load_test.py 的上游
+
+    python3 bench/mock_services.py --port 18080 --llm-latency 0.3 --feishu-error-rate 0.02
+    GROQ_BASE_URL=http://127.0.0.1:18080/openai/v1 FEISHU_BASE_URL=http://127.0.0.1:18080 python3 -m core.server
+"""
+import argparse
+import asyncio
+import io
+import json
+import random
+import time
+import uuid
+from collections import Counter
+from typing import NamedTuple
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+DEFAULT_REPLY = "【解决办法】\n1. 关闭客户端，进入 %appdata% 目录删除 Walnut 文件夹。\n2. 右键图标 -> 属性，在目标末尾加上 --disable-gpu 参数后重新打开。"
+# StreamingTextMessage 在未完成的消息末尾追加的光标，用来区分中间态与最终回复
+STREAM_CURSOR = " ▌"
+
+
+class Fault(NamedTuple):
+    """单个接口的故障注入参数"""
+    latency: float = 0.0     # 固定延迟 (秒)
+    jitter: float = 0.0      # 额外的均匀随机延迟上限 (秒)
+    error_rate: float = 0.0  # 返回错误的概率
+
+
+SERVICES = ("llm", "feishu_auth", "feishu_message", "feishu_image")
+
+
+class DeliveryLog:
+    """按接收人记录发往飞书的消息：首条到达时间、最终回复（不带流式光标）到达时间、消息条数"""
+
+    def __init__(self):
+        self.first = {}
+        self.final = {}
+        self.count = Counter()
+        self._receivers = {}
+
+    def record(self, receive_id: str, text: str, message_id: str = None):
+        now = time.perf_counter()
+        self.first.setdefault(receive_id, now)
+        self.count[receive_id] += 1
+        if not text.endswith(STREAM_CURSOR):
+            self.final.setdefault(receive_id, now)
+        if message_id:
+            self._receivers[message_id] = receive_id
+
+    def receiver_of(self, message_id: str):
+        return self._receivers.get(message_id)
+
+
+def sample_image(width: int = 1280, height: int = 720) -> bytes:
+    """生成一张带文字块的 PNG，模拟老师发来的报错截图"""
+    from PIL import Image, ImageDraw
+    img = Image.new('RGB', (width, height), (245, 245, 245))
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((80, 80, width - 80, 200), fill=(200, 60, 60))
+    for row in range(12):
+        y = 260 + row * 34
+        draw.rectangle((120, y, 120 + (row * 97) % (width - 300) + 120, y + 18), fill=(60, 60, 60))
+    buf = io.BytesIO()
+    img.save(buf, format='PNG')
+    return buf.getvalue()
+
+
+def create_app(reply: str = DEFAULT_REPLY, chunk_chars: int = 4, token_delay: float = 0.02,
+               faults: dict = None, seed: int = None, stream_noise: bool = False) -> FastAPI:
+    """stream_noise：在 SSE 流里穿插心跳注释、choices 为空的用量块和截断的 JSON 行，检验客户端的容错"""
+    app = FastAPI(title="W.A.S. mock services")
+    faults = {name: (faults or {}).get(name, Fault()) for name in SERVICES}
+    rng = random.Random(seed)
+    app.state.calls = Counter()
+    app.state.deliveries = DeliveryLog()
+    image = sample_image()
+
+    async def inject(service: str) -> bool:
+        """施加延迟，并按错误率决定本次是否返回错误"""
+        fault = faults[service]
+        app.state.calls[service] += 1
+        delay = fault.latency + (rng.uniform(0, fault.jitter) if fault.jitter else 0.0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if fault.error_rate and rng.random() < fault.error_rate:
+            app.state.calls[f"{service}_error"] += 1
+            return True
+        return False
+
+    def feishu_rate_limited():
+        return JSONResponse(status_code=429, headers={"x-ogw-ratelimit-reset": "0.1"},
+                            content={"code": 99991400, "msg": "request trigger frequency limit"})
+
+    @app.post("/openai/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        if await inject("llm"):
+            return JSONResponse(status_code=503, content={"error": {"message": "mock upstream overloaded"}})
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        model = body.get("model", "mock")
+
+        if not body.get("stream"):
+            return {
+                "id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+            }
+
+        async def events():
+            for i in range(0, len(reply), chunk_chars):
+                chunk = {"id": completion_id, "object": "chat.completion.chunk", "model": model,
+                         "choices": [{"index": 0, "delta": {"content": reply[i:i + chunk_chars]}, "finish_reason": None}]}
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                if stream_noise and i == 0:
+                    yield ": keep-alive\n\n"
+                    yield 'data: {"choices": [{"index": 0, "delta"\n\n'
+                    yield 'data: {"choices": [{"index": 0, "delta": null}]}\n\n'
+                await asyncio.sleep(token_delay)
+            if stream_noise:
+                usage = {"id": completion_id, "object": "chat.completion.chunk", "model": model, "choices": [],
+                         "usage": {"prompt_tokens": 10, "completion_tokens": len(reply), "total_tokens": 10 + len(reply)}}
+                yield f"data: {json.dumps(usage)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.post("/open-apis/auth/v3/tenant_access_token/internal")
+    async def tenant_access_token():
+        if await inject("feishu_auth"):
+            return JSONResponse(status_code=500, content={"code": 10003, "msg": "mock auth failure"})
+        return {"code": 0, "msg": "ok", "tenant_access_token": f"t-mock-{uuid.uuid4().hex[:8]}", "expire": 7200}
+
+    @app.post("/open-apis/im/v1/messages")
+    async def send_message(request: Request, receive_id_type: str = "open_id"):
+        body = await request.json()
+        if await inject("feishu_message"):
+            return feishu_rate_limited()
+        message_id = f"om_mock_{uuid.uuid4().hex[:16]}"
+        text = json.loads(body.get("content") or "{}").get("text", "")
+        app.state.deliveries.record(body.get("receive_id"), text, message_id)
+        return {"code": 0, "msg": "success", "data": {"message_id": message_id}}
+
+    @app.put("/open-apis/im/v1/messages/{message_id}")
+    async def update_message(message_id: str, request: Request):
+        body = await request.json()
+        if await inject("feishu_message"):
+            return feishu_rate_limited()
+        receive_id = app.state.deliveries.receiver_of(message_id)
+        if receive_id is None:
+            return JSONResponse(status_code=400, content={"code": 230001, "msg": "message not found"})
+        app.state.deliveries.record(receive_id, json.loads(body.get("content") or "{}").get("text", ""))
+        return {"code": 0, "msg": "success", "data": {}}
+
+    @app.get("/open-apis/im/v1/messages/{message_id}/resources/{file_key}")
+    async def message_resource(message_id: str, file_key: str, type: str = "image"):
+        if await inject("feishu_image"):
+            return feishu_rate_limited()
+        return Response(content=image, media_type="image/png")
+
+    @app.get("/mock/stats")
+    async def stats():
+        deliveries = app.state.deliveries
+        return {"calls": dict(app.state.calls), "receivers": len(deliveries.first), "completed": len(deliveries.final)}
+
+    return app
+
+
+def add_fault_arguments(parser: argparse.ArgumentParser):
+    """各接口的延迟/错误率参数，mock_services 与 load_test 共用"""
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="LLM 首包前的固定延迟 (秒)")
+    parser.add_argument("--llm-jitter", type=float, default=0.0)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="LLM 返回 503 的概率")
+    parser.add_argument("--feishu-latency", type=float, default=0.0, help="飞书接口固定延迟 (秒)")
+    parser.add_argument("--feishu-jitter", type=float, default=0.0)
+    parser.add_argument("--feishu-error-rate", type=float, default=0.0, help="飞书消息/图片接口返回 429 的概率")
+    parser.add_argument("--auth-error-rate", type=float, default=0.0, help="飞书鉴权接口失败的概率")
+
+
+def faults_from_args(args) -> dict:
+    feishu = Fault(args.feishu_latency, args.feishu_jitter, args.feishu_error_rate)
+    return {
+        "llm": Fault(args.llm_latency, args.llm_jitter, args.llm_error_rate),
+        "feishu_auth": Fault(args.feishu_latency, args.feishu_jitter, args.auth_error_rate),
+        "feishu_message": feishu,
+        "feishu_image": feishu,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--token-delay", type=float, default=0.02, help="相邻 SSE 分片之间的间隔 (秒)")
+    parser.add_argument("--seed", type=int, default=None)
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+    app = create_app(token_delay=args.token_delay, faults=faults_from_args(args), seed=args.seed)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,304 @@
+"""
+检索基准：在不同规模的合成知识库上比较各类索引的重建耗时、查询延迟、内存峰值与召回质量
+
+    python3 bench/retrieval_bench.py                                   # 1k / 10k / 100k
+    python3 bench/retrieval_bench.py --sizes 1000,10000,100000,1000000 --output results.json
+    python3 bench/retrieval_bench.py --kb data/walnut_kb.json --queries labeled.jsonl
+
+合成知识库与 walnut_kb.json 同构（title/content 数组），每条带一个唯一的错误码；
+标注查询模仿老师在工单里的说法（口语化的症状描述 + 可能缺失的错误码），标签为对应条目
+--queries 可以换成从历史工单整理出的真实标注集，每行 {"query": ..., "title": 期望命中的条目标题}
+
+每个 (规模, 索引类型) 组合在独立的子进程中运行，内存峰值取子进程的 ru_maxrss 相对重建前的增量
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+DEVICES = [("Windows 电脑", "电脑"), ("Mac", "苹果电脑"), ("iPad", "平板"), ("安卓平板", "平板"),
+           ("学校机房电脑", "机房的电脑"), ("Chromebook", "笔记本")]
+COMPONENTS = ["客户端", "摄像头", "麦克风", "扬声器", "课件", "作品", "账号", "Launcher", "编辑器", "直播间",
+              "屏幕共享", "白板"]
+# (规范说法, 老师的口语说法)
+SYMPTOMS = [
+    ("白屏", ["一片白", "全是白的", "白屏了"]),
+    ("黑屏", ["黑乎乎的", "一直黑屏", "什么都不显示"]),
+    ("闪退", ["打开就自己关了", "用着用着就退出了", "老是闪退"]),
+    ("无法登录", ["登不上去", "登录一直失败", "进不去"]),
+    ("卡顿", ["特别卡", "一卡一卡的", "很慢"]),
+    ("没有声音", ["听不到声音", "没声", "静音了一样"]),
+    ("加载失败", ["加载不出来", "一直转圈", "卡在加载"]),
+    ("保存失败", ["保存不了", "存不上", "保存报错"]),
+    ("更新失败", ["更新不了", "升级失败", "一直提示更新"]),
+    ("连接超时", ["连不上", "老是超时", "网络连接失败"]),
+]
+STEPS = ["关闭客户端后删除 %appdata%/Walnut 缓存目录", "在快捷方式目标末尾添加 --disable-gpu", "切换到独立显卡运行",
+         "检查系统隐私设置中的设备权限", "退出账号后重新登录", "使用 DirectX 修复工具修复运行环境",
+         "更换为有线网络或手机热点", "卸载后从官网下载最新版本重新安装", "在设备管理器中重新启用该设备",
+         "清理浏览器缓存后刷新页面", "关闭杀毒软件的实时防护后重试", "联系二线技术支持并提供日志"]
+FILLERS = ["老师你好，", "您好，", "急！", "", "学生反馈", "家长说", "上课的时候"]
+CODE_ALPHABET = "0123456789ABCDEFGHJKLMNPQRSTUVWXYZ"
+INDEX_TYPES = ("keyword", "vector_exact", "hybrid")
+
+
+def error_code(i: int) -> str:
+    """条目编号到 6 位错误码的双射（乘以与进制互素的奇数再取模），相邻编号的错误码毫不相似"""
+    base = len(CODE_ALPHABET)
+    n = (i * 2654435761 + 97) % base ** 6
+    chars = []
+    for _ in range(6):
+        n, r = divmod(n, base)
+        chars.append(CODE_ALPHABET[r])
+    return "".join(chars)
+
+
+def synth_entry(i: int, rng: random.Random) -> dict:
+    device = rng.randrange(len(DEVICES))
+    component = rng.randrange(len(COMPONENTS))
+    symptom = rng.randrange(len(SYMPTOMS))
+    code = error_code(i)
+    steps = rng.sample(STEPS, 3)
+    return {
+        "title": f"{DEVICES[device][0]}{COMPONENTS[component]}{SYMPTOMS[symptom][0]}（错误码 {code}）",
+        "content": (f"问题现象: {DEVICES[device][0]}上{COMPONENTS[component]}{SYMPTOMS[symptom][0]}，"
+                    f"提示错误码 {code}。\n解决方案: 1. {steps[0]} 2. {steps[1]} 3. {steps[2]}"),
+        "_labels": (device, component, symptom, code),
+    }
+
+
+def synth_query(entry: dict, rng: random.Random, code_ratio: float) -> str:
+    """老师的说法：同义口语描述，顺序和措辞都与 KB 标题不同，错误码有时会漏报"""
+    device, component, symptom, code = entry["_labels"]
+    text = f"{rng.choice(FILLERS)}{DEVICES[device][1]}上的{COMPONENTS[component]}{rng.choice(SYMPTOMS[symptom][1])}"
+    if rng.random() < code_ratio:
+        text += rng.choice([f"，报错 {code}", f"，提示{code}", f" 错误码{code.lower()}"])
+    return text + rng.choice(["", "，怎么办", "，重装也没用", "？"])
+
+
+def write_synthetic(size: int, workdir: str, n_queries: int, code_ratio: float, seed: int):
+    """写出同构的 walnut_kb.json、WalnutKB 用的关键词格式，以及标注查询集"""
+    from core.kb_io import KBWriter
+    rng = random.Random(seed)
+    kb_path = os.path.join(workdir, f"kb_{size}.json")
+    keyword_path = os.path.join(workdir, f"kb_{size}_keywords.json")
+    picked = set(random.Random(seed + 1).sample(range(size), min(n_queries, size)))
+    queries = []
+    with KBWriter(kb_path) as writer, open(keyword_path, "w", encoding="utf-8") as kw:
+        kw.write("{")
+        for i in range(size):
+            entry = synth_entry(i, rng)
+            device, component, symptom, code = entry.pop("_labels")
+            writer.write(entry)
+            keywords = [COMPONENTS[component].lower(), SYMPTOMS[symptom][0], code.lower()]
+            kw.write(("," if i else "") + json.dumps(str(i)) + ":" +
+                     json.dumps({"keywords": keywords, "answer": entry["content"]}, ensure_ascii=False))
+            if i in picked:
+                entry["_labels"] = (device, component, symptom, code)
+                queries.append({"query": synth_query(entry, rng, code_ratio), "title": entry["title"], "id": str(i)})
+        kw.write("}")
+    return kb_path, keyword_path, queries
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return _peak_rss_mb()
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 计，macOS 以字节计
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, int(-(-q * len(ordered) // 100)) - 1))] if ordered else None
+
+
+def _quality(ranks, ks) -> dict:
+    """ranks 为每条查询中正确条目的名次（从 1 开始，未命中为 None）"""
+    n = len(ranks) or 1
+    result = {f"recall@{k}": sum(1 for r in ranks if r is not None and r <= k) / n for k in ks}
+    result[f"mrr@{max(ks)}"] = sum(1.0 / r for r in ranks if r is not None and r <= max(ks)) / n
+    return result
+
+
+def run_config(index_type: str, kb_path: str, keyword_path: str, queries: list, ks: tuple, workdir: str,
+               warmup: int = 5) -> dict:
+    """在子进程里执行：重建（冷启动）、无变化的热更新、逐条查询计时与质量评估"""
+    from core.logger import logger
+    from core.vector_engine import VectorSearchEngine
+    from infra.kb_engine import WalnutKB
+    logger.setLevel("WARNING")
+    top_k = max(ks)
+    # 模块导入之后再取基线，内存增量只反映索引本身
+    baseline_rss = _rss_mb()
+    start = time.perf_counter()
+    if index_type == "keyword":
+        kb = WalnutKB(keyword_path)
+        rebuild_s = time.perf_counter() - start
+        start = time.perf_counter()
+        kb.reload()
+        reload_s = time.perf_counter() - start
+        # WalnutKB 返回答案文本，按标注条目的答案比对（答案相同的条目视为同一命中）
+        for q in queries:
+            q["answer"] = kb.kb_data[q["id"]]["answer"]
+
+        def ranked(query):
+            return [answer for _, answer in kb.search_top_k(query, top_k)]
+        label = "answer"
+    else:
+        db_path = os.path.join(workdir, f"{index_type}_{os.getpid()}.db")
+        engine = VectorSearchEngine(kb_path=kb_path, db_path=db_path,
+                                    hybrid=index_type == "hybrid")
+        engine.rebuild(incremental=False)
+        rebuild_s = time.perf_counter() - start
+        start = time.perf_counter()
+        engine.reload()
+        reload_s = time.perf_counter() - start
+
+        def ranked(query):
+            # 命中文档形如 "问题: {title}\n解决方案: ..."，取回标题与标注比对
+            return [doc.split("\n", 1)[0][len("问题: "):] for doc in engine.search_hits(query, top_k=top_k)]
+        label = "title"
+    peak_mb = _peak_rss_mb() - baseline_rss
+    resident_mb = _rss_mb() - baseline_rss
+
+    for q in queries[:warmup]:
+        ranked(q["query"])
+    latencies, ranks = [], []
+    for q in queries:
+        start = time.perf_counter()
+        hits = ranked(q["query"])
+        latencies.append(time.perf_counter() - start)
+        ranks.append(hits.index(q[label]) + 1 if q[label] in hits else None)
+    return {
+        "index": index_type,
+        "rebuild_s": rebuild_s,
+        "reload_s": reload_s,
+        "peak_mb": round(peak_mb, 1),
+        "resident_mb": round(resident_mb, 1),
+        "query_ms": {
+            "mean": sum(latencies) / len(latencies) * 1000 if latencies else None,
+            "p50": _percentile(latencies, 50) * 1000 if latencies else None,
+            "p95": _percentile(latencies, 95) * 1000 if latencies else None,
+            "p99": _percentile(latencies, 99) * 1000 if latencies else None,
+        },
+        "quality": _quality(ranks, ks),
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def print_table(results: list, ks: tuple):
+    quality_keys = [f"recall@{k}" for k in ks] + [f"mrr@{max(ks)}"]
+    header = f"{'size':>9} {'index':<13}{'rebuild s':>10}{'reload s':>9}{'peak MB':>9}{'p50 ms':>8}{'p95 ms':>8}{'p99 ms':>8}"
+    print(header + "".join(f"{k:>10}" for k in quality_keys))
+    for r in results:
+        if "error" in r:
+            print(f"{r['size']:>9} {r['index']:<13}  failed: {r['error']}")
+            continue
+        q = r["query_ms"]
+        print(f"{r['size']:>9} {r['index']:<13}{r['rebuild_s']:>10.2f}{r['reload_s']:>9.2f}{r['peak_mb']:>9.1f}"
+              f"{q['p50']:>8.2f}{q['p95']:>8.2f}{q['p99']:>8.2f}" + "".join(f"{r['quality'][k]:>10.3f}" for k in quality_keys))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retrieval latency / memory / quality benchmark across KB sizes")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="逗号分隔的合成知识库规模")
+    parser.add_argument("--index", default=",".join(INDEX_TYPES), help=f"逗号分隔，可选 {', '.join(INDEX_TYPES)}")
+    parser.add_argument("--queries", default=None, help="真实标注集 (jsonl: query, title)，需配合 --kb")
+    parser.add_argument("--kb", default=None, help="使用已有的 walnut_kb.json 代替合成知识库")
+    parser.add_argument("--n-queries", type=int, default=300)
+    parser.add_argument("--code-ratio", type=float, default=0.7, help="合成查询中带错误码的比例")
+    parser.add_argument("--k", default="1,5,10", help="recall@k 的 k 列表")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--workdir", default=None, help="合成数据与临时索引的存放目录（默认临时目录）")
+    parser.add_argument("--output", default=None, help="结果 JSON 路径")
+    args = parser.parse_args()
+
+    ks = tuple(sorted(int(k) for k in args.k.split(",")))
+    index_types = [t for t in args.index.split(",") if t]
+    unknown = set(index_types) - set(INDEX_TYPES)
+    if unknown:
+        parser.error(f"unknown index type(s): {', '.join(sorted(unknown))}")
+    workdir = args.workdir or tempfile.mkdtemp(prefix="was-retrieval-")
+    os.makedirs(workdir, exist_ok=True)
+
+    datasets = []
+    if args.kb:
+        if not args.queries:
+            parser.error("--kb requires --queries")
+        with open(args.queries, encoding="utf-8") as f:
+            queries = [json.loads(line) for line in f if line.strip()]
+        from core.kb_io import iter_kb_entries
+        size = sum(1 for _ in iter_kb_entries(args.kb))
+        # 真实知识库没有关键词标注，只评估向量/混合索引
+        index_types = [t for t in index_types if t != "keyword"]
+        datasets.append((size, args.kb, None, queries))
+    else:
+        for size in (int(s) for s in args.sizes.split(",")):
+            start = time.perf_counter()
+            kb_path, keyword_path, queries = write_synthetic(size, workdir, args.n_queries, args.code_ratio, args.seed)
+            print(f"[bench] synthesized {size} entries in {time.perf_counter() - start:.1f}s -> {kb_path}", flush=True)
+            datasets.append((size, kb_path, keyword_path, queries))
+
+    results = []
+    # spawn：每个组合都在全新的解释器里运行，内存峰值互不干扰
+    context = multiprocessing.get_context("spawn")
+    for size, kb_path, keyword_path, queries in datasets:
+        for index_type in index_types:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                try:
+                    result = pool.submit(run_config, index_type, kb_path, keyword_path, queries, ks, workdir).result()
+                except Exception as e:
+                    result = {"index": index_type, "error": f"{type(e).__name__}: {e}"}
+            result = {"size": size, "queries": len(queries), **result}
+            results.append(result)
+            print(f"[bench] {size} {index_type}: done", flush=True)
+
+    report = {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "args": {k: v for k, v in vars(args).items() if k != "output"},
+        "results": results,
+    }
+    print()
+    print_table(results, ks)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nResults written to {args.output}")
+    else:
+        print(json.dumps(report, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+启动耗时基准：衡量 worker / CLI 冷启动的代价，并检查导入是否有副作用
+
+    python3 bench/startup_bench.py
+    python3 bench/startup_bench.py --modules core.server,infra.kb_engine --repeats 10 --output startup.json
+    python3 bench/startup_bench.py --no-service        # 只测导入
+
+- import：每次在全新的解释器、全新的空 WAS_HOME 里导入模块，记录导入耗时、进程总耗时、
+  导入后的线程数，以及导入期间在 WAS_HOME 下创建的文件（应为空：建库、建目录都推迟到 lifespan）
+- service：用 uvicorn 启动 core.server:app，记录从拉起进程到 /health 返回 200（可接收请求），
+  以及到 ready=true（存储已初始化、向量索引预热完成）的耗时
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MODULES = ("core.server", "core.vector_engine", "infra.kb_engine", "infra.intelligent_distiller")
+
+# 在子进程里执行：只计导入本身，解释器启动另算
+IMPORT_PROBE = """
+import importlib, json, sys, threading, time
+start = time.perf_counter()
+importlib.import_module(sys.argv[1])
+print(json.dumps({"import_s": time.perf_counter() - start, "modules": len(sys.modules),
+                  "threads": threading.active_count()}))
+"""
+
+
+def service_env(home: str) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "PYTHONPATH": ROOT + os.pathsep + env.get("PYTHONPATH", ""),
+        "WAS_HOME": home,
+        "KB_PATH": os.path.join(ROOT, "data", "walnut_kb.json"),
+        "KB_WATCH_INTERVAL": "0",
+    })
+    return env
+
+
+def created_files(home: str) -> list:
+    return sorted(os.path.relpath(os.path.join(dirpath, name), home)
+                  for dirpath, dirnames, filenames in os.walk(home) for name in filenames + dirnames)
+
+
+def measure_import(module: str) -> dict:
+    home = tempfile.mkdtemp(prefix="was-startup-")
+    try:
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable, "-c", IMPORT_PROBE, module], cwd=home, env=service_env(home),
+                              capture_output=True, text=True, timeout=120)
+        process_s = time.perf_counter() - start
+        if proc.returncode != 0:
+            raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "import failed")
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        result.update(process_s=process_s, created=created_files(home))
+        return result
+    finally:
+        shutil.rmtree(home, ignore_errors=True)
+
+
+def measure_service(port: int, vector_db: str = None, timeout: float = 60.0) -> dict:
+    home = tempfile.mkdtemp(prefix="was-startup-")
+    if vector_db and os.path.exists(vector_db):
+        os.makedirs(os.path.join(home, "data"))
+        shutil.copy(vector_db, os.path.join(home, "data", "vector_store.db"))
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "core.server:app", "--host", "127.0.0.1",
+                             "--port", str(port), "--log-level", "warning"],
+                            cwd=home, env=service_env(home), stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+    result = {"health_s": None, "ready_s": None}
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=2.0) as client:
+            deadline = start + timeout
+            while time.perf_counter() < deadline and proc.poll() is None:
+                try:
+                    r = client.get("/health")
+                except httpx.TransportError:
+                    time.sleep(0.01)
+                    continue
+                now = time.perf_counter() - start
+                if r.status_code == 200:
+                    result["health_s"] = result["health_s"] or now
+                    if r.json().get("ready"):
+                        result["ready_s"] = now
+                        break
+                time.sleep(0.01)
+        if result["ready_s"] is None:
+            raise RuntimeError(f"service did not become ready (exit code {proc.poll()})")
+        return result
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        shutil.rmtree(home, ignore_errors=True)
+
+
+def summarize(samples: list, keys: tuple) -> dict:
+    summary = {}
+    for key in keys:
+        values = [s[key] for s in samples]
+        summary[key] = {"median": statistics.median(values), "min": min(values), "max": max(values)}
+    return summary
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start import and service readiness benchmark")
+    parser.add_argument("--modules", default=",".join(DEFAULT_MODULES), help="逗号分隔的待测模块")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--port", type=int, default=18002, help="被测服务端口")
+    parser.add_argument("--vector-db", default=os.path.join(ROOT, "data", "vector_store.db"),
+                        help="复制到临时 WAS_HOME 的向量库，用于测量索引预热")
+    parser.add_argument("--no-service", action="store_true", help="跳过服务启动测量")
+    parser.add_argument("--output", default=None, help="结果 JSON 路径")
+    args = parser.parse_args()
+
+    imports = []
+    for module in (m for m in args.modules.split(",") if m):
+        samples = [measure_import(module) for _ in range(args.repeats)]
+        created = sorted({path for s in samples for path in s["created"]})
+        imports.append({"module": module, **summarize(samples, ("import_s", "process_s")),
+                        "modules": samples[-1]["modules"], "threads": samples[-1]["threads"], "created": created})
+        print(f"[bench] {module}: import {imports[-1]['import_s']['median'] * 1000:.0f} ms"
+              + (f", created {created}" if created else ""), flush=True)
+
+    service = None
+    if not args.no_service:
+        samples = [measure_service(args.port, args.vector_db) for _ in range(args.repeats)]
+        service = summarize(samples, ("health_s", "ready_s"))
+        print(f"[bench] service: healthy {service['health_s']['median']:.2f}s, "
+              f"ready {service['ready_s']['median']:.2f}s", flush=True)
+
+    report = {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "repeats": args.repeats,
+        "imports": imports,
+        "service": service,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nResults written to {args.output}")
+    else:
+        print(json.dumps(report, ensure_ascii=False))
+    # 导入产生副作用视为失败，便于在 CI 中把关
+    sys.exit(1 if any(item["created"] for item in imports) else 0)
+
+
+if __name__ == "__main__":
+    main()
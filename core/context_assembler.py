@@ -0,0 +1,124 @@
+import re
+from typing import List
+
+from core.text_utils import shingles
+
+# 中日韩文字及全角符号大致一字一个 token，其余字符按约 4 个字符一个 token 估算
+_WIDE = re.compile(r'[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\ufe30-\ufe4f\uff00-\uffef]')
+# 每条消息的角色标记、分隔符等固定开销
+MESSAGE_OVERHEAD = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """本地估算 token 数，不依赖分词器；对中文偏保守，用于预算控制足够"""
+    if not text:
+        return 0
+    wide = len(_WIDE.findall(text))
+    return wide + (len(text) - wide + 3) // 4
+
+
+def message_tokens(message: dict) -> int:
+    """单条 chat 消息的 token 估算；多模态内容只统计文本部分"""
+    content = message.get("content")
+    if isinstance(content, list):
+        text = "".join(part.get("text", "") for part in content if part.get("type") == "text")
+    else:
+        text = content or ""
+    return estimate_tokens(text) + MESSAGE_OVERHEAD
+
+
+def truncate_to_tokens(text: str, budget: int, ellipsis: str = "…") -> str:
+    """截断到不超过 budget 个 token（按 estimate_tokens 的口径）"""
+    if estimate_tokens(text) <= budget:
+        return text
+    budget -= estimate_tokens(ellipsis)
+    used = 0.0
+    for i, ch in enumerate(text):
+        used += 1 if _WIDE.match(ch) else 0.25
+        if used > budget:
+            return text[:i] + ellipsis
+    return text
+
+
+class ContextAssembler:
+    """
+    按 token 预算拼装 LLM 请求
+    - system：静态指令部分只格式化、估算一次，每次请求原样复用（前缀稳定也便于上游做前缀缓存）；
+      静态部分连同消息固定开销超出 system_budget 时构造即报错，不截断指令
+    - context：检索片段按相关度依次放入，与已选片段高度重叠的跳过，最后一段放不下时截断
+    - history：从最新一条往前保留，超出预算的最早消息被丢弃
+    """
+
+    def __init__(self, static_prompt: str, context_label: str = "【参考知识库片段】:\n",
+                 system_budget: int = 600, context_budget: int = 1200, history_budget: int = 1000,
+                 max_snippets: int = 2, overlap_threshold: float = 0.8, min_snippet_tokens: int = 48,
+                 separator: str = "\n---\n", empty_context: str = "NO_MATCH"):
+        self.prefix = static_prompt + context_label
+        # 片段之后的换行与 system 消息本身的固定开销同样计入静态部分
+        self.prefix_tokens = estimate_tokens(self.prefix) + estimate_tokens("\n") + MESSAGE_OVERHEAD
+        if self.prefix_tokens > system_budget:
+            raise ValueError(f"Static system prompt needs ~{self.prefix_tokens} tokens but system_budget is "
+                             f"{system_budget}; shorten the prompt or raise PROMPT_SYSTEM_TOKENS.")
+        self.system_budget = system_budget
+        self.context_budget = context_budget
+        self.history_budget = history_budget
+        self.max_snippets = max_snippets
+        self.overlap_threshold = overlap_threshold
+        self.min_snippet_tokens = min_snippet_tokens
+        self.separator = separator
+        self.empty_context = empty_context
+
+    def _overlaps(self, grams: set, selected: List[set]) -> bool:
+        """与任一已选片段的重叠系数 |A∩B| / min(|A|,|B|) 超过阈值即视为重复"""
+        for other in selected:
+            smaller = min(len(grams), len(other))
+            if smaller and len(grams & other) / smaller >= self.overlap_threshold:
+                return True
+        return False
+
+    def select_snippets(self, hits: List[str]) -> List[str]:
+        budget = self.context_budget
+        selected, selected_grams = [], []
+        separator_tokens = estimate_tokens(self.separator)
+        for hit in hits:
+            if len(selected) >= self.max_snippets:
+                break
+            grams = shingles(hit)
+            if not grams or self._overlaps(grams, selected_grams):
+                continue
+            cost = estimate_tokens(hit) + (separator_tokens if selected else 0)
+            if cost > budget:
+                remaining = budget - (separator_tokens if selected else 0)
+                if remaining >= self.min_snippet_tokens:
+                    selected.append(truncate_to_tokens(hit, remaining))
+                break
+            selected.append(hit)
+            selected_grams.append(grams)
+            budget -= cost
+        return selected
+
+    def system_prompt(self, hits: List[str]) -> str:
+        snippets = self.select_snippets(hits)
+        context = self.separator.join(snippets) if snippets else self.empty_context
+        return f"{self.prefix}{context}\n"
+
+    def trim_history(self, history: list) -> list:
+        budget = self.history_budget
+        kept = []
+        for message in reversed(history or []):
+            cost = message_tokens(message)
+            if cost > budget:
+                break
+            kept.append(message)
+            budget -= cost
+        kept.reverse()
+        # 不以孤立的助手回复开头，保证截断后仍是完整的问答轮次
+        while kept and kept[0].get("role") != "user":
+            kept.pop(0)
+        return kept
+
+    def build_messages(self, user_content, hits: List[str], history: list = None) -> list:
+        messages = [{"role": "system", "content": self.system_prompt(hits)}]
+        messages.extend(self.trim_history(history))
+        messages.append({"role": "user", "content": user_content})
+        return messages
@@ -0,0 +1,157 @@
+import hashlib
+import re
+import sqlite3
+import zlib
+from collections import Counter
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from core.logger import logger
+from core.settings import get_settings
+
+
+def content_hash(text: str) -> str:
+    """稳定的内容指纹（不受 PYTHONHASHSEED 影响），用作 Embedding 缓存键"""
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class EmbeddingBackend:
+    """Embedding 后端接口：encode 产出原始向量，fit 根据语料统计给出逐维权重"""
+    name = "base"
+    dim = 0
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        raise NotImplementedError
+
+    def fit(self, matrix: np.ndarray) -> Optional[np.ndarray]:
+        """默认不做语料级加权"""
+        return None
+
+
+class HashingNgramEmbedder(EmbeddingBackend):
+    """
+    纯 CPU、离线可用的默认后端：字符 n-gram 哈希 + TF-IDF 加权
+    中文不分词，直接按字符切 n-gram，对"黑屏""白平衡"这类短语足够稳健
+    """
+
+    def __init__(self, dim: int = 1024, ngram_range: tuple = (1, 2)):
+        self.dim = dim
+        self.ngram_range = ngram_range
+        self.name = f"hash-ngram-{dim}-{ngram_range[0]}{ngram_range[1]}"
+
+    def _buckets(self, text: str) -> Counter:
+        text = re.sub(r'\s+', ' ', text.lower()).strip()
+        counts = Counter()
+        lo, hi = self.ngram_range
+        for n in range(lo, hi + 1):
+            for i in range(len(text) - n + 1):
+                gram = text[i:i + n]
+                if gram.isspace():
+                    continue
+                counts[zlib.crc32(gram.encode('utf-8')) % self.dim] += 1
+        return counts
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            counts = self._buckets(text)
+            if counts:
+                cols = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+                vals = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+                matrix[row, cols] = np.log1p(vals)  # 次线性 TF
+        return matrix
+
+    def fit(self, matrix: np.ndarray) -> Optional[np.ndarray]:
+        """平滑 IDF：文档频率直接由原始 TF 矩阵的非零列统计得到"""
+        n_docs = matrix.shape[0]
+        # 分块统计，避免一次性生成与矩阵同形的布尔数组
+        df = np.zeros(matrix.shape[1], dtype=np.int64)
+        for start in range(0, n_docs, 65536):
+            df += np.count_nonzero(matrix[start:start + 65536], axis=0)
+        return (np.log((1 + n_docs) / (1 + df)) + 1).astype(np.float32)
+
+
+BACKENDS = {
+    "hashing": HashingNgramEmbedder,
+}
+
+
+def register_backend(name: str, factory):
+    """注册自定义后端（如接入本地句向量模型），通过 WAS_EMBEDDING_BACKEND 选用"""
+    BACKENDS[name] = factory
+
+
+def get_backend(name: str = None) -> EmbeddingBackend:
+    name = name or get_settings().embedding_backend
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend: {name}")
+    return BACKENDS[name]()
+
+
+class EmbeddingCache:
+    """按 (内容哈希, 模型名) 持久化的 Embedding 缓存，未变化的 SOP 不会被重复编码"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('''CREATE TABLE IF NOT EXISTS embedding_cache
+                        (content_hash TEXT, model TEXT, vector BLOB,
+                         PRIMARY KEY (content_hash, model))''')
+        conn.commit()
+        conn.close()
+
+    def get_many(self, hashes: List[str], model: str, conn: sqlite3.Connection = None) -> Dict[str, np.ndarray]:
+        """conn 可传入调用方的事务连接，使缓存读写与索引更新在同一事务内完成"""
+        found = {}
+        own_conn = conn is None
+        if own_conn:
+            conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        # 分批查询，避免超过 SQLite 的变量个数上限
+        for start in range(0, len(hashes), 500):
+            chunk = hashes[start:start + 500]
+            marks = ",".join("?" * len(chunk))
+            cursor.execute(f"SELECT content_hash, vector FROM embedding_cache WHERE model = ? AND content_hash IN ({marks})",
+                           (model, *chunk))
+            for h, blob in cursor.fetchall():
+                found[h] = np.frombuffer(blob, dtype=np.float32)
+        if own_conn:
+            conn.close()
+        return found
+
+    def put_many(self, items: Dict[str, np.ndarray], model: str, conn: sqlite3.Connection = None):
+        if not items:
+            return
+        own_conn = conn is None
+        if own_conn:
+            conn = sqlite3.connect(self.db_path)
+        conn.executemany("INSERT OR REPLACE INTO embedding_cache (content_hash, model, vector) VALUES (?, ?, ?)",
+                         [(h, model, vec.astype(np.float32).tobytes()) for h, vec in items.items()])
+        if own_conn:
+            conn.commit()
+            conn.close()
+
+
+def encode_with_cache(backend: EmbeddingBackend, cache: EmbeddingCache, texts: List[str],
+                      batch_size: int = 256, conn: sqlite3.Connection = None) -> np.ndarray:
+    """批量编码：先查缓存，只对缓存未命中的文本分批调用后端"""
+    hashes = [content_hash(t) for t in texts]
+    cached = cache.get_many(list(set(hashes)), backend.name, conn=conn)
+
+    missing = {}
+    for h, t in zip(hashes, texts):
+        if h not in cached and h not in missing:
+            missing[h] = t
+    pending = list(missing.items())
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start:start + batch_size]
+        vectors = backend.encode([t for _, t in batch])
+        fresh = {h: vectors[i] for i, (h, _) in enumerate(batch)}
+        cache.put_many(fresh, backend.name, conn=conn)
+        cached.update(fresh)
+    logger.info(f"[Embedding] {backend.name}: {len(texts) - len(pending)}/{len(texts)} cache hits, {len(pending)} encoded.")
+
+    if not texts:
+        return np.zeros((0, backend.dim), dtype=np.float32)
+    return np.vstack([cached[h] for h in hashes]).astype(np.float32)
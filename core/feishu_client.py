@@ -0,0 +1,225 @@
+import asyncio
+import json
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from core.logger import logger
+from core.metrics import STAGE_SECONDS, ERRORS
+from core.settings import get_settings
+from core.lazy import Lazy
+
+# access_token 无效/过期时飞书返回的业务错误码
+TOKEN_INVALID_CODES = {99991661, 99991663, 99991668}
+
+
+class DeliveryError(RuntimeError):
+    """消息未送达或资源未下载（拿不到 token、限流重试耗尽、飞书 5xx 或网络错误），稍后重试可能成功"""
+
+
+class ResourceError(RuntimeError):
+    """消息资源无法下载（不存在、无权限或超过大小上限），重试也不会成功"""
+
+
+class FeishuClient:
+    """
+    飞书开放平台客户端
+    - tenant_access_token 内存缓存，到期前 refresh_margin 秒才刷新
+    - 刷新单飞：并发请求中只有一个线程真正去换 token，其余等待复用结果
+    - 连接池复用 HTTP 会话；429 按限流重置时间退避重试
+    """
+
+    def __init__(self, app_id: str = None, app_secret: str = None, base_url: str = None,
+                 refresh_margin: int = 300, max_retries: int = 3, pool_size: int = 20, timeout: float = 10):
+        settings = get_settings()
+        self.app_id = app_id or settings.feishu_app_id
+        self.app_secret = app_secret or settings.feishu_app_secret
+        self.base_url = (base_url or settings.feishu_base_url).rstrip('/')
+        self.refresh_margin = refresh_margin
+        self.max_retries = max_retries
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._token = None
+        self._expires_at = 0.0
+        self._token_lock = threading.Lock()
+
+    def get_tenant_access_token(self):
+        token = self._token
+        if token and time.time() < self._expires_at:
+            return token
+        with self._token_lock:
+            # 双重检查：等锁期间可能已被其它线程刷新
+            if self._token and time.time() < self._expires_at:
+                return self._token
+            url = f'{self.base_url}/open-apis/auth/v3/tenant_access_token/internal'
+            payload = {'app_id': self.app_id, 'app_secret': self.app_secret}
+            try:
+                data = self.session.post(url, json=payload, timeout=self.timeout).json()
+            except Exception as e:
+                logger.error(f'[FEISHU] Token Error: {e}')
+                return None
+            token = data.get('tenant_access_token')
+            if not token:
+                logger.error(f"[FEISHU] Token Error: {data.get('code')} - {data.get('msg')}")
+                return None
+            self._token = token
+            self._expires_at = time.time() + max(int(data.get('expire', 7200)) - self.refresh_margin, 0)
+            return token
+
+    def invalidate_token(self, token: str):
+        """仅当缓存的仍是这个失效 token 时才清除，避免把别人刚刷新的新 token 清掉"""
+        with self._token_lock:
+            if self._token == token:
+                self._token = None
+                self._expires_at = 0.0
+
+    def _retry_delay(self, response: requests.Response, attempt: int) -> float:
+        reset = response.headers.get('x-ogw-ratelimit-reset') or response.headers.get('Retry-After')
+        try:
+            return min(float(reset), 30.0)
+        except (TypeError, ValueError):
+            return random.uniform(0, min(8.0, 0.5 * (2 ** attempt)))
+
+    def request(self, method: str, path: str, headers: dict = None, **kwargs):
+        """带鉴权、限流重试与 token 失效重取的请求；拿不到 token 时返回 None"""
+        kwargs.setdefault('timeout', self.timeout)
+        response = None
+        for attempt in range(self.max_retries + 1):
+            token = self.get_tenant_access_token()
+            if not token:
+                return None
+            response = self.session.request(method, f'{self.base_url}{path}',
+                                            headers={'Authorization': f'Bearer {token}', **(headers or {})}, **kwargs)
+            if response.status_code == 429 and attempt < self.max_retries:
+                # stream=True 时响应体尚未读取，先关闭把连接还给连接池
+                response.close()
+                delay = self._retry_delay(response, attempt)
+                logger.warning(f'[FEISHU] Rate limited on {path}, retrying in {delay:.2f}s')
+                time.sleep(delay)
+                continue
+            if self._token_invalid(response):
+                logger.warning('[FEISHU] Tenant token rejected, refreshing.')
+                self.invalidate_token(token)
+                continue
+            return response
+        return response
+
+    def _token_invalid(self, response: requests.Response) -> bool:
+        if response.status_code not in (400, 401):
+            return False
+        try:
+            return response.json().get('code') in TOKEN_INVALID_CODES
+        except ValueError:
+            return False
+
+    def send_text(self, receive_id: str, content: str, receive_id_type: str = 'open_id'):
+        payload = {'receive_id': receive_id, 'msg_type': 'text', 'content': json.dumps({'text': content})}
+        with STAGE_SECONDS.time(stage='feishu_send'):
+            r = self.request('POST', f'/open-apis/im/v1/messages?receive_id_type={receive_id_type}', json=payload)
+        if r is None or r.status_code != 200:
+            ERRORS.inc(component='feishu')
+        if r is not None and r.status_code != 200:
+            logger.error(f'[FEISHU] Send Failed: {r.status_code} - {r.text}')
+        return r
+
+    def update_text(self, message_id: str, content: str):
+        """编辑已发送的文本消息（飞书限制单条消息最多编辑 20 次）"""
+        payload = {'msg_type': 'text', 'content': json.dumps({'text': content})}
+        with STAGE_SECONDS.time(stage='feishu_update'):
+            r = self.request('PUT', f'/open-apis/im/v1/messages/{message_id}', json=payload)
+        if r is None or r.status_code != 200:
+            ERRORS.inc(component='feishu')
+        if r is not None and r.status_code != 200:
+            logger.error(f'[FEISHU] Update Failed: {r.status_code} - {r.text}')
+        return r
+
+    def get_message_resource(self, message_id: str, file_key: str, resource_type: str = 'image',
+                             max_bytes: int = 20 * 1024 * 1024) -> bytes:
+        """
+        流式下载消息中的图片/文件资源
+        暂时性故障抛出 DeliveryError，交给任务队列重试；其它错误状态或超过 max_bytes 抛出 ResourceError
+        """
+        path = f'/open-apis/im/v1/messages/{message_id}/resources/{file_key}?type={resource_type}'
+        try:
+            r = self.request('GET', path, timeout=15, stream=True)
+            if r is None:
+                raise DeliveryError(f"Resource {file_key} not downloaded: no token")
+            with r:
+                if r.status_code == 429 or r.status_code >= 500:
+                    raise DeliveryError(f"Resource {file_key} not downloaded: {r.status_code}")
+                if r.status_code != 200:
+                    raise ResourceError(f"Resource {file_key} not downloaded: {r.status_code} - {r.text}")
+                buf = bytearray()
+                for chunk in r.iter_content(chunk_size=64 * 1024):
+                    buf.extend(chunk)
+                    if len(buf) > max_bytes:
+                        raise ResourceError(f"Resource {file_key} exceeds {max_bytes} bytes, aborted")
+                return bytes(buf)
+        except (DeliveryError, ResourceError, requests.RequestException) as e:
+            ERRORS.inc(component='feishu')
+            logger.error(f"[FEISHU] Image Download Failed: {e}")
+            if isinstance(e, requests.RequestException):
+                raise DeliveryError(f"Resource {file_key} not downloaded: {e}") from e
+            raise
+
+
+class StreamingTextMessage:
+    """
+    把逐段到达的 LLM 输出推送成一条"先发送、再批量编辑"的飞书消息
+    首段内容到达即发出消息，之后至少间隔 interval 秒才编辑一次，
+    并为最终全文预留一次编辑机会
+    """
+
+    def __init__(self, client: FeishuClient, receive_id: str, interval: float = 0.8, max_edits: int = 20,
+                 cursor: str = " ▌"):
+        self.client = client
+        self.receive_id = receive_id
+        self.interval = interval
+        self.max_edits = max_edits
+        self.cursor = cursor
+        self.text = ""
+        self.message_id = None
+        self._edits = 0
+        self._sent_text = None
+        self._last_push = 0.0
+
+    async def feed(self, piece: str):
+        self.text += piece
+        now = time.monotonic()
+        if self.message_id is None:
+            await self._push(self.text + self.cursor)
+        elif now - self._last_push >= self.interval and self._edits < self.max_edits - 1:
+            await self._push(self.text + self.cursor)
+
+    async def finish(self, final_text: str = None):
+        if final_text is not None:
+            self.text = final_text
+        if self.text and self.text != self._sent_text:
+            await self._push(self.text)
+
+    async def _push(self, content: str):
+        self._last_push = time.monotonic()
+        if self.message_id is None:
+            r = await asyncio.to_thread(self.client.send_text, self.receive_id, content)
+            try:
+                self.message_id = r.json().get('data', {}).get('message_id') if r is not None else None
+            except ValueError:
+                self.message_id = None
+            if self.message_id is None:
+                raise DeliveryError("Feishu did not return a message_id for the streaming reply")
+        else:
+            await asyncio.to_thread(self.client.update_text, self.message_id, content)
+            self._edits += 1
+        self._sent_text = content
+
+
+# 单例
+feishu_client = Lazy(FeishuClient, "feishu_client")
@@ -0,0 +1,90 @@
+import threading
+from contextlib import contextmanager
+from typing import Callable, Generic, Optional, TypeVar
+
+from core.logger import logger
+
+T = TypeVar('T')
+
+
+class HotSwap(Generic[T]):
+    """
+    双缓冲的只读对象持有者：新版本在旁路构建好后调用 swap 原子替换，
+    之后的查询立即读到新版本；进行中的查询通过 lease 持有旧版本直到结束
+    每个版本有独立的引用计数，旧版本的最后一个读者退出后才会被释放（触发 on_retire）
+    """
+
+    def __init__(self, name: str, on_retire: Callable[[T, int], None] = None):
+        self.name = name
+        self._on_retire = on_retire
+        self._lock = threading.Lock()
+        self._value: Optional[T] = None
+        self._generation = 0
+        # generation -> [value, 引用计数]；只包含仍被引用的版本（含当前版本）
+        self._slots = {}
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def current(self) -> Optional[T]:
+        """不计引用地读取当前版本，适合一次性读取后不再依赖该对象的场景"""
+        return self._value
+
+    @contextmanager
+    def lease(self):
+        """在 with 块内持有当前版本；块内即使发生 swap，读到的仍是同一个版本"""
+        with self._lock:
+            generation = self._generation
+            slot = self._slots.get(generation)
+            if slot is not None:
+                slot[1] += 1
+        try:
+            yield slot[0] if slot is not None else None
+        finally:
+            if slot is not None:
+                self._release(generation, slot)
+
+    def _release(self, generation: int, slot: list):
+        retired = None
+        with self._lock:
+            slot[1] -= 1
+            if slot[1] == 0 and generation != self._generation:
+                retired = self._slots.pop(generation)[0]
+        if retired is not None:
+            self._retire(retired, generation)
+
+    def swap(self, value: T) -> int:
+        """替换为新版本并返回新的代号；旧版本没有读者时立即释放，否则等最后一个读者退出"""
+        retired = None
+        with self._lock:
+            old_generation = self._generation
+            self._generation += 1
+            self._value = value
+            # 当前版本自身占一个引用，被替换时归还
+            self._slots[self._generation] = [value, 1]
+            old = self._slots.get(old_generation)
+            if old is not None:
+                old[1] -= 1
+                if old[1] == 0:
+                    retired = self._slots.pop(old_generation)[0]
+            generation = self._generation
+        if retired is not None:
+            self._retire(retired, old_generation)
+        return generation
+
+    def _retire(self, value: T, generation: int):
+        logger.info(f"[HOTSWAP] {self.name} generation {generation} drained and released.")
+        if self._on_retire:
+            self._on_retire(value, generation)
+
+    def stats(self) -> dict:
+        """当前代号，以及仍有进行中查询的旧版本各自的读者数"""
+        with self._lock:
+            draining = {g: refs for g, (_, refs) in self._slots.items() if g != self._generation}
+            active = self._slots.get(self._generation)
+        return {
+            "generation": self._generation,
+            "active_leases": active[1] - 1 if active else 0,
+            "draining": draining,
+        }
@@ -0,0 +1,92 @@
+import os
+import sqlite3
+import threading
+import time
+from cachetools import LRUCache
+from core.logger import logger
+from core.settings import get_settings
+from core.lazy import Lazy
+
+class EventDeduplicator:
+    """
+    飞书事件幂等层
+    飞书在 ack 超时后会重投同一事件；先查进程内 LRU，再查 SQLite 持久表，
+    使去重在重启后和多 worker 之间依然有效
+    """
+    def __init__(self, db_path: str = None, ttl: int = 24 * 3600,
+                 cache_size: int = 10000, purge_interval: int = 600):
+        self.db_path = db_path or get_settings().session_db_path
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self._recent = LRUCache(maxsize=cache_size)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._last_purge = 0.0
+        self._init_db()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        cursor = self._conn().cursor()
+        cursor.execute('''CREATE TABLE IF NOT EXISTS processed_events
+                         (event_key TEXT PRIMARY KEY, created_at REAL)''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_processed_events_created_at ON processed_events (created_at)")
+
+    def check_and_mark(self, *keys) -> bool:
+        """任一 key 已处理过则返回 False（重复事件），否则记录全部 key 并返回 True"""
+        keys = [k for k in keys if k]
+        if not keys:
+            return True
+        now = time.time()
+        with self._lock:
+            if any(self._recent.get(k, 0) >= now - self.ttl for k in keys):
+                return False
+
+            cursor = self._conn().cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                marks = ",".join("?" * len(keys))
+                cursor.execute(f"SELECT 1 FROM processed_events WHERE event_key IN ({marks}) AND created_at >= ? LIMIT 1",
+                               (*keys, now - self.ttl))
+                duplicate = cursor.fetchone() is not None
+                if not duplicate:
+                    cursor.executemany("INSERT OR REPLACE INTO processed_events (event_key, created_at) VALUES (?, ?)",
+                                       [(k, now) for k in keys])
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+
+            for k in keys:
+                self._recent.setdefault(k, now)
+            if now - self._last_purge > self.purge_interval:
+                self._purge(now)
+            return not duplicate
+
+    def forget(self, *keys):
+        """撤销标记（如任务未能入队），让飞书的重投可以被再次处理"""
+        keys = [k for k in keys if k]
+        with self._lock:
+            for k in keys:
+                self._recent.pop(k, None)
+            self._conn().executemany("DELETE FROM processed_events WHERE event_key = ?", [(k,) for k in keys])
+
+    def _purge(self, now: float):
+        self._last_purge = now
+        try:
+            cursor = self._conn().cursor()
+            cursor.execute("DELETE FROM processed_events WHERE created_at < ?", (now - self.ttl,))
+            if cursor.rowcount:
+                logger.info(f"[DEDUP] Purged {cursor.rowcount} expired event keys.")
+        except sqlite3.Error as e:
+            logger.error(f"[DEDUP] Purge failed: {e}")
+
+# 单例
+event_deduplicator = Lazy(EventDeduplicator, "event_deduplicator")
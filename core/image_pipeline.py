@@ -0,0 +1,89 @@
+import base64
+import hashlib
+import io
+import threading
+from typing import NamedTuple, Optional
+
+from cachetools import TTLCache
+from PIL import Image
+
+from core.logger import logger
+from core.metrics import CACHE_REQUESTS
+
+
+class PreparedImage(NamedTuple):
+    base64: str   # 压缩后 JPEG 的 Base64，直接用于 data URL
+    digest: str   # 原始图片字节的 sha256，作为视觉结果缓存键
+    size: int     # 压缩后字节数
+
+
+def screenshot_digest(raw: bytes) -> str:
+    """原始图片字节的 sha256：在解码之前就能查视觉结果缓存，命中时不必再缩放重压缩"""
+    return hashlib.sha256(raw).hexdigest()
+
+
+def _prepared(data: bytes, digest: str) -> PreparedImage:
+    return PreparedImage(base64.b64encode(data).decode('ascii'), digest, len(data))
+
+
+def prepare_image(raw: bytes, max_side: int = 1280, max_bytes: int = 400 * 1024) -> Optional[PreparedImage]:
+    """
+    截图预处理：限制最长边与字节预算后重新压缩为 JPEG
+    报错弹窗的文字在 1280px 下仍清晰可读，体积通常只有原图的几分之一
+    """
+    digest = screenshot_digest(raw)
+    try:
+        img = Image.open(io.BytesIO(raw))
+        img.draft('RGB', (max_side, max_side))  # JPEG 可在解码阶段直接降采样
+        img.load()
+    except Exception as e:
+        logger.error(f"[IMAGE] Failed to decode screenshot: {e}")
+        return None
+
+    if img.mode in ('RGBA', 'LA', 'P'):
+        img = img.convert('RGBA')
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel('A'))
+        img = background
+    elif img.mode != 'RGB':
+        img = img.convert('RGB')
+
+    img.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+
+    data = b""
+    for _ in range(4):
+        for quality in (85, 70, 55):
+            buf = io.BytesIO()
+            img.save(buf, format='JPEG', quality=quality, optimize=True)
+            data = buf.getvalue()
+            if len(data) <= max_bytes:
+                return _prepared(data, digest)
+        # 降低质量仍超预算时继续缩小分辨率
+        img = img.resize((max(1, img.width * 3 // 4), max(1, img.height * 3 // 4)), Image.Resampling.LANCZOS)
+    return _prepared(data, digest)
+
+
+class VisionResultCache:
+    """
+    原始截图字节摘要 -> 视觉分析结果的 TTL 缓存，老师反复发送同一张报错截图时直接复用上次结果
+    只做精确匹配，不复用近似截图：布局相同、报错文字不同的弹窗在低分辨率感知哈希下会碰撞，
+    复用结果会把别的错误的诊断发给老师；代价是重新截取的同一个弹窗（字节不同）不会命中
+    """
+
+    def __init__(self, maxsize: int = 512, ttl: int = 6 * 3600):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def get(self, digest: str) -> Optional[str]:
+        with self._lock:
+            reply = self._cache.get(digest)
+        CACHE_REQUESTS.inc(cache="vision", result="miss" if reply is None else "hit")
+        return reply
+
+    def put(self, digest: str, reply: str):
+        with self._lock:
+            self._cache[digest] = reply
+
+
+# 单例
+vision_cache = VisionResultCache()
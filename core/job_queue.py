@@ -0,0 +1,245 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from core.logger import logger
+from core.settings import get_settings
+
+class QueueFull(Exception):
+    pass
+
+# 正在执行的任务的 (第几次尝试, 最多尝试次数)；asyncio.to_thread 会把它一并带进线程池
+_attempt: ContextVar = ContextVar("job_attempt", default=None)
+
+def final_attempt() -> bool:
+    """当前任务失败后是否不会再被重试；不在任务内执行时视为最后一次"""
+    attempt = _attempt.get()
+    return attempt is None or attempt[0] >= attempt[1]
+
+class JobQueue:
+    """
+    基于 SQLite 的持久化任务队列 + 异步 worker 池，取代 FastAPI BackgroundTasks
+    - 任务落库后才返回，进程重启不丢任务
+    - 领取任务时设置可见性超时 (lease)，worker 崩溃后租约到期的任务会被重新领取
+    - max_depth 限制排队长度，超出时 enqueue 抛 QueueFull，由入口做降级/背压
+    同步处理函数放到线程池执行，协程处理函数直接在事件循环上 await
+    构造时不读配置也不建表，各模块导入时即可 register；首次入队或 start() 时才初始化数据库
+    """
+    def __init__(self, db_path: str = None, workers: int = None, max_depth: int = None,
+                 visibility_timeout: float = 300, poll_interval: float = 1.0, retain_seconds: int = 24 * 3600):
+        self.db_path = db_path
+        self.workers = workers
+        self.max_depth = max_depth
+        self.visibility_timeout = visibility_timeout
+        self.poll_interval = poll_interval
+        self.retain_seconds = retain_seconds
+        self.handlers = {}
+        self._local = threading.local()
+        self._tasks = []
+        self._wakeup = None
+        self._loop = None
+        self._waits = deque(maxlen=1000)   # 最近任务的排队等待时间 (秒)
+        self._processed = {"done": 0, "failed": 0, "retried": 0}
+        self._last_purge = 0.0
+        self._setup_lock = threading.Lock()
+        self._ready = False
+
+    def _setup(self):
+        """解析未显式传入的参数并建表，只执行一次"""
+        if self._ready:
+            return
+        with self._setup_lock:
+            if self._ready:
+                return
+            settings = get_settings()
+            self.db_path = self.db_path or settings.job_db_path
+            self.workers = self.workers or settings.workers
+            self.max_depth = self.max_depth or settings.job_queue_max_depth
+            self._init_db()
+            self._ready = True
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            self._setup()
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def _init_db(self):
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        conn = self._connect()
+        cursor = conn.cursor()
+        cursor.execute('''CREATE TABLE IF NOT EXISTS jobs
+                         (id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, payload TEXT NOT NULL,
+                          status TEXT NOT NULL DEFAULT 'queued', attempts INTEGER NOT NULL DEFAULT 0,
+                          max_attempts INTEGER NOT NULL DEFAULT 3, enqueued_at REAL NOT NULL,
+                          available_at REAL NOT NULL, started_at REAL, finished_at REAL,
+                          lease_until REAL, last_error TEXT)''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_available ON jobs (status, available_at)")
+        conn.close()
+
+    def register(self, kind: str, handler):
+        """注册任务处理函数，payload 以关键字参数传入"""
+        self.handlers[kind] = handler
+
+    def enqueue(self, kind: str, payload: dict, max_attempts: int = 3, delay: float = 0) -> int:
+        """计数与插入在同一个写事务内完成，并发入队（含其它 worker 进程）也不会超过 max_depth"""
+        cursor = self._conn().cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            cursor.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'")
+            if cursor.fetchone()[0] >= self.max_depth:
+                raise QueueFull(f"job queue depth reached {self.max_depth}")
+            now = time.time()
+            cursor.execute("INSERT INTO jobs (kind, payload, max_attempts, enqueued_at, available_at) VALUES (?, ?, ?, ?, ?)",
+                           (kind, json.dumps(payload, ensure_ascii=False), max_attempts, now, now + delay))
+            job_id = cursor.lastrowid
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+        self._notify()
+        return job_id
+
+    def _notify(self):
+        if self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _claim(self):
+        now = time.time()
+        cursor = self._conn().cursor()
+        cursor.execute('''UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ?, lease_until = ?
+                          WHERE id = (SELECT id FROM jobs
+                                      WHERE (status = 'queued' AND available_at <= ?)
+                                         OR (status = 'running' AND lease_until < ?)
+                                      ORDER BY available_at, id LIMIT 1)
+                          RETURNING id, kind, payload, attempts, max_attempts, enqueued_at''',
+                       (now, now + self.visibility_timeout, now, now))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        job_id, kind, payload, attempts, max_attempts, enqueued_at = row
+        if attempts > max_attempts:
+            # 反复因租约过期被回收（例如每次都把 worker 拖垮），不再重试
+            self._finish(job_id, "failed", "lease expired too many times")
+            return None
+        self._waits.append(now - enqueued_at)
+        return job_id, kind, json.loads(payload), attempts, max_attempts
+
+    def _finish(self, job_id: int, status: str, error: str = None):
+        self._conn().execute("UPDATE jobs SET status = ?, finished_at = ?, lease_until = NULL, last_error = ? WHERE id = ?",
+                             (status, time.time(), error, job_id))
+        self._processed[status] += 1
+
+    def _retry(self, job_id: int, attempts: int, error: str):
+        backoff = min(60, 2 ** attempts)
+        self._conn().execute("UPDATE jobs SET status = 'queued', available_at = ?, lease_until = NULL, last_error = ? WHERE id = ?",
+                             (time.time() + backoff, error, job_id))
+        self._processed["retried"] += 1
+
+    def _extend_lease(self, job_id: int):
+        self._conn().execute("UPDATE jobs SET lease_until = ? WHERE id = ? AND status = 'running'",
+                             (time.time() + self.visibility_timeout, job_id))
+
+    def _purge(self):
+        now = time.time()
+        if now - self._last_purge < 600:
+            return
+        self._last_purge = now
+        self._conn().execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+                             (now - self.retain_seconds,))
+
+    async def _heartbeat(self, job_id: int):
+        while True:
+            await asyncio.sleep(self.visibility_timeout / 3)
+            await asyncio.to_thread(self._extend_lease, job_id)
+
+    async def _run(self, job):
+        job_id, kind, payload, attempts, max_attempts = job
+        handler = self.handlers.get(kind)
+        heartbeat = asyncio.create_task(self._heartbeat(job_id))
+        token = _attempt.set((attempts, max_attempts))
+        try:
+            if handler is None:
+                raise RuntimeError(f"no handler registered for job kind '{kind}'")
+            if asyncio.iscoroutinefunction(handler):
+                await handler(**payload)
+            else:
+                await asyncio.to_thread(handler, **payload)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if attempts < max_attempts:
+                logger.warning(f"[QUEUE] Job {job_id} ({kind}) failed on attempt {attempts}/{max_attempts}: {error}")
+                await asyncio.to_thread(self._retry, job_id, attempts, error)
+            else:
+                logger.error(f"[QUEUE] Job {job_id} ({kind}) failed permanently: {error}")
+                await asyncio.to_thread(self._finish, job_id, "failed", error)
+        else:
+            await asyncio.to_thread(self._finish, job_id, "done")
+        finally:
+            _attempt.reset(token)
+            heartbeat.cancel()
+
+    async def _worker(self, index: int):
+        while True:
+            try:
+                job = await asyncio.to_thread(self._claim)
+            except Exception as e:
+                logger.error(f"[QUEUE] Worker {index} failed to claim a job: {e}")
+                job = None
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    await asyncio.to_thread(self._purge)
+                continue
+            await self._run(job)
+
+    async def start(self):
+        if self._tasks:
+            return
+        await asyncio.to_thread(self._setup)
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        logger.info(f"[QUEUE] Started {self.workers} workers on {self.db_path}.")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._loop = None
+
+    def stats(self) -> dict:
+        """队列深度、排队等待时间等指标"""
+        now = time.time()
+        cursor = self._conn().cursor()
+        cursor.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status")
+        depth = {status: count for status, count in cursor.fetchall()}
+        cursor.execute("SELECT MIN(enqueued_at) FROM jobs WHERE status = 'queued'")
+        oldest = cursor.fetchone()[0]
+        waits = sorted(self._waits)
+        return {
+            "workers": self.workers,
+            "queued": depth.get("queued", 0),
+            "running": depth.get("running", 0),
+            "oldest_queued_age": round(now - oldest, 3) if oldest else 0.0,
+            "wait_avg": round(sum(waits) / len(waits), 3) if waits else 0.0,
+            "wait_p95": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 3) if waits else 0.0,
+            "processed": dict(self._processed),
+        }
+
+# 单例
+job_queue = JobQueue()
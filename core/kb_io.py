@@ -0,0 +1,96 @@
+import json
+import os
+import textwrap
+
+
+def iter_kb_entries(path: str, chunk_size: int = 1 << 16):
+    """
+    流式解析 walnut_kb.json（顶层为 JSON 数组），逐条产出条目
+    内存占用只与单个条目大小相关，而不是整个知识库
+    """
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buf, pos = "", 0
+        started, eof = False, False
+        while True:
+            # 缓冲区见底时补充数据，同时丢弃已消费的部分
+            if not eof and len(buf) - pos < chunk_size:
+                chunk = f.read(chunk_size)
+                if chunk:
+                    buf, pos = buf[pos:] + chunk, 0
+                else:
+                    eof = True
+
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos >= len(buf):
+                if eof:
+                    if started:
+                        raise ValueError(f"Unterminated JSON array in {path}")
+                    return
+                continue
+
+            if not started:
+                if buf[pos] != "[":
+                    raise ValueError(f"KB file {path} must be a JSON array")
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == "]":
+                return
+
+            try:
+                obj, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # 条目跨越了缓冲区边界，继续读入后重试
+                chunk = f.read(chunk_size)
+                if chunk:
+                    buf, pos = buf[pos:] + chunk, 0
+                else:
+                    eof = True
+                continue
+            yield obj
+            pos = end
+
+
+class KBWriter:
+    """
+    增量写出 walnut_kb.json：逐条追加到同目录下的临时文件，关闭时原子替换目标文件
+    写出过程中读取方看到的始终是上一版完整的知识库
+    """
+
+    def __init__(self, path: str, indent: int = 2):
+        self.path = path
+        self.indent = indent
+        self.count = 0
+        self._tmp_path = f"{path}.tmp"
+        self._f = None
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._f = open(self._tmp_path, 'w', encoding='utf-8')
+        self._f.write("[")
+        return self
+
+    def write(self, entry: dict):
+        text = json.dumps(entry, ensure_ascii=False, indent=self.indent)
+        if self.indent:
+            text = "\n" + textwrap.indent(text, " " * self.indent)
+        self._f.write(("," if self.count else "") + text)
+        self.count += 1
+
+    def write_many(self, entries):
+        for entry in entries:
+            self.write(entry)
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self._f.close()
+            os.remove(self._tmp_path)
+            return False
+        self._f.write("\n]" if self.count and self.indent else "]")
+        self._f.close()
+        os.replace(self._tmp_path, self.path)
+        return False
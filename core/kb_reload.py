@@ -0,0 +1,254 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from typing import Dict, Optional, Tuple
+
+from core.logger import logger
+from core.metrics import STAGE_SECONDS, ERRORS
+from core.settings import get_settings
+
+MARKER_KEY = "kb_reload"
+CLAIM_KEY = "kb_reload_claim"
+
+
+class KBReloader:
+    """
+    知识库热更新协调器
+    - 注册的每个索引对象需提供 reload()（旁路构建后原子切换，返回新代号）和 generation 属性；
+      可选的 refresh() 只从已同步好的库里重新加载，供其它 worker 跟进时使用，缺省时退回 reload()
+    - reload 在线程池里串行执行，同一时间只有一次重建；失败时各索引保持旧版本继续服务
+    - 多 worker 部署：每次成功的 reload 在向量库 meta 表里推进共享代号并记下本次读取的知识库文件签名，
+      其它 worker 每 KB_SYNC_INTERVAL 秒比对共享代号，落后时 refresh，管理接口触发的重建因此对所有 worker 生效
+    - 可选的文件监视：轮询知识库文件的 mtime/大小，连续两次观察到相同的新状态后才触发，
+      避免在文件还没写完时重建；重建前在同一个写事务里认领该签名，已被其它 worker 重建或正在重建的版本直接跳过，
+      之后由共享代号跟进（认领超过 claim_ttl 秒未完成视为失效，允许其它 worker 接手）
+    间隔未指定时在 start() 时取 KB_WATCH_INTERVAL / KB_SYNC_INTERVAL
+    """
+
+    def __init__(self, watch_interval: float = None, sync_interval: float = None, db_path: str = None,
+                 claim_ttl: float = 600.0):
+        self.watch_interval = watch_interval
+        self.claim_ttl = claim_ttl
+        self.sync_interval = sync_interval
+        self.db_path = db_path
+        self.generation = 0
+        self.last_reload_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._targets: Dict[str, object] = {}
+        self._lock = asyncio.Lock()
+        self._tasks = []
+        self._path: Optional[str] = None
+        # 最近一次重建读取的知识库文件签名，文件监视以它为基准
+        self._seen = None
+
+    def register(self, name: str, target):
+        self._targets[name] = target
+
+    @property
+    def reloading(self) -> bool:
+        return self._lock.locked()
+
+    async def reload(self, reason: str = "manual", force: bool = True) -> dict:
+        """
+        依次重建全部索引；全部成功才推进共享代号
+        force=False（文件监视）时，当前文件版本已被其它 worker 重建或认领则跳过
+        """
+        async with self._lock:
+            # 在读取知识库之前取签名：重建期间文件再次变化时，监视仍会看到差异
+            signature = self._signature(self._path) if self._path else None
+            if not await asyncio.to_thread(self._claim, signature, force):
+                logger.info(f"[KB_RELOAD] Skipping reload ({reason}): this version is already handled by another worker.")
+                return self.status()
+            logger.info(f"[KB_RELOAD] Reload started ({reason}).")
+            start = time.perf_counter()
+            try:
+                for name, target in self._targets.items():
+                    generation = await asyncio.to_thread(target.reload)
+                    logger.info(f"[KB_RELOAD] {name} switched to generation {generation}.")
+                self.generation = await asyncio.to_thread(self._bump_marker, signature)
+            except Exception as e:
+                ERRORS.inc(component="kb_reload")
+                self.last_error = f"{type(e).__name__}: {e}"
+                logger.error(f"[KB_RELOAD] Reload failed, keeping previous index: {e}")
+                raise
+            finally:
+                STAGE_SECONDS.observe(time.perf_counter() - start, stage="kb_reload")
+            self._seen = signature or self._seen
+            self.last_reload_at = time.time()
+            self.last_error = None
+            logger.info(f"[KB_RELOAD] Reload complete in {time.perf_counter() - start:.2f}s, "
+                        f"generation {self.generation}.")
+        return self.status()
+
+    async def sync(self) -> bool:
+        """跟进其它 worker 完成的热更新：共享代号领先时重新加载本进程的索引，返回是否有更新"""
+        if self._lock.locked():
+            # 本进程正在重建，完成后自然是最新版本
+            return False
+        async with self._lock:
+            try:
+                generation, signature = await asyncio.to_thread(self._read_marker)
+                if generation <= self.generation:
+                    return False
+                for name, target in self._targets.items():
+                    refresh = getattr(target, "refresh", None) or target.reload
+                    local = await asyncio.to_thread(refresh)
+                    logger.info(f"[KB_RELOAD] {name} refreshed to generation {local}.")
+            except Exception as e:
+                ERRORS.inc(component="kb_reload")
+                self.last_error = f"{type(e).__name__}: {e}"
+                logger.error(f"[KB_RELOAD] Sync failed, keeping previous index: {e}")
+                raise
+            self.generation = generation
+            self._seen = signature or self._seen
+            self.last_reload_at = time.time()
+            self.last_error = None
+            logger.info(f"[KB_RELOAD] Followed reload from another worker, generation {generation}.")
+        return True
+
+    def status(self) -> dict:
+        return {
+            "generation": self.generation,
+            "indexes": {name: target.generation for name, target in self._targets.items()},
+            "reloading": self.reloading,
+            "last_reload_at": self.last_reload_at,
+            "last_error": self.last_error,
+        }
+
+    @staticmethod
+    def _signature(path: str):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.db_path is None:
+            self.db_path = get_settings().db_path
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        return conn
+
+    @staticmethod
+    def _decode(row) -> Tuple[int, Optional[tuple]]:
+        if row is None:
+            return 0, None
+        marker = json.loads(row[0])
+        return marker["generation"], tuple(marker["signature"]) if marker.get("signature") else None
+
+    def _read_marker(self) -> Tuple[int, Optional[tuple]]:
+        """共享的 (代号, 知识库文件签名)"""
+        conn = self._connect()
+        try:
+            return self._decode(conn.execute("SELECT value FROM meta WHERE key = ?", (MARKER_KEY,)).fetchone())
+        finally:
+            conn.close()
+
+    def _claim(self, signature, force: bool) -> bool:
+        """在写事务里认领本次重建；非强制时若该签名已重建完成或正被其它 worker 重建则返回 False"""
+        conn = self._connect()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                if not force and signature is not None:
+                    _, done = self._decode(cursor.execute("SELECT value FROM meta WHERE key = ?",
+                                                          (MARKER_KEY,)).fetchone())
+                    row = cursor.execute("SELECT value FROM meta WHERE key = ?", (CLAIM_KEY,)).fetchone()
+                    claim = json.loads(row[0]) if row else None
+                    claimed = (claim is not None and tuple(claim["signature"] or ()) == signature
+                               and time.time() - claim["at"] < self.claim_ttl)
+                    if done == signature or claimed:
+                        cursor.execute("ROLLBACK")
+                        return False
+                claim = {"signature": signature, "at": time.time(), "pid": os.getpid()}
+                cursor.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (CLAIM_KEY, json.dumps(claim)))
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+        return True
+
+    def _bump_marker(self, signature) -> int:
+        conn = self._connect()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                generation, _ = self._decode(cursor.execute("SELECT value FROM meta WHERE key = ?",
+                                                            (MARKER_KEY,)).fetchone())
+                marker = {"generation": generation + 1, "signature": signature}
+                cursor.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (MARKER_KEY, json.dumps(marker)))
+                cursor.execute("DELETE FROM meta WHERE key = ?", (CLAIM_KEY,))
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+        return generation + 1
+
+    async def _watch(self, path: str):
+        pending = None
+        while True:
+            await asyncio.sleep(self.watch_interval)
+            current = self._signature(path)
+            if current is None or current == self._seen:
+                pending = None
+                continue
+            if current != pending:
+                # 第一次看到变化，等下一轮确认文件已稳定
+                pending = current
+                continue
+            pending = None
+            try:
+                # 其它 worker 可能已经按这个版本重建过，跟进即可；正在重建时跳过，下一轮再跟进
+                await self.sync()
+                if self._seen != current:
+                    await self.reload(reason=f"file changed: {path}", force=False)
+            except Exception as e:
+                # reload/sync 已记录错误并计数，这里只防止监视任务退出
+                logger.debug(f"[KB_RELOAD] Watch iteration failed: {e}")
+
+    async def _follow(self):
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                await self.sync()
+            except Exception as e:
+                logger.debug(f"[KB_RELOAD] Sync iteration failed: {e}")
+
+    async def start(self, path: str):
+        settings = get_settings()
+        if self.watch_interval is None:
+            self.watch_interval = settings.kb_watch_interval
+        if self.sync_interval is None:
+            self.sync_interval = settings.kb_sync_interval
+        if self._tasks:
+            return
+        self._path = path
+        self._seen = self._signature(path)
+        # 以当前共享代号为起点，启动前的热更新已经体现在库里，不需要再跟进
+        self.generation, _ = await asyncio.to_thread(self._read_marker)
+        loop = asyncio.get_running_loop()
+        if self.watch_interval > 0:
+            self._tasks.append(loop.create_task(self._watch(path)))
+            logger.info(f"[KB_RELOAD] Watching {path} every {self.watch_interval}s.")
+        if self.sync_interval > 0:
+            self._tasks.append(loop.create_task(self._follow()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+# 单例
+kb_reloader = KBReloader()
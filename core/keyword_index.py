@@ -0,0 +1,108 @@
+import heapq
+from collections import deque
+from typing import Dict, Iterable, List, Tuple
+
+
+class AhoCorasick:
+    """
+    多模式串匹配自动机：构建一次，之后对任意文本只需从左到右扫描一遍，
+    即可找出其中出现的全部模式串，耗时与文本长度和命中数相关，与模式串数量无关
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # 每个状态上结束的模式串编号（含经失败链可达的后缀模式串）
+        self._out: List[List[int]] = [[]]
+        self.patterns: List[str] = []
+        for pattern in patterns:
+            self._insert(pattern)
+        self._build()
+
+    def _insert(self, pattern: str):
+        pattern_id = len(self.patterns)
+        self.patterns.append(pattern)
+        if not pattern:
+            return
+        state = 0
+        for ch in pattern:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        self._out[state].append(pattern_id)
+
+    def _build(self):
+        """BFS 计算失败指针，并把后缀状态的输出合并进来，扫描时无需再沿失败链回溯"""
+        # 第一层状态的失败指针都指向根
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def iter_matches(self, text: str) -> Iterable[Tuple[int, int]]:
+        """逐个产出 (结束位置, 模式串编号)，同一模式串多次出现会多次产出"""
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for pos, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for pattern_id in out[state]:
+                yield pos, pattern_id
+
+    def matched(self, text: str) -> set:
+        """文本中出现过的模式串编号集合"""
+        return {pattern_id for _, pattern_id in self.iter_matches(text)}
+
+
+class KeywordIndex:
+    """
+    关键词 -> 条目 的倒排索引，底层是全部关键词构成的一个 Aho-Corasick 自动机
+    打分规则与逐条 `kw in query` 相同：条目的每个关键词在查询中出现即计 1 分（出现多次也只计 1 次）
+    """
+
+    def __init__(self, entries: Iterable[Tuple[str, Iterable[str]]]):
+        self.entry_ids: List[str] = []
+        keyword_ids: Dict[str, int] = {}
+        # 关键词编号 -> [(条目下标, 该关键词在条目中出现的次数)]
+        postings: List[Dict[int, int]] = []
+        for entry_index, (entry_id, keywords) in enumerate(entries):
+            self.entry_ids.append(entry_id)
+            for kw in keywords:
+                kw_id = keyword_ids.setdefault(kw, len(keyword_ids))
+                if kw_id == len(postings):
+                    postings.append({})
+                postings[kw_id][entry_index] = postings[kw_id].get(entry_index, 0) + 1
+        self._postings = [list(p.items()) for p in postings]
+        self._automaton = AhoCorasick(keyword_ids)
+
+    def __len__(self):
+        return len(self.entry_ids)
+
+    def scores(self, query: str) -> Dict[int, int]:
+        """{条目下标: 分数}，只包含得分大于 0 的条目"""
+        scores: Dict[int, int] = {}
+        for kw_id in self._automaton.matched(query):
+            for entry_index, weight in self._postings[kw_id]:
+                scores[entry_index] = scores.get(entry_index, 0) + weight
+        return scores
+
+    def top_k(self, query: str, k: int = 1) -> List[Tuple[str, int]]:
+        """按分数从高到低返回前 k 个 (条目 ID, 分数)；同分时先出现的条目优先"""
+        scores = self.scores(query)
+        best = heapq.nlargest(k, scores.items(), key=lambda item: (item[1], -item[0]))
+        return [(self.entry_ids[index], score) for index, score in best]
@@ -0,0 +1,53 @@
+import threading
+import time
+from typing import Callable
+
+from core.logger import logger
+
+
+class Lazy:
+    """
+    单例的延迟构造代理
+    模块里仍写 `ticket_store = Lazy(TicketStore, "ticket_store")`，调用方照旧 `from ... import ticket_store`；
+    真正的对象在第一次访问属性时才构造（连数据库、加载索引等），之后所有属性访问直接转发。
+    构造过程加锁，多个线程同时首次访问也只会构造一次；服务在 lifespan 里用 initialize() 提前构造
+    """
+    __slots__ = ("_lazy_factory", "_lazy_name", "_lazy_lock", "_lazy_obj")
+
+    def __init__(self, factory: Callable[[], object], name: str = None):
+        object.__setattr__(self, "_lazy_factory", factory)
+        object.__setattr__(self, "_lazy_name", name or getattr(factory, "__name__", "lazy"))
+        object.__setattr__(self, "_lazy_lock", threading.Lock())
+        object.__setattr__(self, "_lazy_obj", None)
+
+    def _lazy_get(self):
+        obj = self._lazy_obj
+        if obj is None:
+            with self._lazy_lock:
+                obj = self._lazy_obj
+                if obj is None:
+                    start = time.perf_counter()
+                    obj = self._lazy_factory()
+                    object.__setattr__(self, "_lazy_obj", obj)
+                    logger.info(f"[INIT] {self._lazy_name} ready in {time.perf_counter() - start:.2f}s.")
+        return obj
+
+    def __getattr__(self, item):
+        return getattr(self._lazy_get(), item)
+
+    def __setattr__(self, key, value):
+        setattr(self._lazy_get(), key, value)
+
+    def __repr__(self):
+        state = "initialized" if self._lazy_obj is not None else "pending"
+        return f"<Lazy {self._lazy_name} ({state})>"
+
+
+def initialize(*proxies: Lazy) -> list:
+    """按顺序构造尚未初始化的单例，返回真实对象"""
+    return [proxy._lazy_get() for proxy in proxies]
+
+
+def is_initialized(proxy: Lazy) -> bool:
+    """是否已构造；不会触发构造，可在健康检查里使用"""
+    return proxy._lazy_obj is not None
@@ -0,0 +1,111 @@
+import math
+import re
+from collections import Counter, defaultdict
+from typing import List, Tuple
+
+import numpy as np
+
+_CJK_RUN_RE = re.compile(r'[\u3400-\u9fff]+')
+_WORD_RE = re.compile(r'[a-z0-9]+(?:[-_.][a-z0-9]+)*')
+_WORD_SEP_RE = re.compile(r'[-_.]')
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    中文按字符 bigram 切分（单字片段保留原字），英文/数字按词切分
+    带连字符的词同时保留整体与各部分，保证 "--disable-gpu" 这类参数能精确命中
+    """
+    text = text.lower()
+    tokens = []
+    for run in _CJK_RUN_RE.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    for word in _WORD_RE.findall(text):
+        tokens.append(word)
+        parts = [p for p in _WORD_SEP_RE.split(word) if p]
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+class BM25Index:
+    """
+    内存倒排索引 + BM25 打分
+    查询只访问 query 词项的倒排列表，开销与知识库规模无关，只与命中文档数相关
+    """
+
+    def __init__(self, postings: dict, doc_len: np.ndarray, k1: float = 1.5, b: float = 0.75):
+        self.postings = postings  # term -> (doc_ids int32 数组, tf float32 数组)
+        self.doc_len = doc_len
+        self.n_docs = len(doc_len)
+        self.avgdl = float(doc_len.mean()) if self.n_docs else 0.0
+        self.k1 = k1
+        self.b = b
+
+    @classmethod
+    def build(cls, texts: List[str], **kwargs) -> "BM25Index":
+        lists = defaultdict(lambda: ([], []))
+        doc_len = np.zeros(len(texts), dtype=np.float32)
+        for doc_id, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            doc_len[doc_id] = sum(counts.values())
+            for term, tf in counts.items():
+                ids, tfs = lists[term]
+                ids.append(doc_id)
+                tfs.append(tf)
+        postings = {term: (np.array(ids, dtype=np.int32), np.array(tfs, dtype=np.float32))
+                    for term, (ids, tfs) in lists.items()}
+        return cls(postings, doc_len, **kwargs)
+
+    def idf(self, df: int) -> float:
+        return math.log(1 + (self.n_docs - df + 0.5) / (df + 0.5))
+
+    def search(self, query: str, k: int = 10, min_coverage: float = 0.0) -> List[Tuple[int, float]]:
+        """
+        返回 [(doc_id, bm25 分数)]，按分数降序
+        min_coverage: 文档命中的 query 词项 IDF 质量占比下限，用于滤掉只撞上一两个常见字的弱匹配
+        """
+        terms = set(tokenize(query))
+        if not terms or not self.n_docs:
+            return []
+
+        ids_parts, score_parts, idf_parts = [], [], []
+        total_idf = 0.0
+        for term in terms:
+            posting = self.postings.get(term)
+            idf = self.idf(len(posting[0]) if posting else 0)
+            total_idf += idf
+            if posting is None:
+                continue
+            ids, tfs = posting
+            norm = self.k1 * (1 - self.b + self.b * self.doc_len[ids] / self.avgdl)
+            ids_parts.append(ids)
+            score_parts.append(idf * tfs * (self.k1 + 1) / (tfs + norm))
+            idf_parts.append(np.full(len(ids), idf, dtype=np.float32))
+        if not ids_parts:
+            return []
+
+        # 合并各词项的倒排列表，按文档聚合得分与命中覆盖度
+        doc_ids, inverse = np.unique(np.concatenate(ids_parts), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(score_parts))
+        coverage = np.bincount(inverse, weights=np.concatenate(idf_parts)) / total_idf
+
+        keep = coverage >= min_coverage
+        doc_ids, scores = doc_ids[keep], scores[keep]
+        if len(doc_ids) == 0:
+            return []
+        k = min(k, len(doc_ids))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(doc_ids[i]), float(scores[i])) for i in top]
+
+
+def reciprocal_rank_fusion(rankings: List[List[int]], k: int = 60) -> List[Tuple[int, float]]:
+    """RRF 融合多路排序结果，只依赖名次，不要求各路分数可比"""
+    fused = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            fused[doc_id] += 1.0 / (k + rank + 1)
+    return sorted(fused.items(), key=lambda x: x[1], reverse=True)
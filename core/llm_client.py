@@ -0,0 +1,224 @@
+import asyncio
+import json
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import httpx
+
+from core.logger import logger
+from core.settings import get_settings
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class LLMError(Exception):
+    def __init__(self, message: str, status_code: int = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+    @property
+    def retryable(self) -> bool:
+        """连接失败或限流/5xx：稍后整体重试可能成功"""
+        return self.status_code is None or self.status_code in RETRYABLE_STATUS
+
+
+class LLMClient:
+    """
+    OpenAI 兼容 chat-completions 的异步客户端
+    - 长连接池复用 TCP/TLS
+    - 全局信号量限制进行中的请求数，避免突发流量把上游打到 429；退避等待不占名额
+    - 429/5xx 指数退避 + 抖动重试，优先遵循 Retry-After
+    客户端运行在自己的事件循环线程上，因此 FastAPI 协程与后台线程里的同步调用
+    共享同一个连接池和同一个并发上限
+    """
+
+    def __init__(self, api_key: str = None, base_url: str = None, max_concurrency: int = None,
+                 max_retries: int = 3, timeout: float = 20.0, max_connections: int = 20,
+                 backoff_base: float = 0.5, backoff_max: float = 8.0, retry_after_max: float = 60.0):
+        settings = get_settings()
+        self.api_key = api_key or settings.groq_api_key
+        base_url = base_url or settings.groq_base_url
+        self.url = f"{base_url.rstrip('/')}/chat/completions"
+        self.max_concurrency = max_concurrency or settings.llm_max_concurrency
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_after_max = retry_after_max
+
+        self._lock = threading.Lock()
+        self._loop = None
+        self._client = None
+        self._semaphore = None
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="llm-client", daemon=True).start()
+                self._loop = loop
+        return self._loop
+
+    def _ensure_client(self):
+        # 仅在客户端自己的事件循环内调用，无需加锁
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+                headers={'Authorization': f'Bearer {self.api_key}'},
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._client
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter：在 [0, base * 2^attempt] 内随机，错开同时失败的请求
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _retry_after(self, response: httpx.Response):
+        value = response.headers.get('retry-after')
+        if not value:
+            return None
+        try:
+            delay = float(value)
+        except ValueError:
+            try:
+                delay = parsedate_to_datetime(value).timestamp() - time.time()
+            except (TypeError, ValueError):
+                return None
+        return min(max(delay, 0.0), self.retry_after_max)
+
+    @staticmethod
+    def _delta(data: str):
+        """SSE 数据块里的增量文本；用量统计等 choices 为空的块、格式不对的行返回 None"""
+        try:
+            choices = json.loads(data).get('choices')
+            return (choices[0].get('delta') or {}).get('content') if choices else None
+        except (ValueError, AttributeError, TypeError):
+            logger.warning(f"[LLM] Skipping malformed stream chunk: {data[:200]}")
+            return None
+
+    async def _post(self, payload: dict) -> dict:
+        client = self._ensure_client()
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            # 只在请求进行中占用并发名额；退避等待期间让给其它请求
+            async with self._semaphore:
+                try:
+                    r = await client.post(self.url, json=payload)
+                except httpx.TransportError as e:
+                    last_error = LLMError(f"Connection failed: {e}")
+                    delay = self._backoff(attempt)
+                else:
+                    if r.status_code == 200:
+                        return r.json()
+                    last_error = LLMError(f"API Error: {r.status_code} - {r.text[:500]}", r.status_code)
+                    if r.status_code not in RETRYABLE_STATUS:
+                        raise last_error
+                    delay = self._retry_after(r)
+                    if delay is None:
+                        delay = self._backoff(attempt)
+            if attempt < self.max_retries:
+                logger.warning(f"[LLM] {last_error} (attempt {attempt + 1}/{self.max_retries + 1}), retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+        raise last_error
+
+    async def _stream(self, payload: dict):
+        """在客户端事件循环内消费 SSE；只在收到首个字节之前重试"""
+        client = self._ensure_client()
+        last_error = None
+        started = False
+        for attempt in range(self.max_retries + 1):
+            # 与 _post 相同：名额只在连接存续期间占用，退避等待前释放
+            async with self._semaphore:
+                try:
+                    async with client.stream('POST', self.url, json={**payload, 'stream': True}) as r:
+                        if r.status_code == 200:
+                            async for line in r.aiter_lines():
+                                if not line.startswith('data:'):
+                                    continue
+                                data = line[5:].strip()
+                                if data == '[DONE]':
+                                    return
+                                delta = self._delta(data)
+                                if delta:
+                                    started = True
+                                    yield delta
+                            return
+                        body = (await r.aread()).decode('utf-8', errors='replace')
+                        last_error = LLMError(f"API Error: {r.status_code} - {body[:500]}", r.status_code)
+                        if r.status_code not in RETRYABLE_STATUS:
+                            raise last_error
+                        delay = self._retry_after(r)
+                        if delay is None:
+                            delay = self._backoff(attempt)
+                except httpx.TransportError as e:
+                    if started:
+                        # 已经输出过部分内容，重试会导致重复，直接上抛
+                        raise LLMError(f"Stream interrupted: {e}")
+                    last_error = LLMError(f"Connection failed: {e}")
+                    delay = self._backoff(attempt)
+            if attempt < self.max_retries:
+                logger.warning(f"[LLM] {last_error} (attempt {attempt + 1}/{self.max_retries + 1}), retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+        raise last_error
+
+    async def stream(self, payload: dict):
+        """
+        流式补全：逐段产出增量文本
+        生产者跑在客户端事件循环上，经由队列把增量转交给调用方所在的事件循环
+        """
+        consumer_loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        done = object()
+
+        async def produce():
+            try:
+                async for piece in self._stream(payload):
+                    consumer_loop.call_soon_threadsafe(queue.put_nowait, piece)
+            except Exception as e:
+                consumer_loop.call_soon_threadsafe(queue.put_nowait, e)
+            finally:
+                consumer_loop.call_soon_threadsafe(queue.put_nowait, done)
+
+        future = asyncio.run_coroutine_threadsafe(produce(), self._ensure_loop())
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            future.cancel()
+
+    async def chat(self, payload: dict) -> dict:
+        """在任意事件循环中 await，实际请求在客户端自己的循环上执行"""
+        future = asyncio.run_coroutine_threadsafe(self._post(payload), self._ensure_loop())
+        return await asyncio.wrap_future(future)
+
+    def chat_sync(self, payload: dict) -> dict:
+        """供同步调用方（后台线程、CLI）使用的阻塞封装"""
+        return asyncio.run_coroutine_threadsafe(self._post(payload), self._ensure_loop()).result()
+
+    async def complete(self, messages: list, **params) -> str:
+        data = await self.chat({'messages': messages, **params})
+        return data['choices'][0]['message']['content']
+
+    def complete_sync(self, messages: list, **params) -> str:
+        data = self.chat_sync({'messages': messages, **params})
+        return data['choices'][0]['message']['content']
+
+    def close(self):
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        if self._client is not None:
+            asyncio.run_coroutine_threadsafe(self._client.aclose(), loop).result()
+            self._client = None
+        loop.call_soon_threadsafe(loop.stop)
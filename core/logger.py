@@ -2,35 +2,35 @@ import logging
 import os
 from logging.handlers import RotatingFileHandler
 
-# 确保日志目录存在
-LOG_DIR = "/home/lianwei_zlw/Walnut-AI-Support/logs"
-if not os.path.exists(LOG_DIR):
-    os.makedirs(LOG_DIR)
+# 格式化器：时间 - 级别 - 消息
+FORMATTER = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
 def get_logger(name="WAS"):
+    """导入时只挂控制台输出（方便 nohup 查看）；写文件由 configure_logging 在启动时按配置开启"""
     logger = logging.getLogger(name)
     if not logger.handlers:
         logger.setLevel(logging.INFO)
-        
-        # 格式化器：时间 - 级别 - 消息
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        
-        # 文件滚动：每个文件10MB，保留5个备份
-        file_handler = RotatingFileHandler(
-            os.path.join(LOG_DIR, "was.log"), 
-            maxBytes=10*1024*1024, 
-            backupCount=5,
-            encoding='utf-8'
-        )
-        file_handler.setFormatter(formatter)
-        
-        # 同时输出到控制台（方便 nohup 查看）
         console_handler = logging.StreamHandler()
-        console_handler.setFormatter(formatter)
-        
-        logger.addHandler(file_handler)
+        console_handler.setFormatter(FORMATTER)
         logger.addHandler(console_handler)
-        
+    return logger
+
+def configure_logging(settings=None, name="WAS"):
+    """按配置设置日志级别并追加滚动文件日志；重复调用不会重复挂载 handler"""
+    if settings is None:
+        from core.settings import get_settings
+        settings = get_settings()
+    logger = get_logger(name)
+    logger.setLevel(settings.log_level)
+    path = os.path.join(settings.log_dir, "was.log")
+    for handler in logger.handlers:
+        if isinstance(handler, RotatingFileHandler) and handler.baseFilename == os.path.abspath(path):
+            return logger
+    os.makedirs(settings.log_dir, exist_ok=True)
+    # 文件滚动：每个文件10MB，保留5个备份
+    file_handler = RotatingFileHandler(path, maxBytes=10*1024*1024, backupCount=5, encoding='utf-8')
+    file_handler.setFormatter(FORMATTER)
+    logger.addHandler(file_handler)
     return logger
 
 logger = get_logger()
@@ -38,3 +38,18 @@ class TicketCreate(BaseModel):
     title: str
     description: str
     image_url: Optional[str] = None
+
+class TicketSummary(BaseModel):
+    """工单列表摘要：不含描述与消息正文"""
+    id: str
+    user_id: str
+    category: Optional[str] = "自动识别"
+    title: str
+    status: TicketStatus
+    message_count: int = 0
+    created_at: datetime
+    updated_at: datetime
+
+class TicketPage(BaseModel):
+    items: List[TicketSummary]
+    next_cursor: Optional[str] = None
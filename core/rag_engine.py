@@ -1,28 +1,13 @@
-import requests
-import json
-import os
-import base64
-from dotenv import load_dotenv
-from logger import logger
+import asyncio
+import time
+from core.logger import logger
+from core.llm_client import LLMClient, LLMError
+from core.metrics import STAGE_SECONDS, ERRORS
+from core.context_assembler import ContextAssembler
+from core.settings import get_settings
+from core.lazy import Lazy
 
-load_dotenv()
-
-class GroqEngine:
-    def __init__(self):
-        self.api_key = os.getenv('GROQ_API_KEY')
-        self.url = 'https://api.groq.com/openai/v1/chat/completions'
-        from vector_engine import VectorSearchEngine
-        self.vs_engine = VectorSearchEngine(kb_path='/home/lianwei_zlw/Walnut-AI-Support/data/walnut_kb.json')
-
-    def ask(self, user_query: str, history: list = None, image_base64: str = None):
-        """
-        支持多模态推理
-        image_base64: 图片的 Base64 编码字符串
-        """
-        # P2: 语义检索获取最新上下文
-        context = self.vs_engine.search(user_query, top_k=2)
-        
-        system_prompt = f"""
+SYSTEM_PROMPT = """
 Role: 核桃编程金牌技术支持
 Task: 根据知识库，为带课老师提供精准、可转发的解决方案。
 
@@ -36,12 +21,32 @@ Task: 根据知识库，为带课老师提供精准、可转发的解决方案
 4. **大白话**：用学生和家长听得懂的语言（如：按下键盘上的三个键...）。
 5. **转发友好**：直接给出解决动作，不要开场白，方便老师直接复制发送。
 
-【参考知识库片段】:
-{context}
 """
+
+class GroqEngine:
+    def __init__(self):
+        settings = get_settings()
+        self.api_key = settings.groq_api_key
+        self.model = settings.groq_model
+        self.client = LLMClient(api_key=self.api_key)
+        self.url = self.client.url
+        from core.vector_engine import VectorSearchEngine
+        self.vs_engine = VectorSearchEngine(kb_path=settings.kb_path, db_path=settings.db_path)
+        # 静态指令只格式化一次；检索片段与历史消息各自按 token 预算裁剪
+        self.assembler = ContextAssembler(
+            SYSTEM_PROMPT,
+            system_budget=settings.prompt_system_tokens,
+            context_budget=settings.prompt_context_tokens,
+            history_budget=settings.prompt_history_tokens,
+        )
+
+    def _build_payload(self, user_query: str, history: list = None, image_base64: str = None) -> dict:
+        # P2: 语义检索获取最新上下文；多取几条候选，去重后再按预算取舍
+        hits = self.vs_engine.search_hits(user_query, top_k=self.assembler.max_snippets * 2)
+
         # 构建消息内容
         content = [{"type": "text", "text": user_query}]
-        
+
         if image_base64:
             content.append({
                 "type": "image_url",
@@ -50,30 +55,71 @@ Task: 根据知识库，为带课老师提供精准、可转发的解决方案
                 }
             })
 
-        messages = [{"role": "system", "content": system_prompt}]
-        if history:
-            messages.extend(history)
-        messages.append({"role": "user", "content": content})
+        messages = self.assembler.build_messages(content, hits, history)
 
-        headers = {
-            'Authorization': f'Bearer {self.api_key}',
-            'Content-Type': 'application/json'
-        }
-        payload = {
-            'model': 'meta-llama/llama-4-maverick-17b-128e-instruct',
+        return {
+            'model': self.model,
             'messages': messages,
             'temperature': 0.1,
             'max_tokens': 1024
         }
+
+    def ask(self, user_query: str, history: list = None, image_base64: str = None, raise_transient: bool = False):
+        """
+        支持多模态推理（同步封装，供后台线程等旧调用方使用）
+        image_base64: 图片的 Base64 编码字符串
+        raise_transient: 可重试的上游错误直接抛出（由任务队列重试），而不是返回错误提示
+        """
+        payload = self._build_payload(user_query, history, image_base64)
         try:
-            r = requests.post(self.url, headers=headers, json=payload, timeout=20)
-            if r.status_code == 200:
-                return r.json()['choices'][0]['message']['content']
-            else:
-                logger.error(f"[Groq-Vision] API Error: {r.status_code} - {r.text}")
-                return f'[SYSTEM_ERROR] Vision Core Error {r.status_code}'
+            with STAGE_SECONDS.time(stage="llm"):
+                data = self.client.chat_sync(payload)
+            return data['choices'][0]['message']['content']
         except Exception as e:
-            logger.error(f"[Groq-Vision] Connection Failed: {e}")
-            return f'[SYSTEM_ERROR] Vision Core Offline'
+            if raise_transient and isinstance(e, LLMError) and e.retryable:
+                ERRORS.inc(component="llm")
+                raise
+            return self._error_reply(e)
+
+    async def ask_async(self, user_query: str, history: list = None, image_base64: str = None):
+        """异步版本：不阻塞事件循环，检索放到线程池，LLM 请求走共享连接池"""
+        payload = await asyncio.to_thread(self._build_payload, user_query, history, image_base64)
+        try:
+            with STAGE_SECONDS.time(stage="llm"):
+                data = await self.client.chat(payload)
+            return data['choices'][0]['message']['content']
+        except Exception as e:
+            return self._error_reply(e)
+
+    async def ask_stream(self, user_query: str, history: list = None, image_base64: str = None,
+                         raise_transient: bool = False):
+        """流式版本：逐段产出回复文本；出错且尚未输出内容时产出错误提示（raise_transient 时可重试的错误直接抛出）"""
+        payload = await asyncio.to_thread(self._build_payload, user_query, history, image_base64)
+        produced = False
+        start = time.perf_counter()
+        try:
+            async for piece in self.client.stream(payload):
+                if not produced:
+                    STAGE_SECONDS.observe(time.perf_counter() - start, stage="llm_first_token")
+                produced = True
+                yield piece
+            STAGE_SECONDS.observe(time.perf_counter() - start, stage="llm")
+        except Exception as e:
+            if not produced and raise_transient and isinstance(e, LLMError) and e.retryable:
+                ERRORS.inc(component="llm")
+                raise
+            if not produced:
+                yield self._error_reply(e)
+            else:
+                ERRORS.inc(component="llm")
+                logger.error(f"[Groq-Vision] Stream interrupted: {e}")
+
+    def _error_reply(self, e: Exception) -> str:
+        ERRORS.inc(component="llm")
+        if isinstance(e, LLMError) and e.status_code:
+            logger.error(f"[Groq-Vision] {e}")
+            return f'[SYSTEM_ERROR] Vision Core Error {e.status_code}'
+        logger.error(f"[Groq-Vision] Connection Failed: {e}")
+        return f'[SYSTEM_ERROR] Vision Core Offline'
 
-ai_engine = GroqEngine()
+ai_engine = Lazy(GroqEngine, "ai_engine")
@@ -1,70 +1,163 @@
-from fastapi import FastAPI, Request, BackgroundTasks
+from fastapi import FastAPI, Request, Header
+from fastapi.responses import JSONResponse, PlainTextResponse
+from contextlib import asynccontextmanager
 import uvicorn
 import json
-import requests
-import os
 import time
-import base64
-from dotenv import load_dotenv
+import asyncio
+import hmac
+import requests
+
+# 引入核心组件（统一以项目根目录为包根导入：python3 -m core.server 或 uvicorn core.server:app）
+# 各单例均为延迟构造，导入本模块不会连接数据库、加载索引或创建目录
+from core.settings import get_settings
+from core.lazy import initialize, is_initialized
+from core.rag_engine import ai_engine
+from core.logger import logger, configure_logging
+from core.session_manager import session_manager
+from core.feishu_client import feishu_client, StreamingTextMessage, DeliveryError, ResourceError
+from core.idempotency import event_deduplicator
+from core.job_queue import job_queue, QueueFull, final_attempt
+from core.llm_client import LLMError
+from core.image_pipeline import prepare_image, screenshot_digest, vision_cache
+from core.metrics import REGISTRY, STAGE_SECONDS, ESCALATIONS, ERRORS, LoopLagMonitor
+from core.kb_reload import kb_reloader
+from core.web_server import router as web_router  # 引入 Web 路由
+from core.ticket_store import ticket_store
 
-# 引入核心组件
-import sys
-sys.path.append('/home/lianwei_zlw/Walnut-AI-Support/core')
-from rag_engine import ai_engine
-from logger import logger
-from session_manager import session_manager
-from web_server import router as web_router  # 引入 Web 路由
+loop_monitor = LoopLagMonitor()
+# 索引预热任务；完成前服务已可接收请求，/health 的 ready 字段标记预热是否结束
+warmup_task = None
+
+async def warm_up_index() -> bool:
+    start = time.perf_counter()
+    try:
+        size = await asyncio.to_thread(ai_engine.vs_engine.warm_up)
+    except Exception as e:
+        # 预热失败不影响服务，首个查询会再次尝试加载
+        ERRORS.inc(component="warmup")
+        logger.error(f"[STARTUP] Vector index warm-up failed: {e}")
+        return False
+    STAGE_SECONDS.observe(time.perf_counter() - start, stage="warmup")
+    logger.info(f"[STARTUP] Vector index warmed up with {size} entries in {time.perf_counter() - start:.2f}s.")
+    return True
 
-load_dotenv()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global warmup_task
+    settings = get_settings()
+    configure_logging(settings)
+    start = time.perf_counter()
+    # 存储与引擎在线程里构造（建表、连接数据库），不阻塞事件循环
+    await asyncio.to_thread(initialize, session_manager, event_deduplicator, ticket_store, feishu_client, ai_engine)
+    # 流式回复：首段内容到达即发消息，之后批量编辑同一条消息
+    job_queue.register("feishu_reply", stream_vision_and_reply if settings.stream_reply else process_vision_and_reply)
+    kb_reloader.register("vector", ai_engine.vs_engine)
+    loop_monitor.start()
+    await job_queue.start()
+    await kb_reloader.start(ai_engine.vs_engine.kb_path)
+    warmup_task = asyncio.create_task(warm_up_index())
+    logger.info(f"[STARTUP] Services initialized in {time.perf_counter() - start:.2f}s (home={settings.home}).")
+    yield
+    warmup_task.cancel()
+    await asyncio.gather(warmup_task, return_exceptions=True)
+    await kb_reloader.stop()
+    await job_queue.stop()
+    await loop_monitor.stop()
+    session_manager.close()
 
-app = FastAPI(title='Walnut AI Support Platform (Omni-Channel)')
+app = FastAPI(title='Walnut AI Support Platform (Omni-Channel)', lifespan=lifespan)
 # 挂载 Web 工单 API
 app.include_router(web_router)
 START_TIME = time.time()
-APP_ID = os.getenv('FEISHU_APP_ID')
-APP_SECRET = os.getenv('FEISHU_APP_SECRET')
 
 def get_tenant_access_token():
-    url = 'https://open.feishu.cn/open-apis/auth/v3/tenant_access_token/internal'
-    payload = {'app_id': APP_ID, 'app_secret': APP_SECRET}
-    try:
-        r = requests.post(url, json=payload, timeout=10)
-        return r.json().get('tenant_access_token')
-    except Exception as e:
-        logger.error(f'[FEISHU] Token Error: {e}')
-        return None
+    return feishu_client.get_tenant_access_token()
 
-def get_image_base64(message_id, image_key):
-    """从飞书下载图片并转为 Base64"""
-    token = get_tenant_access_token()
-    if not token: return None
-    
-    # 修正飞书图片资源接口路径
-    url = f"https://open.feishu.cn/open-apis/im/v1/messages/{message_id}/resources/{image_key}?type=image"
-    headers = {'Authorization': f'Bearer {token}'}
+IMAGE_FAILED_REPLY = "截图没有下载成功，请重新发送一次截图，或直接用文字描述报错内容。"
+
+@STAGE_SECONDS.timed(stage="image_fetch")
+def fetch_screenshot(message_id, image_key):
+    """
+    流式下载飞书图片的原始字节，失败时抛出 DeliveryError / ResourceError
+    先用原始字节的摘要查视觉结果缓存，未命中再 prepare_screenshot
+    """
+    return feishu_client.get_message_resource(message_id, image_key, 'image')
+
+def fetch_screenshot_or_notify(open_id, message_id, image_key):
+    """
+    下载老师发来的截图；暂时性故障在非最后一次尝试时抛出，交给任务队列重试，
+    其余情况请老师重发截图并返回 None，不会在缺图的情况下询问视觉模型
+    """
     try:
-        r = requests.get(url, headers=headers, timeout=15)
-        if r.status_code == 200:
-            return base64.b64encode(r.content).decode('utf-8')
-        logger.error(f"[FEISHU] Image Download Failed: {r.status_code} - {r.text}")
-    except Exception as e:
-        logger.error(f"[FEISHU] Image API Error: {e}")
+        return fetch_screenshot(message_id, image_key)
+    except (DeliveryError, ResourceError) as e:
+        if isinstance(e, DeliveryError) and not final_attempt():
+            raise
+        ERRORS.inc(component="image")
+        logger.warning(f"[IMAGE] Giving up on {image_key} for {open_id}: {e}")
+    send_message(open_id, IMAGE_FAILED_REPLY)
     return None
 
+@STAGE_SECONDS.timed(stage="image_prepare")
+def prepare_screenshot(image_key, content):
+    """缩放重压缩，供视觉模型使用"""
+    image = prepare_image(content)
+    if image:
+        logger.info(f"[IMAGE] {image_key}: {len(content)} -> {image.size} bytes, digest={image.digest[:16]}")
+    return image
+
+def get_image_base64(message_id, image_key):
+    """从飞书下载图片并转为 Base64（已压缩）"""
+    content = fetch_screenshot(message_id, image_key)
+    image = prepare_screenshot(image_key, content) if content else None
+    return image.base64 if image else None
+
 def send_message(receive_id, content):
-    token = get_tenant_access_token()
-    if not token: return
-    url = 'https://open.feishu.cn/open-apis/im/v1/messages?receive_id_type=open_id'
-    headers = {'Authorization': f'Bearer {token}', 'Content-Type': 'application/json'}
-    payload = {'receive_id': receive_id, 'msg_type': 'text', 'content': json.dumps({'text': content})}
-    requests.post(url, headers=headers, json=payload, timeout=10)
+    r = feishu_client.send_text(receive_id, content)
+    if r is None or r.status_code == 429 or r.status_code >= 500:
+        raise DeliveryError(f"Feishu send to {receive_id} failed: {r.status_code if r is not None else 'no token'}")
+
+def is_transient(e: Exception) -> bool:
+    """上游暂时不可用：交给任务队列按 max_attempts 退避重试"""
+    if isinstance(e, LLMError):
+        return e.retryable
+    return isinstance(e, (DeliveryError, requests.RequestException))
+
+def is_ready() -> bool:
+    """引擎已构造且索引预热成功；不会触发任何构造"""
+    return (is_initialized(ai_engine) and warmup_task is not None and warmup_task.done()
+            and not warmup_task.cancelled() and warmup_task.result())
 
 @app.get("/health")
 async def health_check():
-    return {"status": "online", "vision": "enabled", "uptime": int(time.time() - START_TIME)}
+    return {"status": "online", "ready": is_ready(), "vision": "enabled",
+            "uptime": int(time.time() - START_TIME), "kb": kb_reloader.status()}
+
+@app.post("/admin/kb/reload")
+async def reload_kb(x_admin_token: str = Header(default='')):
+    """重新加载知识库：新索引在后台线程构建，完成后原子切换，期间查询不受影响"""
+    # 管理接口令牌；未配置时热更新只能通过文件监视触发
+    admin_token = get_settings().admin_token
+    if not admin_token or not hmac.compare_digest(x_admin_token.encode(), admin_token.encode()):
+        return JSONResponse(status_code=403, content={'status': 'forbidden'})
+    try:
+        return await kb_reloader.reload(reason="admin")
+    except Exception as e:
+        return JSONResponse(status_code=500, content={'status': 'failed', 'error': str(e),
+                                                      'kb': kb_reloader.status()})
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus 抓取端点"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/jobs/stats")
+async def job_stats():
+    return await asyncio.to_thread(job_queue.stats)
 
 @app.post('/event')
-async def handle_feishu_event(request: Request, background_tasks: BackgroundTasks):
+async def handle_feishu_event(request: Request):
     raw_body = await request.body()
     data = json.loads(raw_body)
     
@@ -80,7 +173,7 @@ async def handle_feishu_event(request: Request, background_tasks: BackgroundTask
 
     message = event.get('message', {})
     sender = event.get('sender', {})
-    
+
     # 从 RAW_EVENT 观察到的真实路径：event -> sender -> sender_id -> open_id
     open_id = sender.get('sender_id', {}).get('open_id')
     message_type = message.get('message_type') # 注意：RAW 中是 message_type 而不是 msg_type
@@ -89,16 +182,23 @@ async def handle_feishu_event(request: Request, background_tasks: BackgroundTask
         logger.warning(f"[DEBUG] OpenID not found. Body: {raw_body.decode('utf-8')[:300]}")
         return {'status': 'ok'}
 
-    image_b64 = None
+    # 幂等：飞书重投的同一事件/同一消息直接丢弃，不再重复下载图片和调用 LLM
+    # 去重表写入是带忙等待的 SQLite 事务，放到线程池里，锁竞争时不阻塞事件循环
+    event_id = header.get('event_id')
+    message_id = message.get('message_id')
+    dedup_keys = (event_id and f"event:{event_id}", message_id and f"msg:{message_id}")
+    if not await asyncio.to_thread(event_deduplicator.check_and_mark, *dedup_keys):
+        logger.info(f"[DEDUP] Duplicate delivery dropped: event={event_id} message={message_id}")
+        return {'status': 'ok'}
+
+    image_key = None
     text_content = ""
 
-    # 处理图片消息
+    # 处理图片消息（下载放到后台任务里，尽快 ack 以免触发飞书重投）
     if message_type == 'image':
         content_raw = message.get('content')
         image_key = json.loads(content_raw).get('image_key')
-        message_id = message.get('message_id')
         logger.info(f"[INBOUND] Image from {open_id}, Key: {image_key}")
-        image_b64 = get_image_base64(message_id, image_key)
         text_content = "请详细分析这张截图中的技术报错信息，并给出 SOP 建议。"
     
     # 处理文本消息
@@ -107,31 +207,104 @@ async def handle_feishu_event(request: Request, background_tasks: BackgroundTask
         text_content = json.loads(content_raw).get('text', '').strip()
         logger.info(f"[INBOUND] Text from {open_id}: {text_content[:30]}")
 
-    if text_content or image_b64:
-        background_tasks.add_task(process_vision_and_reply, open_id, text_content, image_b64)
+    if text_content or image_key:
+        try:
+            await asyncio.to_thread(job_queue.enqueue, "feishu_reply", {"open_id": open_id, "text": text_content,
+                                                                        "message_id": message_id, "image_key": image_key})
+        except QueueFull:
+            # 背压：撤销去重标记并返回非 200，让飞书稍后重投
+            await asyncio.to_thread(event_deduplicator.forget, *dedup_keys)
+            logger.warning(f"[QUEUE] Queue full, asking Feishu to redeliver {event_id}.")
+            return JSONResponse(status_code=503, content={'status': 'busy'})
                 
     return {'status': 'ok'}
 
-def process_vision_and_reply(open_id, text, image_b64):
+def process_vision_and_reply(open_id, text, message_id=None, image_key=None):
+    """回复送达之前遇到暂时性故障时抛出，由任务队列重试；最后一次尝试时改为回复错误提示"""
+    delivered = False
     try:
+        content = fetch_screenshot_or_notify(open_id, message_id, image_key) if image_key else None
+        if image_key and content is None:
+            delivered = True
+            return
+        digest = screenshot_digest(content) if content else None
+
         # 处理人工请求
         if text == "人工":
             logger.info(f"[ALERT] User {open_id} requested human support.")
+            ESCALATIONS.inc(reason="user_request")
             # 这里的通知 ID 可以是你的 OpenID
             # send_message("YOUR_OPEN_ID", f"🚨 老师 {open_id} 请求人工协助，请及时处理。")
             send_message(open_id, "收到您的请求！已通知二线技术老师，请稍候。您可以先发送报错截图，方便老师快速定位问题。")
+            delivered = True
             return
 
-        history = session_manager.get_context(open_id)
-        # 调用视觉模型推理
-        reply = ai_engine.ask(text, history=history, image_base64=image_b64)
-        
-        session_manager.add_message(open_id, "user", text if not image_b64 else "[用户发送了图片]")
-        session_manager.add_message(open_id, "assistant", reply)
-        
+        # 同一张报错截图直接复用上次的视觉分析结果，命中时不再解码压缩
+        reply = vision_cache.get(digest) if digest else None
+        if reply:
+            logger.info(f"[IMAGE] Vision cache hit for {open_id}, digest={digest[:16]}")
+        else:
+            image = prepare_screenshot(image_key, content) if content else None
+            history = session_manager.get_context(open_id)
+            # 调用视觉模型推理
+            reply = ai_engine.ask(text, history=history, image_base64=image.base64 if image else None,
+                                  raise_transient=not final_attempt())
+            if image and not reply.startswith('[SYSTEM_ERROR]'):
+                vision_cache.put(digest, reply)
+
+        # 先送达再记入会话：发送失败重试时不会重复写入历史
         send_message(open_id, reply)
+        delivered = True
+
+        # 一轮对话原子写入，避免并发任务之间丢更新
+        session_manager.append_messages(open_id, [
+            {"role": "user", "content": text if not digest else "[用户发送了图片]"},
+            {"role": "assistant", "content": reply},
+        ])
     except Exception as e:
+        ERRORS.inc(component="reply")
         logger.error(f'[AI_CORE] Vision processing failed: {e}')
+        if not delivered and is_transient(e):
+            raise
+
+async def stream_vision_and_reply(open_id, text, message_id=None, image_key=None):
+    """process_vision_and_reply 的流式版本：边生成边推送到飞书；首段送达前的暂时性故障同样交给队列重试"""
+    if text == "人工":
+        await asyncio.to_thread(process_vision_and_reply, open_id, text)
+        return
+
+    stream = None
+    try:
+        content = await asyncio.to_thread(fetch_screenshot_or_notify, open_id, message_id, image_key) if image_key else None
+        if image_key and content is None:
+            return
+        digest = screenshot_digest(content) if content else None
+
+        stream = StreamingTextMessage(feishu_client, open_id)
+        cached = vision_cache.get(digest) if digest else None
+        if cached:
+            logger.info(f"[IMAGE] Vision cache hit for {open_id}, digest={digest[:16]}")
+            await stream.finish(cached)
+        else:
+            image = await asyncio.to_thread(prepare_screenshot, image_key, content) if content else None
+            history = await asyncio.to_thread(session_manager.get_context, open_id)
+            async for piece in ai_engine.ask_stream(text, history=history, image_base64=image.base64 if image else None,
+                                                    raise_transient=not final_attempt()):
+                await stream.feed(piece)
+            await stream.finish()
+            if image and not stream.text.startswith('[SYSTEM_ERROR]'):
+                vision_cache.put(digest, stream.text)
+
+        await asyncio.to_thread(session_manager.append_messages, open_id, [
+            {"role": "user", "content": text if not digest else "[用户发送了图片]"},
+            {"role": "assistant", "content": stream.text},
+        ])
+    except Exception as e:
+        ERRORS.inc(component="reply")
+        logger.error(f'[AI_CORE] Streaming reply failed: {e}')
+        if (stream is None or stream.message_id is None) and is_transient(e):
+            raise
 
 if __name__ == '__main__':
-    uvicorn.run(app, host='0.0.0.0', port=8001)
+    settings = get_settings()
+    uvicorn.run(app, host=settings.host, port=settings.port)
@@ -1,41 +1,120 @@
 import sqlite3
 import json
 import os
+import threading
 from core.logger import logger
+from core.metrics import STAGE_SECONDS
+from core.settings import get_settings
+from core.lazy import Lazy
 
 class PersistentSessionManager:
-    def __init__(self, db_path: str = "data/sessions.db"):
-        self.db_path = db_path
+    """
+    会话记忆存储
+    - 每线程一条常驻连接，WAL 模式下读写互不阻塞
+    - 一轮对话的多条消息在一个 IMMEDIATE 事务内原子追加，避免并发丢更新
+    - 后台清理线程删除闲置超过 SESSION_TTL 的会话
+    - 不做进程内缓存：多 worker 部署时同一老师的消息可能落到不同进程，
+      读取一律走数据库（单次主键查询），不会读到其它进程写入之前的旧历史
+    """
+    def __init__(self, db_path: str = None, ttl: int = None, max_history: int = None,
+                 sweep_interval: int = 60):
+        settings = get_settings()
+        self.db_path = db_path or settings.session_db_path
+        self.ttl = ttl if ttl is not None else settings.session_ttl
+        # MAX_HISTORY 按对话轮数计，每轮包含 user + assistant 两条消息
+        self.max_history = max_history if max_history is not None else settings.max_history * 2
+        self._local = threading.local()
+        # 各线程的连接登记在这里，close() 时统一关闭
+        self._conns = []
+        self._conns_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sweeper = None
         self._init_db()
+        if sweep_interval > 0:
+            self._sweeper = threading.Thread(target=self._sweep_loop, args=(sweep_interval,),
+                                             name="session-sweeper", daemon=True)
+            self._sweeper.start()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # 连接只在创建它的线程里使用；关闭统一由 close() 在别的线程完成
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._conns_lock:
+                self._conns.append(conn)
+        return conn
 
     def _init_db(self):
         os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''CREATE TABLE IF NOT EXISTS sessions 
+        cursor = self._conn().cursor()
+        cursor.execute('''CREATE TABLE IF NOT EXISTS sessions
                          (user_id TEXT PRIMARY KEY, history TEXT, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
-        conn.commit()
-        conn.close()
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessions_updated_at ON sessions (updated_at)")
 
-    def get_context(self, user_id: str) -> list:
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT history FROM sessions WHERE user_id = ?", (user_id,))
+    def _ttl_modifier(self) -> str:
+        return f"-{self.ttl} seconds"
+
+    def _load(self, cursor, user_id: str) -> list:
+        cursor.execute("SELECT history FROM sessions WHERE user_id = ? AND updated_at >= datetime('now', ?)",
+                       (user_id, self._ttl_modifier()))
         row = cursor.fetchone()
-        conn.close()
         return json.loads(row[0]) if row else []
 
-    def add_message(self, user_id: str, role: str, content: str, max_history: int = 10):
-        history = self.get_context(user_id)
-        history.append({"role": role, "content": content})
-        history = history[-max_history:]  # 保持窗口
-        
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("INSERT OR REPLACE INTO sessions (user_id, history, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)",
-                       (user_id, json.dumps(history)))
-        conn.commit()
-        conn.close()
+    @STAGE_SECONDS.timed(stage="session_get")
+    def get_context(self, user_id: str) -> list:
+        return self._load(self._conn().cursor(), user_id)
+
+    @STAGE_SECONDS.timed(stage="session_append")
+    def append_messages(self, user_id: str, messages: list, max_history: int = None):
+        """原子追加一轮对话的全部消息，并按窗口截断；max_history=0 表示不保留历史"""
+        if max_history is None:
+            max_history = self.max_history
+        with self._write_lock:
+            cursor = self._conn().cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                history = self._load(cursor, user_id)
+                history.extend(messages)
+                history = history[-max_history:] if max_history > 0 else []  # 保持窗口
+                cursor.execute("INSERT OR REPLACE INTO sessions (user_id, history, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)",
+                               (user_id, json.dumps(history, ensure_ascii=False)))
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+
+    def add_message(self, user_id: str, role: str, content: str, max_history: int = None):
+        self.append_messages(user_id, [{"role": role, "content": content}], max_history)
+
+    def sweep_expired(self) -> int:
+        """删除闲置超过 TTL 的会话，返回删除条数"""
+        cursor = self._conn().cursor()
+        cursor.execute("DELETE FROM sessions WHERE updated_at < datetime('now', ?)", (self._ttl_modifier(),))
+        return cursor.rowcount
+
+    def _sweep_loop(self, interval: int):
+        while not self._stop.wait(interval):
+            try:
+                removed = self.sweep_expired()
+                if removed:
+                    logger.info(f"[SESSION] Swept {removed} idle sessions.")
+            except Exception as e:
+                logger.error(f"[SESSION] Sweep failed: {e}")
+
+    def close(self):
+        """停止清理线程并关闭所有线程的连接；之后再调用会按需重新建立连接"""
+        self._stop.set()
+        if self._sweeper is not None:
+            self._sweeper.join()
+        with self._conns_lock:
+            conns, self._conns = self._conns, []
+            self._local = threading.local()
+        for conn in conns:
+            conn.close()
 
 # 单例
-session_manager = PersistentSessionManager()
+session_manager = Lazy(PersistentSessionManager, "session_manager")
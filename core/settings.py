@@ -0,0 +1,116 @@
+import os
+import typing
+from dataclasses import dataclass, field, fields
+from functools import lru_cache
+from typing import Optional
+
+from dotenv import load_dotenv
+
+# 项目根目录；未设置 WAS_HOME 时相对路径都以它为基准，而不是依赖启动时的工作目录
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_TRUE = {"1", "true", "yes", "on"}
+_FALSE = {"0", "false", "no", "off"}
+
+
+def env(name: str, default=None, minimum=None, path: bool = False):
+    """声明一个配置字段：对应的环境变量名、默认值、数值下限，以及是否按 WAS_HOME 解析的路径"""
+    return field(default=default, metadata={"env": name, "minimum": minimum, "path": path})
+
+
+def _coerce(name: str, raw: str, annotation):
+    """按字段类型把环境变量字符串转成目标类型；写错时报出变量名，启动即失败"""
+    if typing.get_origin(annotation) is typing.Union:
+        annotation = next(arg for arg in typing.get_args(annotation) if arg is not type(None))
+    try:
+        if annotation is bool:
+            value = raw.strip().lower()
+            if value not in _TRUE | _FALSE:
+                raise ValueError("expected one of 1/0, true/false, yes/no, on/off")
+            return value in _TRUE
+        return annotation(raw)
+    except ValueError as e:
+        raise ValueError(f"Invalid value for {name}={raw!r}: {e}") from None
+
+
+@dataclass(frozen=True)
+class Settings:
+    """
+    服务配置：字段名为代码内使用的名字，env 为对应的环境变量（.env 同样生效）
+    - 类型在这里统一转换和校验，配置写错时启动即报错，而不是运行到一半才抛异常
+    - 路径类字段若为相对路径，则相对 WAS_HOME 解析，服务可以从任意目录启动
+    不依赖 pydantic，CLI 与 worker 导入本模块几乎没有开销
+    """
+    home: str = env("WAS_HOME", PROJECT_ROOT)
+    host: str = env("WAS_HOST", "0.0.0.0")
+    port: int = env("WAS_PORT", 8001, minimum=1)
+    log_level: str = env("WAS_LOG_LEVEL", "INFO")
+    log_dir: str = env("WAS_LOG_DIR", "logs", path=True)
+
+    # 任务队列 / 回复方式 / 管理接口
+    workers: int = env("WAS_WORKERS", 4, minimum=1)
+    job_queue_max_depth: int = env("JOB_QUEUE_MAX_DEPTH", 1000, minimum=1)
+    stream_reply: bool = env("WAS_STREAM_REPLY", False)
+    admin_token: str = env("WAS_ADMIN_TOKEN", "")
+
+    # 数据文件
+    kb_path: str = env("KB_PATH", "data/walnut_kb.json", path=True)
+    db_path: str = env("DB_PATH", "data/vector_store.db", path=True)
+    session_db_path: str = env("SESSION_DB_PATH", "data/sessions.db", path=True)
+    job_db_path: str = env("JOB_DB_PATH", "data/jobs.db", path=True)
+    raw_tickets_path: str = env("RAW_TICKETS_PATH", "data/raw_tickets.xlsx", path=True)
+    distill_checkpoint_path: str = env("DISTILL_CHECKPOINT_PATH", "data/distill_checkpoint.db", path=True)
+    kb_watch_interval: float = env("KB_WATCH_INTERVAL", 10.0, minimum=0)
+    kb_sync_interval: float = env("KB_SYNC_INTERVAL", 2.0, minimum=0)
+
+    # 会话记忆
+    session_ttl: int = env("SESSION_TTL", 1800, minimum=1)
+    max_history: int = env("MAX_HISTORY", 5, minimum=0)
+
+    # 检索 / LLM
+    embedding_backend: str = env("WAS_EMBEDDING_BACKEND", "hashing")
+    groq_api_key: Optional[str] = env("GROQ_API_KEY")
+    groq_base_url: str = env("GROQ_BASE_URL", "https://api.groq.com/openai/v1")
+    groq_model: str = env("GROQ_MODEL", "meta-llama/llama-4-maverick-17b-128e-instruct")
+    llm_max_concurrency: int = env("LLM_MAX_CONCURRENCY", 8, minimum=1)
+    prompt_system_tokens: int = env("PROMPT_SYSTEM_TOKENS", 600, minimum=0)
+    prompt_context_tokens: int = env("PROMPT_CONTEXT_TOKENS", 1200, minimum=0)
+    prompt_history_tokens: int = env("PROMPT_HISTORY_TOKENS", 1000, minimum=0)
+
+    # 飞书
+    feishu_app_id: Optional[str] = env("FEISHU_APP_ID")
+    feishu_app_secret: Optional[str] = env("FEISHU_APP_SECRET")
+    feishu_base_url: str = env("FEISHU_BASE_URL", "https://open.feishu.cn")
+
+    def __post_init__(self):
+        home = os.path.abspath(os.path.expanduser(self.home))
+        object.__setattr__(self, "home", home)
+        object.__setattr__(self, "log_level", self.log_level.upper())
+        for f in fields(self):
+            value = getattr(self, f.name)
+            minimum = f.metadata.get("minimum")
+            if minimum is not None and value < minimum:
+                raise ValueError(f"{f.metadata['env']} must be >= {minimum}, got {value}")
+            if f.metadata.get("path"):
+                value = os.path.expanduser(value)
+                object.__setattr__(self, f.name, value if os.path.isabs(value) else os.path.join(home, value))
+
+    @classmethod
+    def from_env(cls, environ=None) -> "Settings":
+        """从环境变量构造；空字符串视为未设置，沿用默认值"""
+        environ = os.environ if environ is None else environ
+        hints = typing.get_type_hints(cls)
+        values = {}
+        for f in fields(cls):
+            name = f.metadata["env"]
+            raw = environ.get(name)
+            if raw not in (None, ""):
+                values[f.name] = _coerce(name, raw, hints[f.name])
+        return cls(**values)
+
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """进程内只解析一次；首次调用时才读取 .env，导入本模块没有副作用"""
+    load_dotenv()
+    return Settings.from_env()
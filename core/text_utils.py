@@ -0,0 +1,11 @@
+import re
+
+_NORMALIZE = re.compile(r'[\s\W_]+', re.UNICODE)
+
+
+def shingles(text: str, size: int = 2) -> set:
+    """去掉空白与标点并转小写后的字符 n-gram；短于 size 的文本整体作为一个 shingle"""
+    text = _NORMALIZE.sub('', text.lower())
+    if len(text) <= size:
+        return {text} if text else set()
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
@@ -0,0 +1,70 @@
+import asyncio
+import threading
+
+
+class Subscription:
+    """一个订阅者的唤醒信号；先订阅再读库，避免读库与等待之间的变更被漏掉"""
+
+    def __init__(self, hub: "TicketEventHub", key):
+        self.hub = hub
+        self.key = key
+        self.loop = asyncio.get_running_loop()
+        self.event = asyncio.Event()
+
+    async def wait(self, timeout: float) -> bool:
+        """等待下一次变更通知，超时返回 False"""
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.event.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.hub._unsubscribe(self)
+
+
+class TicketEventHub:
+    """
+    进程内工单变更通知
+    只负责"有变化了"的唤醒，具体变更内容由订阅者自己从数据库增量读取，
+    因此通知丢失或来自其它 worker 的写入，都会在下一次超时轮询时被补上
+    发布方可以在任意线程调用 publish
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def subscribe(self, ticket_id: str = None) -> Subscription:
+        """ticket_id 为 None 时订阅所有工单（列表级变更）"""
+        sub = Subscription(self, ticket_id)
+        with self._lock:
+            self._subscribers.setdefault(ticket_id, set()).add(sub)
+        return sub
+
+    def _unsubscribe(self, sub: Subscription):
+        with self._lock:
+            subs = self._subscribers.get(sub.key)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subscribers[sub.key]
+
+    def publish(self, ticket_id: str):
+        with self._lock:
+            targets = list(self._subscribers.get(ticket_id, ())) + list(self._subscribers.get(None, ()))
+        for sub in targets:
+            try:
+                sub.loop.call_soon_threadsafe(sub.event.set)
+            except RuntimeError:
+                # 订阅者所在事件循环已关闭
+                pass
+
+
+# 单例
+ticket_events = TicketEventHub()
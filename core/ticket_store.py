@@ -0,0 +1,209 @@
+import base64
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import List, Optional, Tuple
+from core.models import Ticket, TicketSummary, TicketStatus, Message
+from core.logger import logger
+from core.ticket_events import ticket_events
+from core.metrics import STAGE_SECONDS
+from core.settings import get_settings
+from core.lazy import Lazy
+
+class TicketStore:
+    """
+    工单存储：工单主表 + 只追加的 ticket_messages 表
+    - 追加消息只插入一行，不再整行重写 JSON
+    - 列表接口走 (status, created_at) 索引做 keyset 分页，只投影摘要列，不读取消息正文
+    - 每次写入提交后通过 ticket_events 唤醒对应的推送流
+    """
+    def __init__(self, db_path: str = None):
+        self.db_path = db_path or get_settings().session_db_path
+        self._local = threading.local()
+        self._init_db()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        cursor = self._conn().cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            columns = [row[1] for row in cursor.execute("PRAGMA table_info(tickets)")]
+            legacy = 'messages' in columns
+            if legacy:
+                cursor.execute("ALTER TABLE tickets RENAME TO tickets_legacy")
+            cursor.execute('''CREATE TABLE IF NOT EXISTS tickets
+                             (id TEXT PRIMARY KEY, user_id TEXT, category TEXT, title TEXT,
+                              description TEXT, status TEXT, created_at TEXT, updated_at TEXT)''')
+            cursor.execute('''CREATE TABLE IF NOT EXISTS ticket_messages
+                             (id INTEGER PRIMARY KEY AUTOINCREMENT, ticket_id TEXT NOT NULL, role TEXT,
+                              content TEXT, image_url TEXT, timestamp TEXT)''')
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_tickets_status_created ON tickets (status, created_at, id)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_tickets_created ON tickets (created_at, id)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_tickets_updated ON tickets (updated_at, id)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_ticket_messages_ticket ON ticket_messages (ticket_id, id)")
+            if legacy:
+                self._migrate_legacy(cursor)
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+
+    def _migrate_legacy(self, cursor):
+        """把旧版 tickets.messages JSON 列拆分到 ticket_messages"""
+        rows = cursor.execute('''SELECT id, user_id, category, title, description, status, messages, created_at
+                                 FROM tickets_legacy''').fetchall()
+        for ticket_id, user_id, category, title, description, status, messages, created_at in rows:
+            created = datetime.fromisoformat(str(created_at)) if created_at else datetime.now()
+            msgs = json.loads(messages) if messages else []
+            stamps = [datetime.fromisoformat(m['timestamp']) if m.get('timestamp') else created for m in msgs]
+            updated = max([created] + stamps)
+            cursor.execute("INSERT OR REPLACE INTO tickets VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                           (ticket_id, user_id, category, title, description, status, created.isoformat(), updated.isoformat()))
+            cursor.executemany("INSERT INTO ticket_messages (ticket_id, role, content, image_url, timestamp) VALUES (?, ?, ?, ?, ?)",
+                               [(ticket_id, m.get('role'), m.get('content'), m.get('image_url'), ts.isoformat())
+                                for m, ts in zip(msgs, stamps)])
+        cursor.execute("DROP TABLE tickets_legacy")
+        logger.info(f"[TICKET] Migrated {len(rows)} legacy tickets to ticket_messages.")
+
+    @STAGE_SECONDS.timed(stage="ticket_create")
+    def create(self, ticket: Ticket):
+        cursor = self._conn().cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            # 与 append_message 相同：updated_at 在写锁内取值，模型上的时间可能早于并发写入者已提交的变更
+            ticket.updated_at = datetime.now()
+            cursor.execute("INSERT INTO tickets VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                           (ticket.id, ticket.user_id, ticket.category, ticket.title, ticket.description,
+                            ticket.status.value, ticket.created_at.isoformat(), ticket.updated_at.isoformat()))
+            self._insert_messages(cursor, ticket.id, ticket.messages)
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+        ticket_events.publish(ticket.id)
+
+    def _insert_messages(self, cursor, ticket_id: str, messages: List[Message]):
+        cursor.executemany("INSERT INTO ticket_messages (ticket_id, role, content, image_url, timestamp) VALUES (?, ?, ?, ?, ?)",
+                           [(ticket_id, m.role.value, m.content, m.image_url, m.timestamp.isoformat()) for m in messages])
+
+    @STAGE_SECONDS.timed(stage="ticket_append")
+    def append_message(self, ticket_id: str, message: Message, status: TicketStatus = None) -> bool:
+        """追加一条消息（可同时更新状态），工单不存在时返回 False"""
+        cursor = self._conn().cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            # updated_at 取写锁内的当前时间而不是消息时间，保证列表级变更游标单调递增
+            now = datetime.now().isoformat()
+            if status is not None:
+                cursor.execute("UPDATE tickets SET status = ?, updated_at = ? WHERE id = ?", (status.value, now, ticket_id))
+            else:
+                cursor.execute("UPDATE tickets SET updated_at = ? WHERE id = ?", (now, ticket_id))
+            if cursor.rowcount == 0:
+                cursor.execute("ROLLBACK")
+                return False
+            self._insert_messages(cursor, ticket_id, [message])
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+        ticket_events.publish(ticket_id)
+        return True
+
+    @STAGE_SECONDS.timed(stage="ticket_get")
+    def get(self, ticket_id: str) -> Optional[Ticket]:
+        cursor = self._conn().cursor()
+        cursor.execute("SELECT id, user_id, category, title, description, status, created_at, updated_at FROM tickets WHERE id = ?",
+                       (ticket_id,))
+        row = cursor.fetchone()
+        if not row: return None
+        return Ticket(
+            id=row[0], user_id=row[1], category=row[2], title=row[3],
+            description=row[4], status=TicketStatus(row[5]), messages=[m for _, m in self.messages_after(ticket_id)],
+            created_at=datetime.fromisoformat(row[6]), updated_at=datetime.fromisoformat(row[7])
+        )
+
+    @STAGE_SECONDS.timed(stage="ticket_messages")
+    def messages_after(self, ticket_id: str, after_id: int = 0) -> List[Tuple[int, Message]]:
+        """按追加顺序返回 id 大于 after_id 的 (消息 id, 消息)，供推送流增量读取"""
+        rows = self._conn().execute('''SELECT id, role, content, image_url, timestamp FROM ticket_messages
+                                       WHERE ticket_id = ? AND id > ? ORDER BY id''', (ticket_id, after_id)).fetchall()
+        return [(row_id, Message(role=role, content=content, image_url=image_url, timestamp=datetime.fromisoformat(ts)))
+                for row_id, role, content, image_url, ts in rows]
+
+    @STAGE_SECONDS.timed(stage="ticket_version")
+    def version(self, ticket_id: str) -> Optional[Tuple[str, str, int]]:
+        """(status, updated_at, 最后一条消息 id)；只走索引不读正文，用于 ETag 与变更检测"""
+        return self._conn().execute('''SELECT status, updated_at,
+                                              (SELECT COALESCE(MAX(id), 0) FROM ticket_messages WHERE ticket_id = ?)
+                                       FROM tickets WHERE id = ?''', (ticket_id, ticket_id)).fetchone()
+
+    @staticmethod
+    def encode_cursor(sort_key: str, ticket_id: str) -> str:
+        return base64.urlsafe_b64encode(f"{sort_key}|{ticket_id}".encode('utf-8')).decode('ascii')
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> Tuple[str, str]:
+        sort_key, ticket_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|', 1)
+        return sort_key, ticket_id
+
+    _SUMMARY_COLUMNS = '''t.id, t.user_id, t.category, t.title, t.status, t.created_at, t.updated_at,
+                          (SELECT COUNT(*) FROM ticket_messages m WHERE m.ticket_id = t.id)'''
+
+    @staticmethod
+    def _summary(r) -> TicketSummary:
+        return TicketSummary(id=r[0], user_id=r[1], category=r[2], title=r[3], status=TicketStatus(r[4]),
+                             created_at=datetime.fromisoformat(r[5]), updated_at=datetime.fromisoformat(r[6]),
+                             message_count=r[7])
+
+    @STAGE_SECONDS.timed(stage="ticket_list")
+    def list_summaries(self, status: str = None, limit: int = 50, cursor: str = None) -> Tuple[List[TicketSummary], Optional[str]]:
+        """按创建时间倒序的 keyset 分页；返回 (本页摘要, 下一页游标)"""
+        clauses, params = [], []
+        if status:
+            clauses.append("t.status = ?")
+            params.append(status)
+        if cursor:
+            clauses.append("(t.created_at, t.id) < (?, ?)")
+            params.extend(self.decode_cursor(cursor))
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._conn().execute(f'''SELECT {self._SUMMARY_COLUMNS} FROM tickets t {where}
+                                        ORDER BY t.created_at DESC, t.id DESC LIMIT ?''',
+                                    (*params, limit + 1)).fetchall()
+        items = [self._summary(r) for r in rows[:limit]]
+        next_cursor = self.encode_cursor(rows[limit - 1][5], rows[limit - 1][0]) if len(rows) > limit else None
+        return items, next_cursor
+
+    @STAGE_SECONDS.timed(stage="ticket_changes")
+    def changes_since(self, cursor: str = None, limit: int = 100) -> Tuple[List[TicketSummary], Optional[str]]:
+        """
+        按 (updated_at, id) 升序返回游标之后有变更的工单摘要，供列表级推送流使用
+        返回的游标指向本批最后一条；没有新变更时原样返回传入的游标
+        """
+        where, params = "", ()
+        if cursor:
+            where, params = "WHERE (t.updated_at, t.id) > (?, ?)", self.decode_cursor(cursor)
+        rows = self._conn().execute(f'''SELECT {self._SUMMARY_COLUMNS} FROM tickets t {where}
+                                        ORDER BY t.updated_at, t.id LIMIT ?''', (*params, limit)).fetchall()
+        if not rows:
+            return [], cursor
+        return [self._summary(r) for r in rows], self.encode_cursor(rows[-1][6], rows[-1][0])
+
+    def latest_change_cursor(self) -> Optional[str]:
+        """当前最新一次变更的游标；推送流从这里开始只推之后的变化"""
+        row = self._conn().execute("SELECT updated_at, id FROM tickets ORDER BY updated_at DESC, id DESC LIMIT 1").fetchone()
+        return self.encode_cursor(*row) if row else None
+
+
+# 单例
+ticket_store = Lazy(TicketStore, "ticket_store")
@@ -1,20 +1,40 @@
-import json
 import numpy as np
 import os
 import sqlite3
 import argparse
-import sys
+import threading
+from typing import NamedTuple, Optional
 
-# 设置路径，确保在任何地方运行都能找到项目根目录
-BASE_DIR = "/home/lianwei_zlw/Walnut-AI-Support"
-sys.path.append(BASE_DIR)
-from core.logger import logger
+from core.logger import logger, configure_logging
+from core.settings import get_settings
+from core.embedding import EmbeddingBackend, EmbeddingCache, get_backend, encode_with_cache, content_hash
+from core.kb_io import iter_kb_entries
+from core.lexical_index import BM25Index, reciprocal_rank_fusion
+from core.metrics import STAGE_SECONDS
+from core.hot_swap import HotSwap
+
+class _IndexSnapshot(NamedTuple):
+    """常驻索引快照，整体替换保证查询读到一致版本"""
+    matrix: np.ndarray              # 预归一化的 float32 矩阵
+    docs: list                      # 与矩阵行对应的文档文本
+    weights: Optional[np.ndarray]   # Embedding 后端给出的逐维权重（如 IDF）
+    lexical: Optional[BM25Index]    # 标题+正文的 BM25 倒排索引
 
 class VectorSearchEngine:
-    def __init__(self, kb_path: str = f"{BASE_DIR}/data/walnut_kb.json", db_path: str = f"{BASE_DIR}/data/vector_store.db"):
-        self.kb_path = kb_path
-        self.db_path = db_path
+    def __init__(self, kb_path: str = None, db_path: str = None,
+                 embedder: EmbeddingBackend = None,
+                 hybrid: bool = True, lexical_min_coverage: float = 0.3):
+        settings = get_settings()
+        self.kb_path = kb_path or settings.kb_path
+        self.db_path = db_path or settings.db_path
+        self.embedder = embedder or get_backend()
+        # 混合检索：向量与 BM25 两路结果用 RRF 融合，精确术语查询由 BM25 兜底
+        self.hybrid = hybrid
+        self.lexical_min_coverage = lexical_min_coverage
+        self._snapshots = HotSwap("vector_index")
+        self._index_lock = threading.Lock()
         self._init_db()
+        self.cache = EmbeddingCache(self.db_path)
 
     def _init_db(self):
         os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
@@ -22,56 +42,212 @@ class VectorSearchEngine:
         cursor = conn.cursor()
         cursor.execute('''CREATE TABLE IF NOT EXISTS knowledge 
                          (id INTEGER PRIMARY KEY, title TEXT, content TEXT, vector BLOB)''')
+        cursor.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        # 旧库迁移：补充内容哈希列，供增量同步做差异比对
+        columns = [row[1] for row in cursor.execute("PRAGMA table_info(knowledge)")]
+        if 'content_hash' not in columns:
+            cursor.execute("ALTER TABLE knowledge ADD COLUMN content_hash TEXT")
+        cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_knowledge_hash ON knowledge (content_hash)")
+        # WAL 模式下重建事务进行中，查询仍可读取上一个已提交版本
+        cursor.execute("PRAGMA journal_mode=WAL")
         conn.commit()
         conn.close()
 
     def _get_vector(self, text: str):
-        # 暂时使用随机种子向量，后期可接入实际 Embedding
-        np.random.seed(hash(text) % (2**32))
-        return np.random.rand(128).astype(np.float32)
-
-    def rebuild(self):
-        logger.info(f"[Vector] Rebuilding index from {self.kb_path}...")
-        with open(self.kb_path, 'r', encoding='utf-8') as f:
-            kb_data = json.load(f)
+        return self.embedder.encode([text])[0]
 
-        conn = sqlite3.connect(self.db_path)
+    def rebuild(self, incremental: bool = True, batch_size: int = 256):
+        """
+        同步知识库到向量库
+        incremental=True 时按内容哈希做差异比对，只写入新增条目、删除已下线条目；
+        整个同步在单个事务内完成，提交前查询始终看到旧版本
+        """
+        logger.info(f"[Vector] Rebuilding index from {self.kb_path} (incremental={incremental})...")
+        conn = sqlite3.connect(self.db_path, isolation_level=None)
         cursor = conn.cursor()
-        cursor.execute("DELETE FROM knowledge")
-        for item in kb_data:
-            text = f"{item.get('title', '')} {item.get('content', '')}"
-            vec = self._get_vector(text).tobytes()
-            cursor.execute("INSERT INTO knowledge (title, content, vector) VALUES (?, ?, ?)",
-                           (item.get('title'), item.get('content'), vec))
-        conn.commit()
-        conn.close()
-        logger.info(f"[Vector] Rebuild complete. {len(kb_data)} items indexed.")
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("SELECT value FROM meta WHERE key = 'embedding_model'")
+            row = cursor.fetchone()
+            if row is None or row[0] != self.embedder.name:
+                # 换了 Embedding 后端，旧向量不可复用
+                incremental = False
+            if not incremental:
+                cursor.execute("DELETE FROM knowledge")
+            cursor.execute("SELECT content_hash FROM knowledge")
+            existing = {h for (h,) in cursor.fetchall()}
 
-    def search(self, query: str, top_k: int = 2, threshold: float = 0.3) -> str:
-        query_vec = self._get_vector(query)
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT title, content, vector FROM knowledge")
-        
-        results = []
-        for title, content, vec_blob in cursor.fetchall():
-            item_vec = np.frombuffer(vec_blob, dtype=np.float32)
-            similarity = np.dot(query_vec, item_vec) / (np.linalg.norm(query_vec) * np.linalg.norm(item_vec))
-            if similarity >= threshold:
-                results.append((similarity, f"问题: {title}\n解决方案: {content}"))
-        
-        conn.close()
-        results.sort(key=lambda x: x[0], reverse=True)
-        
+            seen, added = set(), 0
+            pending = []
+
+            def flush():
+                texts = [text for _, text, _ in pending]
+                vectors = encode_with_cache(self.embedder, self.cache, texts, batch_size=batch_size, conn=conn)
+                cursor.executemany("INSERT OR IGNORE INTO knowledge (title, content, vector, content_hash) VALUES (?, ?, ?, ?)",
+                                   [(item.get('title'), item.get('content'), vectors[i].tobytes(), h)
+                                    for i, (h, _, item) in enumerate(pending)])
+                pending.clear()
+
+            for item in iter_kb_entries(self.kb_path):
+                text = f"{item.get('title', '')} {item.get('content', '')}"
+                h = content_hash(text)
+                if h in seen:
+                    continue
+                seen.add(h)
+                if h in existing:
+                    continue
+                pending.append((h, text, item))
+                added += 1
+                if len(pending) >= batch_size:
+                    flush()
+            if pending:
+                flush()
+
+            removed = existing - seen
+            cursor.executemany("DELETE FROM knowledge WHERE content_hash IS ?", [(h,) for h in removed])
+            cursor.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('embedding_model', ?)", (self.embedder.name,))
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+        # 新索引在旁路构建完成后整体替换，进行中的查询继续使用旧快照
+        with self._index_lock:
+            self._load_index()
+        logger.info(f"[Vector] Rebuild complete. {len(seen)} items indexed "
+                    f"(+{added} / -{len(removed)} / ={len(seen) - added}), generation {self.generation}.")
+
+    def reload(self) -> int:
+        """热更新：增量同步知识库并切换到新快照，返回新的索引代号"""
+        self.rebuild(incremental=True)
+        return self.generation
+
+    def refresh(self) -> int:
+        """其它 worker 已完成同步：直接从库里重新加载常驻索引，不再重新读取知识库文件"""
+        with self._index_lock:
+            self._load_index()
+        return self.generation
+
+    @property
+    def generation(self) -> int:
+        """常驻索引的版本号，每次加载/重建后加一；0 表示尚未加载"""
+        return self._snapshots.generation
+
+    def _load_index(self):
+        """
+        一次性把向量加载成连续的归一化矩阵，查询时只需一次矩阵-向量乘法
+        矩阵预先按行数分配，逐行从游标填入后原地加权、归一化，峰值内存约为一份矩阵
+        """
+        conn = sqlite3.connect(self.db_path, isolation_level=None)
+        try:
+            cursor = conn.cursor()
+            # 同一个读事务里统计行数并读取向量，期间提交的重建不会让两者对不上
+            cursor.execute("BEGIN")
+            cursor.execute("SELECT value FROM meta WHERE key = 'embedding_model'")
+            row = cursor.fetchone()
+            model = row[0] if row else None
+            count, size = cursor.execute("SELECT COUNT(*), MAX(LENGTH(vector)) FROM knowledge").fetchone()
+            if count and model != self.embedder.name:
+                # 库内向量来自其它后端（或旧版随机向量），维度与语义都不可比，必须重建
+                logger.warning(f"[Vector] Index built with '{model}', current backend is '{self.embedder.name}'. Run --rebuild.")
+                count = 0
+            titles, contents, hashes = [], [], []
+            matrix = np.empty((count, (size or 0) // 4), dtype=np.float32)
+            if count:
+                cursor.execute("SELECT title, content, vector, content_hash FROM knowledge ORDER BY id")
+                for i, (title, content, blob, h) in enumerate(cursor):
+                    matrix[i] = np.frombuffer(blob, dtype=np.float32)
+                    titles.append(title)
+                    contents.append(content)
+                    hashes.append(h)
+            cursor.execute("COMMIT")
+        finally:
+            conn.close()
+
+        docs = [f"问题: {title}\n解决方案: {content}" for title, content in zip(titles, contents)]
+        weights = None
+        lexical = None
+        if count:
+            weights = self.embedder.fit(matrix)
+            if weights is not None:
+                np.multiply(matrix, weights, out=matrix)
+            # einsum 逐行求平方和，不像 np.linalg.norm 那样先生成一份平方后的矩阵
+            norms = np.sqrt(np.einsum('ij,ij->i', matrix, matrix))[:, None]
+            norms[norms == 0] = 1.0
+            matrix /= norms
+            if self.hybrid:
+                lexical = BM25Index.build([f"{title or ''} {content or ''}" for title, content in zip(titles, contents)])
+        else:
+            matrix = np.zeros((0, 0), dtype=np.float32)
+
+        snapshot = _IndexSnapshot(matrix, docs, weights, lexical)
+        generation = self._snapshots.swap(snapshot)
+        logger.info(f"[Vector] Resident index loaded: {len(docs)} items, "
+                    f"generation {generation}.")
+        return snapshot
+
+    def warm_up(self) -> int:
+        """提前把索引载入内存，避免首个查询承担加载耗时；返回索引条目数"""
+        self._ensure_index()
+        return len(self._snapshots.current().docs)
+
+    def _ensure_index(self):
+        if self._snapshots.current() is None:
+            with self._index_lock:
+                if self._snapshots.current() is None:
+                    self._load_index()
+
+    def search(self, query: str, top_k: int = 2, threshold: float = 0.15) -> str:
+        results = self.search_hits(query, top_k, threshold)
         if not results:
             return "NO_MATCH"
-        
-        return "\n---\n".join([r[1] for r in results[:top_k]])
+
+        return "\n---\n".join(results)
+
+    @STAGE_SECONDS.timed(stage="retrieval")
+    def search_hits(self, query: str, top_k: int = 2, threshold: float = 0.15) -> list:
+        """按相关度排序的命中文档列表（未命中返回空列表），供调用方自行拼装上下文"""
+        self._ensure_index()
+        # 整个查询持有同一个快照；期间发生热更新也不会读到新旧混杂的数据
+        with self._snapshots.lease() as snapshot:
+            return self._search(snapshot, query, top_k, threshold)
+
+    def _search(self, snapshot: _IndexSnapshot, query: str, top_k: int, threshold: float) -> list:
+        matrix, docs, weights, lexical = snapshot
+        if not docs:
+            return []
+
+        # 多取一些候选再融合，避免某一路的正确结果因名次靠后被截断
+        candidate_k = max(top_k * 5, 20) if lexical is not None else top_k
+        vector_hits = []
+        query_vec = self._get_vector(query)
+        if weights is not None:
+            query_vec = query_vec * weights
+        norm = np.linalg.norm(query_vec)
+        if norm > 0:
+            query_vec = (query_vec / norm).astype(np.float32)
+            scores = matrix @ query_vec
+            k = min(candidate_k, len(docs))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            top_scores = scores[top]
+            vector_hits = [int(i) for i, score in zip(top, top_scores) if score >= threshold]
+
+        if lexical is not None:
+            lexical_hits = [doc_id for doc_id, _ in lexical.search(query, candidate_k, self.lexical_min_coverage)]
+            ranked = [doc_id for doc_id, _ in reciprocal_rank_fusion([vector_hits, lexical_hits])]
+        else:
+            ranked = vector_hits
+        return [docs[i] for i in ranked[:top_k]]
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--rebuild", action="store_true")
+    parser.add_argument("--full", action="store_true", help="清空后全量重建，而不是增量同步")
     args = parser.parse_args()
+    configure_logging()
     engine = VectorSearchEngine()
     if args.rebuild:
-        engine.rebuild()
+        engine.rebuild(incremental=not args.full)
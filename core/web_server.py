@@ -1,30 +1,43 @@
-from fastapi import APIRouter, HTTPException, BackgroundTasks
-from core.models import Ticket, TicketCreate, TicketStatus, Message, Role
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from core.models import Ticket, TicketCreate, TicketStatus, TicketPage, Message, Role
 from core.rag_engine import ai_engine
 from core.logger import logger
-import uuid
-import sqlite3
+from core.job_queue import job_queue, QueueFull
+from core.ticket_store import ticket_store
+from core.ticket_events import ticket_events
+from core.metrics import ESCALATIONS, ERRORS
+import asyncio
+import hashlib
 import json
-from datetime import datetime
-from typing import List, Optional
+import uuid
+from typing import Optional
 
 router = APIRouter(prefix="/api/tickets", tags=["Tickets"])
 
-DB_PATH = "data/sessions.db"
+# 推送流在没有变更时发送心跳的间隔，同时兜底捕获其它 worker 进程的写入
+STREAM_KEEPALIVE = 15.0
+LIST_STREAM_BATCH = 100
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+def _sse(event: str, data, event_id=None) -> str:
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False, default=str)}")
+    return "\n".join(lines) + "\n\n"
 
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('''CREATE TABLE IF NOT EXISTS tickets 
-                     (id TEXT PRIMARY KEY, user_id TEXT, category TEXT, title TEXT, 
-                      description TEXT, status TEXT, messages TEXT, created_at TIMESTAMP)''')
-    conn.commit()
-    conn.close()
+def _etag(version) -> str:
+    return '"%s"' % hashlib.sha1("|".join(map(str, version)).encode('utf-8')).hexdigest()[:16]
 
-init_db()
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+    return "*" in tags or etag in tags
 
 @router.post("/create", response_model=Ticket)
-async def create_ticket(data: TicketCreate, background_tasks: BackgroundTasks):
+async def create_ticket(data: TicketCreate):
     ticket_id = str(uuid.uuid4())[:8]
     new_ticket = Ticket(
         id=ticket_id,
@@ -36,90 +49,141 @@ async def create_ticket(data: TicketCreate, background_tasks: BackgroundTasks):
         messages=[Message(role=Role.USER, content=data.description)]
     )
     
-    save_ticket(new_ticket)
+    await asyncio.to_thread(ticket_store.create, new_ticket)
     logger.info(f"[WEB_TICKET] Created: {ticket_id}")
-    background_tasks.add_task(ai_diagnostic_process, ticket_id)
+    try:
+        await asyncio.to_thread(job_queue.enqueue, "ticket_diagnose", {"ticket_id": ticket_id})
+    except QueueFull:
+        # 队列积压时不再排队等 AI，直接转人工，避免老师长时间无响应
+        notice = Message(role=Role.AI, content="[系统通知] 当前咨询量较大，已为您直接转接二线技术支持...")
+        await asyncio.to_thread(ticket_store.append_message, ticket_id, notice, status=TicketStatus.HUMAN_NEEDED)
+        new_ticket.status = TicketStatus.HUMAN_NEEDED
+        new_ticket.messages.append(notice)
+        ESCALATIONS.inc(reason="queue_full")
+        logger.warning(f"[WEB_TICKET] Queue full, ticket {ticket_id} escalated directly.")
     return new_ticket
 
-@router.get("/list", response_model=List[Ticket])
-async def list_tickets(status: Optional[str] = None):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    if status:
-        cursor.execute("SELECT * FROM tickets WHERE status = ? ORDER BY created_at DESC", (status,))
-    else:
-        cursor.execute("SELECT * FROM tickets ORDER BY created_at DESC")
-    
-    rows = cursor.fetchall()
-    conn.close()
-    
-    tickets = []
-    for row in rows:
-        tickets.append(Ticket(
-            id=row[0], user_id=row[1], category=row[2], title=row[3],
-            description=row[4], status=TicketStatus(row[5]),
-            messages=json.loads(row[6]), created_at=datetime.fromisoformat(row[7])
-        ))
-    return tickets
+@router.get("/list", response_model=TicketPage)
+async def list_tickets(status: Optional[str] = None, limit: int = Query(50, ge=1, le=200), cursor: Optional[str] = None):
+    """工单摘要列表：按创建时间倒序，使用上一页返回的 next_cursor 翻页"""
+    try:
+        items, next_cursor = await asyncio.to_thread(ticket_store.list_summaries, status, limit, cursor)
+    except ValueError:
+        raise HTTPException(400, "Invalid cursor")
+    return TicketPage(items=items, next_cursor=next_cursor)
+
+@router.get("/events")
+async def list_events(request: Request, cursor: Optional[str] = None):
+    """
+    二线工作台的列表级推送流 (SSE)：任一工单创建、追加消息或状态变化时推送其最新摘要
+    默认只推送连接之后的变化；断线重连时浏览器会带上 Last-Event-ID 从断点续推
+    """
+    cursor = request.headers.get("last-event-id") or cursor
+    try:
+        if cursor:
+            ticket_store.decode_cursor(cursor)
+        else:
+            cursor = await asyncio.to_thread(ticket_store.latest_change_cursor)
+    except ValueError:
+        raise HTTPException(400, "Invalid cursor")
+
+    async def stream(cursor):
+        with ticket_events.subscribe() as sub:
+            while True:
+                items, cursor = await asyncio.to_thread(ticket_store.changes_since, cursor, LIST_STREAM_BATCH)
+                for item in items:
+                    yield _sse("ticket", item.model_dump(mode="json"),
+                               ticket_store.encode_cursor(item.updated_at.isoformat(), item.id))
+                if len(items) == LIST_STREAM_BATCH:
+                    continue
+                if await request.is_disconnected():
+                    return
+                if not await sub.wait(STREAM_KEEPALIVE):
+                    yield ": keep-alive\n\n"
+
+    return StreamingResponse(stream(cursor), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@router.get("/{ticket_id}", response_model=Ticket)
+async def get_ticket(ticket_id: str, request: Request):
+    """工单详情：支持 If-None-Match，未变化时返回 304 且不读取消息正文"""
+    version = await asyncio.to_thread(ticket_store.version, ticket_id)
+    if not version: raise HTTPException(404)
+    etag = _etag(version)
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    ticket = await asyncio.to_thread(ticket_store.get, ticket_id)
+    return JSONResponse(ticket.model_dump(mode="json"), headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+@router.get("/{ticket_id}/events")
+async def ticket_events_stream(ticket_id: str, request: Request, after: int = 0):
+    """
+    单个工单的推送流 (SSE)
+    - message：新消息（AI 回复、转人工通知、人工回复），事件 id 为消息 id
+    - status：状态变化，连接建立时先推送一次当前状态
+    断线重连时按 Last-Event-ID（或 after 参数）只补发之后的消息
+    """
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id and last_event_id.isdigit():
+        after = int(last_event_id)
+    if not await asyncio.to_thread(ticket_store.version, ticket_id): raise HTTPException(404)
+
+    async def stream(after):
+        last_status = None
+        with ticket_events.subscribe(ticket_id) as sub:
+            while True:
+                version = await asyncio.to_thread(ticket_store.version, ticket_id)
+                if version is None:
+                    return
+                status, _, last_id = version
+                if status != last_status:
+                    last_status = status
+                    yield _sse("status", {"status": status})
+                if last_id > after:
+                    for message_id, message in await asyncio.to_thread(ticket_store.messages_after, ticket_id, after):
+                        after = message_id
+                        yield _sse("message", message.model_dump(mode="json"), message_id)
+                if await request.is_disconnected():
+                    return
+                if not await sub.wait(STREAM_KEEPALIVE):
+                    yield ": keep-alive\n\n"
+
+    return StreamingResponse(stream(after), media_type="text/event-stream", headers=SSE_HEADERS)
 
 @router.post("/{ticket_id}/respond")
 async def admin_respond(ticket_id: str, content: str):
     """二线人工回复接口"""
-    ticket = get_ticket_from_db(ticket_id)
-    if not ticket: raise HTTPException(404)
-    
     msg = Message(role=Role.ADMIN, content=content)
-    ticket.messages.append(msg)
-    ticket.status = TicketStatus.RESOLVED # 暂时简化逻辑
-    save_ticket(ticket)
+    # 暂时简化逻辑：人工回复即结单
+    if not await asyncio.to_thread(ticket_store.append_message, ticket_id, msg, status=TicketStatus.RESOLVED):
+        raise HTTPException(404)
     return {"status": "ok"}
 
-def save_ticket(ticket: Ticket):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("INSERT OR REPLACE INTO tickets VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-                   (ticket.id, ticket.user_id, ticket.category, ticket.title, 
-                    ticket.description, ticket.status.value, 
-                    json.dumps([m.dict() for m in ticket.messages], default=str),
-                    ticket.created_at.isoformat()))
-    conn.commit()
-    conn.close()
-
-def get_ticket_from_db(ticket_id: str) -> Optional[Ticket]:
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM tickets WHERE id = ?", (ticket_id,))
-    row = cursor.fetchone()
-    conn.close()
-    if not row: return None
-    return Ticket(
-        id=row[0], user_id=row[1], category=row[2], title=row[3],
-        description=row[4], status=TicketStatus(row[5]),
-        messages=json.loads(row[6]), created_at=datetime.fromisoformat(row[7])
-    )
-
 async def ai_diagnostic_process(ticket_id: str):
     """AI 自动化诊断逻辑：具备自动转人工能力"""
-    ticket = get_ticket_from_db(ticket_id)
+    ticket = await asyncio.to_thread(ticket_store.get, ticket_id)
     if not ticket: return
     try:
         # 调用 RAG 引擎获取回复
-        ai_reply = ai_engine.ask(f"问题:{ticket.title} 描述:{ticket.description}")
+        ai_reply = await ai_engine.ask_async(f"问题:{ticket.title} 描述:{ticket.description}")
         
         # 1. 自动转人工判断逻辑：如果检索结果为 NO_MATCH 或 AI 明确回复不知道
         if "很抱歉" in ai_reply or "尚未收录" in ai_reply or "NO_MATCH" in ai_reply:
-            ticket.status = TicketStatus.HUMAN_NEEDED
-            ticket.messages.append(Message(role=Role.AI, content="[系统通知] AI 无法从现有知识库找到解决方案，正在为您自动转接二线技术支持..."))
+            await asyncio.to_thread(ticket_store.append_message, ticket_id,
+                                    Message(role=Role.AI, content="[系统通知] AI 无法从现有知识库找到解决方案，正在为您自动转接二线技术支持..."),
+                                    status=TicketStatus.HUMAN_NEEDED)
+            ESCALATIONS.inc(reason="knowledge_gap")
             logger.info(f"[AUTO_ESCALATE] Ticket {ticket_id} escalated due to knowledge gap.")
         else:
-            ticket.messages.append(Message(role=Role.AI, content=ai_reply))
             # AI 成功匹配后，状态依然保持 AI_PROCESSING，直到用户确认或 AI 无法继续
-            
-        save_ticket(ticket)
-        
+            await asyncio.to_thread(ticket_store.append_message, ticket_id, Message(role=Role.AI, content=ai_reply))
+
     except Exception as e:
         logger.error(f"AI Process failed: {e}")
+        ERRORS.inc(component="ticket_ai")
+        ESCALATIONS.inc(reason="ai_error")
         # 如果推理出错，也强制转人工，防止流程阻塞
-        ticket.status = TicketStatus.HUMAN_NEEDED
-        ticket.messages.append(Message(role=Role.AI, content="[系统错误] 推理核心暂不可用，已为您自动转接人工。"))
-        save_ticket(ticket)
+        await asyncio.to_thread(ticket_store.append_message, ticket_id,
+                                Message(role=Role.AI, content="[系统错误] 推理核心暂不可用，已为您自动转接人工。"),
+                                status=TicketStatus.HUMAN_NEEDED)
+
+job_queue.register("ticket_diagnose", ai_diagnostic_process)
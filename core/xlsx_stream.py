@@ -0,0 +1,136 @@
+import posixpath
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+from typing import Dict, Iterator, List, Optional
+
+NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+PKG_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+_CELL_REF = re.compile(r'([A-Z]+)')
+
+
+def _column_index(ref: str) -> int:
+    """'C12' -> 2"""
+    index = 0
+    for ch in _CELL_REF.match(ref).group(1):
+        index = index * 26 + ord(ch) - 64
+    return index - 1
+
+
+def _text_of(elem) -> str:
+    """拼接 <si>/<is> 下所有 <t> 文本（富文本会拆成多个 run），忽略注音 <rPh>"""
+    parts = []
+    for child in elem:
+        if child.tag == f'{NS}t':
+            parts.append(child.text or '')
+        elif child.tag == f'{NS}r':
+            t = child.find(f'{NS}t')
+            if t is not None:
+                parts.append(t.text or '')
+    return ''.join(parts)
+
+
+def iter_shared_strings(z: zipfile.ZipFile) -> Iterator[str]:
+    """iterparse 逐条产出共享字符串，处理完即清空元素，不构建整棵 DOM"""
+    if 'xl/sharedStrings.xml' not in z.namelist():
+        return
+    with z.open('xl/sharedStrings.xml') as f:
+        for _, elem in ET.iterparse(f, events=('end',)):
+            if elem.tag == f'{NS}si':
+                yield _text_of(elem)
+                elem.clear()
+
+
+def sheet_path(z: zipfile.ZipFile, sheet: int = 0) -> str:
+    """按 workbook.xml 中的顺序解析第 sheet 个工作表在压缩包内的路径"""
+    with z.open('xl/workbook.xml') as f:
+        sheets = ET.parse(f).getroot().find(f'{NS}sheets')
+    rel_id = list(sheets)[sheet].get(f'{REL_NS}id')
+    with z.open('xl/_rels/workbook.xml.rels') as f:
+        for rel in ET.parse(f).getroot().iter(f'{PKG_REL_NS}Relationship'):
+            if rel.get('Id') == rel_id:
+                target = rel.get('Target')
+                return target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join('xl', target))
+    raise KeyError(f"Sheet #{sheet} not found")
+
+
+def iter_sheet_rows(path: str, sheet: int = 0) -> Iterator[List[Optional[str]]]:
+    """
+    流式读取工作表的每一行，单元格按列号对齐并解析为文本（共享字符串、内联字符串、数字原样）
+    工作表按行 iterparse，处理完一行即从 sheetData 中移除，内存与行数无关；
+    共享字符串表需要按下标随机访问，会完整驻留（只含去重后的字符串）
+    """
+    with zipfile.ZipFile(path) as z:
+        shared = list(iter_shared_strings(z))
+        with z.open(sheet_path(z, sheet)) as f:
+            sheet_data = None
+            for event, elem in ET.iterparse(f, events=('start', 'end')):
+                if event == 'start':
+                    if elem.tag == f'{NS}sheetData':
+                        sheet_data = elem
+                    continue
+                if elem.tag != f'{NS}row':
+                    continue
+                cells = {}
+                for c in elem.iter(f'{NS}c'):
+                    kind = c.get('t')
+                    if kind == 'inlineStr':
+                        inline = c.find(f'{NS}is')
+                        value = _text_of(inline) if inline is not None else None
+                    else:
+                        v = c.find(f'{NS}v')
+                        value = v.text if v is not None else None
+                        if value is not None and kind == 's':
+                            value = shared[int(value)]
+                    ref = c.get('r')
+                    cells[_column_index(ref) if ref else len(cells)] = value
+                row = [None] * (max(cells) + 1 if cells else 0)
+                for index, value in cells.items():
+                    row[index] = value
+                yield row
+                if sheet_data is not None:
+                    sheet_data.clear()
+                else:
+                    elem.clear()
+
+
+def iter_sheet_records(path: str, sheet: int = 0) -> Iterator[Dict[str, str]]:
+    """首行作为表头，逐行产出 {列名: 值}（空单元格省略）"""
+    rows = iter_sheet_rows(path, sheet)
+    header = [h or f'col{i}' for i, h in enumerate(next(rows, []))]
+    for row in rows:
+        yield {header[i] if i < len(header) else f'col{i}': v for i, v in enumerate(row) if v not in (None, '')}
+
+
+class MultiPatternMatcher:
+    """
+    多组规则（规则名 -> 正则列表）的单遍匹配
+    所有规则编译进一个零宽前瞻的组合正则，由正则引擎在 C 里定位“某条规则可能在此处开始”的位置，
+    只在这些位置逐条规则尝试匹配。前瞻不消耗字符，贪婪的 URL 规则不会吞掉其后的关键词，
+    结果与各规则分别 search 一致
+    """
+
+    def __init__(self, rules: Dict[str, List[str]], flags: int = 0):
+        self.rules = list(rules)
+        self._rule_regexes = {name: [re.compile(p, flags) for p in patterns] for name, patterns in rules.items()}
+        alternatives = [f'(?:{p})' for patterns in rules.values() for p in patterns]
+        self._regex = re.compile(f"(?=(?:{'|'.join(alternatives)}))", flags) if alternatives else None
+
+    def scan(self, text: str) -> Dict[str, List[str]]:
+        """返回 {规则名: [命中片段, ...]}，未命中的规则不出现；同一规则的命中片段互不重叠"""
+        hits, ends = {}, {}
+        if not text or self._regex is None:
+            return hits
+        for m in self._regex.finditer(text):
+            pos = m.start()
+            for name, regexes in self._rule_regexes.items():
+                if ends.get(name, -1) > pos:
+                    continue
+                for regex in regexes:
+                    hit = regex.match(text, pos)
+                    if hit:
+                        hits.setdefault(name, []).append(hit.group())
+                        ends[name] = hit.end()
+                        break
+        return hits
@@ -1,12 +1,25 @@
 import pandas as pd
+import argparse
 import json
 import os
 import re
 import sys
 import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 # 添加项目根目录到路径
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from core.logger import logger
+from core.settings import get_settings
+from core.kb_io import KBWriter
+from core.near_dup import NearDuplicateIndex, size_report
+
+DESC_COL = '问题现象'
+SOL_COL = '解决方式'
+NOISE_PATTERN = r'[_\-\s\./\\]+'
+PHONE_PATTERN = r'1[3-9]\d{9}'
+# 形如 "1." "2、" "3）" 的步骤编号
+STEP_PATTERN = re.compile(r'(?:^|[\s：:；;。，,])\d{1,2}\s*[\.、．)）]')
 
 def clean_text(text):
     """基础清洗：去除空白、特殊字符和脱敏处理"""
@@ -15,10 +28,147 @@ def clean_text(text):
     # 去除换行符和多余空格
     text = re.sub(r'\s+', ' ', text).strip()
     # 简单脱敏：隐藏手机号 (针对 11 位数字)
-    text = re.sub(r'1[3-9]\d{9}', '[PHONE_HIDDEN]', text)
+    text = re.sub(PHONE_PATTERN, '[PHONE_HIDDEN]', text)
     return text
 
-def distil_tickets(file_path, output_path):
+def clean_series(s: pd.Series) -> pd.Series:
+    """clean_text 的向量化版本：非字符串单元格视为空串"""
+    s = s.where(s.map(type) == str, "").astype(object)
+    return (s.str.replace(r'\s+', ' ', regex=True)
+             .str.strip()
+             .str.replace(PHONE_PATTERN, '[PHONE_HIDDEN]', regex=True))
+
+def answer_score(answer: str):
+    """聚类内挑选最佳答案：分步骤的优先，其次内容更充实的（长度封顶，避免堆砌）"""
+    return (len(STEP_PATTERN.findall(answer)) >= 2, min(len(answer), 300))
+
+class SOPDeduplicator:
+    """
+    问题描述的近重复聚类（MinHash + LSH），每个聚类只保留答案最好的一条
+    取代原来"问题前 20 个字完全相同"的去重：换种说法的重复能被合并，
+    前缀相同但实际不同的问题也不会被误删
+    每个聚类只保留成员数和当前最佳的一条问答，候选文本不会常驻内存；
+    最佳答案要读完全部输入才能确定，因此条目在最后统一产出
+    """
+    def __init__(self, threshold=0.5):
+        self.index = NearDuplicateIndex(threshold=threshold)
+        self.candidates = 0
+        # 聚类首条的编号 -> [成员数, 最佳答案得分, 问题, 答案, 报告样例]，按首次出现顺序排列
+        self._clusters = {}
+
+    def add(self, question, answer):
+        # 脱敏占位符本身会贡献大量 shingle，聚类时去掉，避免把不相干的短问题拉到一起
+        doc_id = self.index.add(question.replace('[PHONE_HIDDEN]', ''))
+        self.candidates += 1
+        score = answer_score(answer)
+        cluster = self._clusters.get(self.index.leader_of(doc_id))
+        if cluster is None:
+            self._clusters[doc_id] = [1, score, question, answer, question[:50]]
+            return
+        cluster[0] += 1
+        # 得分相同保留先出现的一条
+        if score > cluster[1]:
+            cluster[1:4] = [score, question, answer]
+
+    def entries(self, report_path=None):
+        """按聚类首次出现的顺序产出 KB 条目，并输出聚类规模报告"""
+        clusters = list(self._clusters.values())
+        report = size_report([c[0] for c in clusters], [c[4] for c in clusters])
+        logger.info(f"[Distiller] {report['documents']} candidates -> {report['clusters']} clusters, "
+                    f"{report['duplicates_removed']} near-duplicates merged, sizes: {report['size_distribution']}")
+        for item in report['largest'][:5]:
+            logger.info(f"[Distiller]   cluster x{item['size']}: {item['sample']}")
+        if report_path:
+            with open(report_path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+        for _, _, question, answer, _ in clusters:
+            yield {
+                "title": question[:50],  # 提取前50字作为标题
+                "content": f"问题现象: {question}\n解决方案: {answer}"
+            }
+
+def iter_excel_chunks(file_path, columns, chunk_size=5000):
+    """
+    openpyxl 只读模式逐行流式读取第一个工作表，每 chunk_size 行产出一个只含所需列的 DataFrame
+    内存占用与分块大小相关，而不是整个导出文件
+    """
+    from openpyxl import load_workbook
+    wb = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        rows = wb.active.iter_rows(values_only=True)
+        header = [str(c).strip() if c is not None else "" for c in next(rows, ())]
+        logger.info(f"[Distiller] Columns found: {header}")
+        missing = [c for c in columns if c not in header]
+        if missing:
+            raise KeyError(f"Required columns {missing} not found.")
+        indexes = [header.index(c) for c in columns]
+        buf = []
+        for row in rows:
+            buf.append([row[i] if i < len(row) else None for i in indexes])
+            if len(buf) >= chunk_size:
+                yield pd.DataFrame(buf, columns=columns)
+                buf = []
+        if buf:
+            yield pd.DataFrame(buf, columns=columns)
+    finally:
+        wb.close()
+
+def distil_chunk(df: pd.DataFrame, desc_col=DESC_COL, sol_col=SOL_COL) -> pd.DataFrame:
+    """对一个分块做向量化清洗与过滤，返回 question/answer 两列（可在子进程中执行）"""
+    question = clean_series(df[desc_col])
+    answer = clean_series(df[sol_col])
+    keep = (question.str.len() >= 4) & (answer.str.len() >= 4)
+    keep &= ~(question.str.fullmatch(NOISE_PATTERN) | answer.str.fullmatch(NOISE_PATTERN))
+    keep &= ~(question.str.contains('测试', regex=False) | question.str.contains('test', case=False, regex=False))
+    return pd.DataFrame({'question': question[keep], 'answer': answer[keep]})
+
+def _iter_distilled(chunks, workers):
+    """按原始顺序产出各分块的清洗结果；workers > 1 时用进程池并行，在途分块数有上限"""
+    if workers <= 1:
+        for chunk in chunks:
+            yield distil_chunk(chunk)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(distil_chunk, chunk))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def distil_tickets_streaming(file_path, output_path, chunk_size=5000, workers=0, dedup_threshold=0.5,
+                             report_path=None):
+    """
+    大文件模式：流式读取、分块向量化清洗、可选多进程；过滤与去重规则与 distil_tickets 一致
+    只有输入是流式的：每个聚类的最佳答案要读完全部输入才能确定，KB 条目在读完后才一次写出，
+    内存随条目数 O(entries) 增长——每个聚类常驻一条问答，LSH 桶每个候选行至多 bands 个键
+    """
+    logger.info(f"[Distiller] Starting streaming processing: {file_path} (chunk={chunk_size}, workers={workers})")
+    try:
+        dedup = SOPDeduplicator(dedup_threshold)
+        raw = 0
+
+        def counted(chunks):
+            nonlocal raw
+            for chunk in chunks:
+                raw += len(chunk)
+                yield chunk
+
+        chunks = counted(iter_excel_chunks(file_path, [DESC_COL, SOL_COL], chunk_size))
+        for distilled in _iter_distilled(chunks, workers):
+            for question, answer in zip(distilled['question'], distilled['answer']):
+                dedup.add(question, answer)
+            logger.info(f"[Distiller] {raw} rows scanned, {dedup.candidates} candidates kept.")
+
+        with KBWriter(output_path) as writer:
+            writer.write_many(dedup.entries(report_path))
+
+        logger.info(f"[Distiller] Success! Distilled {writer.count} high-quality SOPs from {raw} raw tickets into {output_path}")
+    except Exception as e:
+        logger.error(f"[Distiller] Streaming processing failed: {e}")
+
+def distil_tickets(file_path, output_path, dedup_threshold=0.5, report_path=None):
     logger.info(f"[Distiller] Starting batch processing: {file_path}")
     
     try:
@@ -34,14 +184,12 @@ def distil_tickets(file_path, output_path):
         # 尝试寻找关键列
         desc_col = '问题现象' # 根据日志修正
         sol_col = '解决方式'  # 根据日志修正
-        status_col = None     # 该表似乎没有状态列，或者状态隐含在解决方式中
 
         if desc_col not in df.columns or sol_col not in df.columns:
             logger.error(f"[Distiller] Required columns {desc_col}/{sol_col} not found.")
             return
 
-        knowledge_base = []
-        seen_questions = set()
+        dedup = SOPDeduplicator(dedup_threshold)
 
         # 4. 遍历提取
         for _, row in df.iterrows():
@@ -59,17 +207,10 @@ def distil_tickets(file_path, output_path):
             if '测试' in str(question) or 'test' in str(question).lower():
                 continue
 
-            # 简易去重逻辑：如果问题前 20 个字完全一样，视为重复
-            q_fingerprint = question[:20]
-            if q_fingerprint in seen_questions:
-                continue
-            
-            seen_questions.add(q_fingerprint)
+            dedup.add(question, answer)
 
-            knowledge_base.append({
-                "title": question[:50],  # 提取前50字作为标题
-                "content": f"问题现象: {question}\n解决方案: {answer}"
-            })
+        # 近重复聚类，每个聚类保留最佳答案
+        knowledge_base = list(dedup.entries(report_path))
 
         # 5. 保存为 JSON
         with open(output_path, 'w', encoding='utf-8') as f:
@@ -81,6 +222,19 @@ def distil_tickets(file_path, output_path):
         logger.error(f"[Distiller] Batch processing failed: {e}")
 
 if __name__ == "__main__":
-    RAW_PATH = "/home/lianwei_zlw/Walnut-AI-Support/data/raw_tickets.xlsx"
-    OUT_PATH = "/home/lianwei_zlw/Walnut-AI-Support/data/walnut_kb.json"
-    distil_tickets(RAW_PATH, OUT_PATH)
+    settings = get_settings()
+    parser = argparse.ArgumentParser(description="Distil raw ticket exports into walnut_kb.json")
+    parser.add_argument("--input", default=settings.raw_tickets_path)
+    parser.add_argument("--output", default=settings.kb_path)
+    parser.add_argument("--fast", action="store_true",
+                        help="Vectorized mode for large exports; streams the input only, entries are written "
+                             "after the whole export is read (memory grows with the number of entries)")
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=0, help="Process pool size for --fast (0 = in-process)")
+    parser.add_argument("--dedup-threshold", type=float, default=0.5, help="Jaccard similarity treated as duplicate")
+    parser.add_argument("--report", default=None, help="Write the cluster size report as JSON")
+    args = parser.parse_args()
+    if args.fast:
+        distil_tickets_streaming(args.input, args.output, args.chunk_size, args.workers, args.dedup_threshold, args.report)
+    else:
+        distil_tickets(args.input, args.output, args.dedup_threshold, args.report)
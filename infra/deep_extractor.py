@@ -1,48 +1,70 @@
-import xml.etree.ElementTree as ET
-import zipfile
 import json
-import re
+import os
+import sys
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.xlsx_stream import iter_sheet_rows, MultiPatternMatcher
+from core.settings import get_settings
 
-def extract_all():
+# URL 字符：遇到空白、中日韩文字或全角标点即结束，避免把紧跟的中文说明并入链接
+URL_CHAR = r'[^\s\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]'
+
+# 规则表：规则名 -> 正则；所有规则（连同 v2 的聚类规则）编译进同一个组合正则，每行只扫描一遍
+SOP_RULES = {
+    'wiki_url': [rf'https://{URL_CHAR}+?feishu\.cn/wiki/{URL_CHAR}+'],    # 知识库 URL
+    'ht101': [r'ht101\.com'],                                # 下载链接
+    'launcher': [r'launcher'],
+    'student': [r'student'],
+    'white_balance': [r'白平衡'],                             # 硬件修复 SOP (基于高频指令)
+    'app_fix': [r'清除缓存', r'右上角设置'],
+}
+
+def apply_sop_rules(hits: dict, kb: dict):
+    """根据一行工单的规则命中结果更新知识库"""
+    if 'wiki_url' in hits:
+        kb['general_wiki'] = {'keywords': ['文档', 'FAQ', '手册'], 'answer': f"【核桃技术支持】请参考官方FAQ指南：{hits['wiki_url'][0]}"}
+
+    if 'ht101' in hits:
+        if 'launcher' in hits:
+            kb['download_new'] = {'keywords': ['下载', '新端', '合端'], 'answer': '【核桃技术支持】新版合端下载地址：https://d.ht101.com/launcher/'}
+        if 'student' in hits:
+            kb['download_old'] = {'keywords': ['老端', '学生端', '1.0'], 'answer': '【核桃技术支持】老版学生端下载地址：https://d.hetao101.com/student/'}
+
+    if 'white_balance' in hits:
+        kb['hw_white_balance'] = {'keywords': ['颜色', '识别', '反光'], 'answer': '【核桃技术支持】请按以下步骤校准：\n1. 进入自由创作模式\n2. 写入 whiteBalance() 代码并下载\n3. 将小车放在白纸上按下A键校准。'}
+
+    if 'app_fix' in hits:
+        kb['app_fix'] = {'keywords': ['加载', '缓慢', '空白'], 'answer': '【核桃技术支持】请尝试：右上角设置 -> 清除缓存，然后点击“重做”按钮重新加载关卡。'}
+
+def iter_ticket_texts(path: str):
+    """流式读取工单表，一行工单的各单元格拼成一段文本，保持工单完整"""
+    for row in iter_sheet_rows(path):
+        text = '\n'.join(v for v in row if v)
+        if text:
+            yield text
+
+def extract_all(raw_path: str = None, kb_path: str = None):
+    # 未指定时使用 RAW_TICKETS_PATH / KB_PATH 配置
+    settings = get_settings()
+    raw_path = raw_path or settings.raw_tickets_path
+    kb_path = kb_path or settings.kb_path
     print('💀 STARTING DEEP DISTILLATION OF ALL TICKETS...')
     kb = {}
-    
+
     try:
-        with zipfile.ZipFile('/home/lianwei_zlw/Walnut-AI-Support/data/raw_tickets.xlsx', 'r') as z:
-            with z.open('xl/sharedStrings.xml') as f:
-                tree = ET.parse(f)
-                root = tree.getroot()
-                strings = [node.text for node in root.findall('.//{http://schemas.openxmlformats.org/spreadsheetml/2006/main}t') if node.text]
-        
-        # 复杂模式识别逻辑
-        current_ticket = []
-        for s in strings:
-            # 识别知识库 URL
-            urls = re.findall(r'https://[^\s]+feishu.cn/wiki/[^\s]+', s)
-            if urls:
-                kb['general_wiki'] = {'keywords': ['文档', 'FAQ', '手册'], 'answer': f'【核桃技术支持】请参考官方FAQ指南：{urls[0]}'}
-            
-            # 识别下载链接
-            if 'ht101.com' in s:
-                if 'launcher' in s:
-                    kb['download_new'] = {'keywords': ['下载', '新端', '合端'], 'answer': '【核桃技术支持】新版合端下载地址：https://d.ht101.com/launcher/'}
-                if 'student' in s:
-                    kb['download_old'] = {'keywords': ['老端', '学生端', '1.0'], 'answer': '【核桃技术支持】老版学生端下载地址：https://d.hetao101.com/student/'}
-
-            # 识别硬件修复 SOP (基于高频指令)
-            if '白平衡' in s:
-                kb['hw_white_balance'] = {'keywords': ['颜色', '识别', '反光'], 'answer': '【核桃技术支持】请按以下步骤校准：\n1. 进入自由创作模式\n2. 写入 whiteBalance() 代码并下载\n3. 将小车放在白纸上按下A键校准。'}
-            
-            if '清除缓存' in s or '右上角设置' in s:
-                 kb['app_fix'] = {'keywords': ['加载', '缓慢', '空白'], 'answer': '【核桃技术支持】请尝试：右上角设置 -> 清除缓存，然后点击“重做”按钮重新加载关卡。'}
+        matcher = MultiPatternMatcher(SOP_RULES)
+        rows = 0
+        for text in iter_ticket_texts(raw_path):
+            rows += 1
+            apply_sop_rules(matcher.scan(text), kb)
 
         # 保存为正式知识库
-        with open('/home/lianwei_zlw/Walnut-AI-Support/data/walnut_kb.json', 'w', encoding='utf-8') as f:
+        with open(kb_path, 'w', encoding='utf-8') as f:
             json.dump(kb, f, ensure_ascii=False, indent=4)
-        
-        print(f'💀 SUCCESS: Distilled {len(kb)} Core SOPs from full dataset.')
+
+        print(f'💀 SUCCESS: Distilled {len(kb)} Core SOPs from {rows} tickets.')
     except Exception as e:
         print(f'💀 ERROR: {e}')
 
 if __name__ == '__main__':
-    extract_all()
+    extract_all(*sys.argv[1:3])
@@ -1,32 +1,51 @@
-import zipfile
-import xml.etree.ElementTree as ET
 import json
-import re
+import os
+import sys
+from collections import Counter
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.xlsx_stream import MultiPatternMatcher
+from core.settings import get_settings
+from infra.deep_extractor import SOP_RULES, apply_sop_rules, iter_ticket_texts
 
-def extract_deep():
+# 我们不仅抓 URL，更要抓解决问题的动作词组
+patterns = {
+    'install_admin': [r'管理员', r'权限'],
+    'network_reset': [r'重启路由器', r'换个网络', r'热点'],
+    'device_not_found': [r'连不上', r'找不到设备', r'蓝牙'],
+    'browser_issue': [r'浏览器', r'兼容', r'谷歌'],
+    'account_sync': [r'同步', r'进度', r'账号不存在']
+}
+
+def extract_deep(raw_path: str = None, output_path: str = None):
+    raw_path = raw_path or get_settings().raw_tickets_path
     print('💀 INITIALIZING NEURAL DATA MINING (V2.0)...')
-    # 模拟更深层的对话对提取
     kb = {}
-    
-    # 这里的逻辑将遍历 6000 条对话流
-    # 我们不仅抓 URL，更要抓解决问题的动作词组
-    patterns = {
-        'install_admin': [r'管理员', r'权限'],
-        'network_reset': [r'重启路由器', r'换个网络', r'热点'],
-        'device_not_found': [r'连不上', r'找不到设备', r'蓝牙'],
-        'browser_issue': [r'浏览器', r'兼容', r'谷歌'],
-        'account_sync': [r'同步', r'进度', r'账号不存在']
-    }
-    
-    # ... (深度解析代码逻辑) ...
-    
-    print('[LOG] 6432 Tickets Processed.')
-    print('[LOG] Cluster Alpha: Download & Installation (1223 hits)')
-    print('[LOG] Cluster Beta: Hardware Connectivity (854 hits)')
-    print('[LOG] Cluster Gamma: Performance & Cache (412 hits)')
-    
-    # 预想中的条目数应该在 50-100 条高质量 SOP
-    print('💀 SUCCESS: Distilled 48 High-Quality SOPs.')
+    clusters = Counter()
+    samples = {}
+
+    # v1 的 SOP 规则与 v2 的聚类规则合并为一个组合正则，每条工单只扫描一遍
+    matcher = MultiPatternMatcher({**SOP_RULES, **patterns})
+    rows = 0
+    for text in iter_ticket_texts(raw_path):
+        rows += 1
+        hits = matcher.scan(text)
+        apply_sop_rules(hits, kb)
+        for name in patterns:
+            if name in hits:
+                clusters[name] += 1
+                samples.setdefault(name, text[:80])
+
+    print(f'[LOG] {rows} Tickets Processed.')
+    for name, count in clusters.most_common():
+        print(f'[LOG] Cluster {name}: {count} hits  e.g. {samples[name]!r}')
+
+    if output_path:
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump({'tickets': rows, 'clusters': dict(clusters), 'samples': samples, 'sops': kb},
+                      f, ensure_ascii=False, indent=4)
+    print(f'💀 SUCCESS: Distilled {len(kb)} Core SOPs, {len(clusters)} clusters.')
+    return clusters
 
 if __name__ == '__main__':
-    extract_deep()
+    extract_deep(*sys.argv[1:3])
@@ -1,48 +1,300 @@
+import argparse
+import asyncio
 import json
 import os
-import requests
-from dotenv import load_dotenv
+import re
+import sqlite3
+import sys
+import threading
+import time
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from core.logger import logger
+from core.llm_client import LLMClient
+from core.embedding import content_hash
+from core.kb_io import KBWriter
+from core.lazy import Lazy
+from core.settings import get_settings
 
-load_dotenv()
+DISTILL_MODEL = 'llama-3.1-8b-instant'  # 使用小模型进行大规模清洗
 
 class IntelligentDistiller:
-    def __init__(self):
-        self.api_key = os.getenv('GROQ_API_KEY')
-        self.url = 'https://api.groq.com/openai/v1/chat/completions'
+    def __init__(self, client: LLMClient = None, model: str = DISTILL_MODEL):
+        self.client = client or LLMClient()
+        self.model = model
+        self.url = self.client.url
 
-    def distill_with_llm(self, raw_content: str):
-        """利用 LLM 将原始工单/文档转化为标准 Q&A"""
+    def build_messages(self, raw_content: str) -> list:
         prompt = f"""
         你是一个专业的数据清洗专家。请将以下原始技术支持记录提炼为高质量的 RAG 知识点。
-        
+
         【原始记录】:
         {raw_content}
-        
+
         【要求】:
         1. 提取核心问题 (question) 和 最终解决方案 (answer)。
         2. 方案必须是步骤清晰的 SOP (1. 2. 3. ...)。
         3. 剔除所有姓名、手机号、日期等隐私信息。
         4. 生成 2-3 个用户可能会问的同义词 (variants)。
         5. 以 JSON 格式输出: {{"question": "...", "answer": "...", "variants": ["...", "..."]}}
-        
+
         注意：仅输出 JSON，不要有任何开场白。
         """
-        
-        headers = {'Authorization': f'Bearer {self.api_key}', 'Content-Type': 'application/json'}
-        payload = {
-            'model': 'llama-3.1-8b-instant', # 使用小模型进行大规模清洗
-            'messages': [{'role': 'user', 'content': prompt}],
-            'temperature': 0.1,
-            'response_format': {"type": "json_object"}
-        }
-        
+        return [{'role': 'user', 'content': prompt}]
+
+    def params(self) -> dict:
+        return {'model': self.model, 'temperature': 0.1, 'response_format': {"type": "json_object"}}
+
+    def distill_with_llm(self, raw_content: str):
+        """利用 LLM 将原始工单/文档转化为标准 Q&A"""
         try:
-            r = requests.post(self.url, headers=headers, json=payload, timeout=20)
-            if r.status_code == 200:
-                return r.json()['choices'][0]['message']['content']
+            return self.client.complete_sync(self.build_messages(raw_content), **self.params())
         except Exception as e:
             logger.error(f"[Distiller] LLM failed: {e}")
         return None
 
-distiller = IntelligentDistiller()
+distiller = Lazy(IntelligentDistiller, "distiller")
+
+
+def parse_distilled(text: str) -> dict:
+    """校验 LLM 输出：必须是含非空 question/answer 的 JSON 对象，variants 可选；不合格时抛 ValueError"""
+    if not text:
+        raise ValueError("empty output")
+    text = text.strip()
+    # 兼容模型偶尔包上的 ```json 代码块或前后多余文字
+    match = re.search(r'\{.*\}', text, re.S)
+    if not match:
+        raise ValueError("no JSON object found")
+    data = json.loads(match.group(0))
+    if not isinstance(data, dict):
+        raise ValueError("output is not a JSON object")
+    question, answer = data.get('question'), data.get('answer')
+    if not isinstance(question, str) or not question.strip():
+        raise ValueError("missing question")
+    if not isinstance(answer, str) or not answer.strip():
+        raise ValueError("missing answer")
+    variants = data.get('variants') or []
+    if not isinstance(variants, list):
+        variants = [variants]
+    return {'question': question.strip(), 'answer': answer.strip(),
+            'variants': [str(v).strip() for v in variants if str(v).strip()]}
+
+
+def to_kb_entry(result: dict) -> dict:
+    """转成 vector_engine.rebuild 读取的 walnut_kb.json 条目格式"""
+    content = f"问题现象: {result['question']}\n解决方案: {result['answer']}"
+    if result.get('variants'):
+        content += f"\n相似问法: {'；'.join(result['variants'])}"
+    return {"title": result['question'][:50], "content": content}
+
+
+class TokenBucket:
+    """令牌桶限速：按 rate/秒 匀速补充，最多攒 capacity 个，允许短时突发"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens: float = 1.0):
+        tokens = min(tokens, self.capacity)
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+
+class DistillCheckpoint:
+    """以原始内容哈希为键记录已完成的提炼结果，重跑时直接复用"""
+
+    def __init__(self, db_path: str = None):
+        self.db_path = db_path or get_settings().distill_checkpoint_path
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        # 提炼结果在线程池里写入，连接跨线程共享并由锁串行化
+        self._conn = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute('''CREATE TABLE IF NOT EXISTS distilled
+                              (content_hash TEXT PRIMARY KEY, status TEXT, result TEXT, error TEXT,
+                               attempts INTEGER DEFAULT 0, updated_at REAL)''')
+
+    def get(self, key: str):
+        """已成功的返回结果 dict，否则返回 None"""
+        with self._lock:
+            row = self._conn.execute("SELECT result FROM distilled WHERE content_hash = ? AND status = 'done'", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def mark_done(self, key: str, result: dict):
+        with self._lock:
+            self._conn.execute('''INSERT INTO distilled (content_hash, status, result, error, attempts, updated_at)
+                                  VALUES (?, 'done', ?, NULL, 1, ?)
+                                  ON CONFLICT(content_hash) DO UPDATE SET status = 'done', result = excluded.result,
+                                      error = NULL, attempts = attempts + 1, updated_at = excluded.updated_at''',
+                               (key, json.dumps(result, ensure_ascii=False), time.time()))
+
+    def mark_failed(self, key: str, error: str):
+        with self._lock:
+            self._conn.execute('''INSERT INTO distilled (content_hash, status, result, error, attempts, updated_at)
+                                  VALUES (?, 'failed', NULL, ?, 1, ?)
+                                  ON CONFLICT(content_hash) DO UPDATE SET status = 'failed', error = excluded.error,
+                                      attempts = attempts + 1, updated_at = excluded.updated_at''',
+                               (key, error[:500], time.time()))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._conn.execute("SELECT status, COUNT(*) FROM distilled GROUP BY status").fetchall())
+
+    def close(self):
+        self._conn.close()
+
+
+class DistillRunner:
+    """
+    批量 LLM 提炼
+    - concurrency 个 worker 从有界队列取记录，输入可以是任意长的流
+    - 令牌桶同时限制请求速率与（估算的）token 速率；429/5xx 的退避重试由 LLMClient 负责
+    - 输出不是合法 JSON 时带上纠正提示重问，最多 json_retries 次
+    - 以内容哈希为键写 SQLite 检查点：重跑时已完成的记录直接复用结果，不再调用 LLM
+    - 结果按完成顺序经 KBWriter 流式写入知识库文件
+    client 只需提供 async complete(messages, **params)，测试时可替换为本地桩
+    """
+
+    def __init__(self, distiller: IntelligentDistiller = None, checkpoint: DistillCheckpoint = None,
+                 concurrency: int = 8, requests_per_second: float = 5.0, tokens_per_minute: float = None,
+                 json_retries: int = 2):
+        self.distiller = distiller or IntelligentDistiller(LLMClient(max_concurrency=concurrency))
+        self.checkpoint = checkpoint or DistillCheckpoint()
+        self.concurrency = concurrency
+        self.request_bucket = TokenBucket(requests_per_second, max(requests_per_second, 1.0))
+        self.token_bucket = TokenBucket(tokens_per_minute / 60.0, tokens_per_minute) if tokens_per_minute else None
+        self.json_retries = json_retries
+        self.stats = {'distilled': 0, 'cached': 0, 'failed': 0, 'duplicate': 0}
+
+    async def _call(self, messages: list) -> str:
+        await self.request_bucket.acquire()
+        if self.token_bucket is not None:
+            # 中文约 1 字 1 token，粗略估算即可
+            await self.token_bucket.acquire(sum(len(m['content']) for m in messages))
+        return await self.distiller.client.complete(messages, **self.distiller.params())
+
+    async def distill_one(self, raw_content: str) -> dict:
+        messages = self.distiller.build_messages(raw_content)
+        last_error = None
+        for attempt in range(self.json_retries + 1):
+            text = await self._call(messages)
+            try:
+                return parse_distilled(text)
+            except ValueError as e:
+                last_error = e
+                logger.warning(f"[Distiller] Malformed output ({e}), attempt {attempt + 1}/{self.json_retries + 1}")
+                messages = messages[:1] + [
+                    {'role': 'assistant', 'content': text or ''},
+                    {'role': 'user', 'content': '上面的输出不是合法的 JSON 或缺少字段。请只输出 {"question": "...", "answer": "...", "variants": [...]}'},
+                ]
+        raise ValueError(f"invalid JSON after {self.json_retries + 1} attempts: {last_error}")
+
+    async def _worker(self, queue: asyncio.Queue, writer: KBWriter):
+        while True:
+            item = await queue.get()
+            try:
+                if item is None:
+                    return
+                key, raw = item
+                try:
+                    result = await self.distill_one(raw)
+                    await asyncio.to_thread(self.checkpoint.mark_done, key, result)
+                except Exception as e:
+                    # 单条失败不影响整批，记入检查点，下次重跑会再试
+                    self.stats['failed'] += 1
+                    logger.error(f"[Distiller] Record {key[:10]} failed: {e}")
+                    try:
+                        await asyncio.to_thread(self.checkpoint.mark_failed, key, str(e))
+                    except Exception as ce:
+                        logger.error(f"[Distiller] Checkpoint write failed: {ce}")
+                    continue
+                writer.write(to_kb_entry(result))
+                self.stats['distilled'] += 1
+            finally:
+                queue.task_done()
+
+    async def run(self, records, output_path: str) -> dict:
+        """提炼 records（可迭代的原始文本），结果写入 output_path；返回统计"""
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        seen = set()
+        started = time.perf_counter()
+        with KBWriter(output_path) as writer:
+            workers = [asyncio.create_task(self._worker(queue, writer)) for _ in range(self.concurrency)]
+            try:
+                for raw in records:
+                    if not raw or not raw.strip():
+                        continue
+                    key = content_hash(raw)
+                    if key in seen:
+                        self.stats['duplicate'] += 1
+                        continue
+                    seen.add(key)
+                    cached = await asyncio.to_thread(self.checkpoint.get, key)
+                    if cached is not None:
+                        writer.write(to_kb_entry(cached))
+                        self.stats['cached'] += 1
+                        continue
+                    await queue.put((key, raw))
+                for _ in workers:
+                    await queue.put(None)
+                await asyncio.gather(*workers)
+            except BaseException:
+                for task in workers:
+                    task.cancel()
+                raise
+        elapsed = time.perf_counter() - started
+        logger.info(f"[Distiller] Done in {elapsed:.1f}s: {self.stats}, {writer.count} entries written to {output_path}")
+        return dict(self.stats, written=writer.count, seconds=round(elapsed, 2))
+
+
+def iter_records(path: str):
+    """
+    读取原始记录：.jsonl 每行一个字符串或对象（对象的各字段拼成 "键: 值" 文本），
+    .xlsx 每行拼成 "列名: 值" 文本
+    """
+    if path.endswith('.jsonl'):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                obj = json.loads(line)
+                yield obj if isinstance(obj, str) else "\n".join(f"{k}: {v}" for k, v in obj.items() if v not in (None, ""))
+    elif path.endswith('.xlsx'):
+        from openpyxl import load_workbook
+        wb = load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = wb.active.iter_rows(values_only=True)
+            header = [str(c) if c is not None else "" for c in next(rows, ())]
+            for row in rows:
+                yield "\n".join(f"{h}: {v}" for h, v in zip(header, row) if v not in (None, ""))
+        finally:
+            wb.close()
+    else:
+        raise ValueError(f"Unsupported input format: {path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent, resumable LLM distillation into walnut_kb.json format")
+    parser.add_argument("input", help=".jsonl or .xlsx file of raw records")
+    parser.add_argument("output", help="KB JSON output path")
+    parser.add_argument("--checkpoint", default=None, help="断点库路径（默认 DISTILL_CHECKPOINT_PATH，相对 WAS_HOME）")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rps", type=float, default=5.0, help="Max requests per second")
+    parser.add_argument("--tpm", type=float, default=None, help="Max estimated tokens per minute")
+    parser.add_argument("--json-retries", type=int, default=2)
+    args = parser.parse_args()
+
+    runner = DistillRunner(IntelligentDistiller(LLMClient(max_concurrency=args.concurrency)),
+                           DistillCheckpoint(args.checkpoint), args.concurrency, args.rps, args.tpm, args.json_retries)
+    asyncio.run(runner.run(iter_records(args.input), args.output))
@@ -1,22 +1,51 @@
 import json
+from typing import NamedTuple
+# 以项目根目录为包根导入（python3 -m ... 或 uvicorn core.server:app），导入时不修改 sys.path
+from core.keyword_index import KeywordIndex
+from core.hot_swap import HotSwap
+from core.settings import get_settings
+from core.lazy import Lazy
+
+class _KBSnapshot(NamedTuple):
+    kb_data: dict
+    index: KeywordIndex
 
 class WalnutKB:
     def __init__(self, kb_path):
         self.kb_path = kb_path
-        with open(kb_path, 'r', encoding='utf-8') as f:
-            self.kb_data = json.load(f)
+        self._snapshots = HotSwap("keyword_index")
+        self.reload()
+
+    def reload(self):
+        """重新读取知识库并在旁路构建关键词索引，完成后原子切换，返回新的索引代号"""
+        with open(self.kb_path, 'r', encoding='utf-8') as f:
+            kb_data = json.load(f)
+        # 加载时一次性构建关键词自动机，查询只需扫描一遍 query
+        # query 会转小写，关键词同样转小写，否则含大写字母的关键词永远无法命中
+        index = KeywordIndex(
+            (key, [kw.lower() for kw in entry['keywords']]) for key, entry in kb_data.items()
+        )
+        return self._snapshots.swap(_KBSnapshot(kb_data, index))
+
+    @property
+    def generation(self):
+        return self._snapshots.generation
+
+    @property
+    def kb_data(self):
+        return self._snapshots.current().kb_data
+
+    def search_top_k(self, query, k=3):
+        """返回得分最高的 k 个 (分数, 答案)"""
+        with self._snapshots.lease() as snapshot:
+            hits = snapshot.index.top_k(query.lower(), k)
+            return [(score, snapshot.kb_data[key]['answer']) for key, score in hits]
 
     def search(self, query):
-        query = query.lower()
-        results = []
-        for key, entry in self.kb_data.items():
-            score = sum(1 for kw in entry['keywords'] if kw in query)
-            if score > 0:
-                results.append((score, entry['answer']))
-        
-        if not results: return None
+        hits = self.search_top_k(query, 1)
+        if not hits: return None
         # 返回匹配分数最高的答案
-        results.sort(key=lambda x: x[0], reverse=True)
-        return results[0][1]
+        return hits[0][1]
 
-kb_engine = WalnutKB('/home/lianwei_zlw/Walnut-AI-Support/data/walnut_kb.json')
+# 单例：首次使用时才加载 KB_PATH 指向的知识库
+kb_engine = Lazy(lambda: WalnutKB(get_settings().kb_path), "kb_engine")
@@ -1,21 +1,22 @@
-import zipfile
-import xml.etree.ElementTree as ET
+import os
+import sys
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.xlsx_stream import iter_sheet_rows
+from core.settings import get_settings
 
-def peek():
+def peek(path=None, limit=100):
+    path = path or get_settings().raw_tickets_path
     try:
-        with zipfile.ZipFile('/home/lianwei_zlw/Walnut-AI-Support/data/raw_tickets.xlsx', 'r') as z:
-            # 读取 sharedStrings 来获取文本内容
-            with z.open('xl/sharedStrings.xml') as f:
-                tree = ET.parse(f)
-                root = tree.getroot()
-                # 提取前 20 条文本内容
-                strings = [node.text for node in root.findall('.//{http://schemas.openxmlformats.org/spreadsheetml/2006/main}t') if node.text]
-                print('--- DATA_SAMPLES_START ---')
-                for s in strings[:100]:
-                    print(s)
-                print('--- DATA_SAMPLES_END ---')
+        # 流式读取工作表，只解析前 limit 行，单元格已按共享字符串解析并保持行结构
+        print('--- DATA_SAMPLES_START ---')
+        for i, row in enumerate(iter_sheet_rows(path)):
+            if i >= limit:
+                break
+            print(' | '.join(v or '' for v in row))
+        print('--- DATA_SAMPLES_END ---')
     except Exception as e:
         print(f'Error: {e}')
 
 if __name__ == '__main__':
-    peek()
+    peek(*sys.argv[1:2])
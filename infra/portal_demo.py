@@ -7,6 +7,19 @@ API_BASE_URL = "http://127.0.0.1:8001/api/tickets"
 
 st.set_page_config(page_title="W.A.S. 中台", page_icon="🌰", layout="wide")
 
+def fetch_ticket(ticket_id):
+    """带 ETag 的工单详情拉取：未变化时服务端返回 304，复用上次的结果"""
+    cache = st.session_state.setdefault("ticket_cache", {})
+    etag, cached = cache.get(ticket_id, (None, None))
+    headers = {"If-None-Match": etag} if etag else {}
+    r = requests.get(f"{API_BASE_URL}/{ticket_id}", headers=headers)
+    if r.status_code == 304:
+        return cached
+    if r.status_code != 200:
+        return None
+    cache[ticket_id] = (r.headers.get("ETag"), r.json())
+    return cache[ticket_id][1]
+
 page = st.sidebar.selectbox("切换入口", ["👨‍🏫 老师提单门户", "🛠️ 二线接单后台"])
 
 # --- 老师提单门户 ---
@@ -26,9 +39,8 @@ if page == "👨‍🏫 老师提单门户":
                     st.rerun()
     else:
         st.info(f"工单受理中: {st.session_state.ticket_id}")
-        r = requests.get(f"{API_BASE_URL}/{st.session_state.ticket_id}")
-        if r.status_code == 200:
-            ticket = r.json()
+        ticket = fetch_ticket(st.session_state.ticket_id)
+        if ticket:
             for m in ticket["messages"]:
                 with st.chat_message("assistant" if m["role"] in ["ai", "admin"] else "user"):
                     st.write(f"**[{m['role'].upper()}]** {m['content']}")
@@ -44,15 +56,14 @@ else:
     st.title("W.A.S. 二线工作台")
     r = requests.get(f"{API_BASE_URL}/list")
     if r.status_code == 200:
-        tickets = r.json()
+        tickets = r.json()["items"]
         df = pd.DataFrame(tickets)
         if not df.empty:
-            st.dataframe(df[["id", "user_id", "title", "status", "created_at"]], use_container_width=True)
+            st.dataframe(df[["id", "user_id", "title", "status", "message_count", "created_at"]], use_container_width=True)
             
             selected_id = st.selectbox("选择要接管的工单 ID", df["id"].tolist())
             if selected_id:
-                t_r = requests.get(f"{API_BASE_URL}/{selected_id}")
-                ticket = t_r.json()
+                ticket = fetch_ticket(selected_id)
                 st.subheader(f"对话流: {ticket['title']}")
                 for m in ticket["messages"]:
                     st.text(f"[{m['role']}] {m['content']}")
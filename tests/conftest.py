@@ -0,0 +1,47 @@
+import os
+import sys
+
+import pytest
+
+# 与 infra/bench 脚本相同：以项目根目录为包根导入
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(autouse=True)
+def was_home(tmp_path, monkeypatch):
+    """每个用例一个独立的 WAS_HOME，数据库与日志不会写进仓库"""
+    from core.settings import get_settings
+    monkeypatch.setenv("WAS_HOME", str(tmp_path))
+    get_settings.cache_clear()
+    yield tmp_path
+    get_settings.cache_clear()
+
+
+@pytest.fixture
+def mock_services():
+    """在后台线程里启动 bench/mock_services 的替身服务；工厂参数同 create_app，返回 (base_url, app)"""
+    import socket
+    import threading
+    import time
+    import uvicorn
+    from bench.mock_services import create_app
+
+    servers = []
+
+    def start(**kwargs):
+        app = create_app(**kwargs)
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        server = uvicorn.Server(uvicorn.Config(app, log_level="warning"))
+        thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True)
+        thread.start()
+        servers.append((server, thread))
+        while not server.started:
+            time.sleep(0.01)
+        return f"http://127.0.0.1:{sock.getsockname()[1]}", app
+
+    yield start
+    for server, thread in servers:
+        server.should_exit = True
+        thread.join(5)
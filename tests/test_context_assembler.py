@@ -0,0 +1,36 @@
+import random
+
+import pytest
+
+from core.context_assembler import ContextAssembler, estimate_tokens, message_tokens
+
+PROMPT = "你是核桃编程的技术支持助手，只根据参考片段回答老师的问题。\n"
+
+
+def snippet(rng: random.Random, length: int) -> str:
+    return "".join(chr(0x4E00 + rng.randrange(20000)) for _ in range(length)) + " steps: restart the client"
+
+
+def test_messages_stay_within_total_budget():
+    rng = random.Random(0)
+    assembler = ContextAssembler(PROMPT, system_budget=80, context_budget=120, history_budget=100, max_snippets=3)
+    for _ in range(50):
+        hits = [snippet(rng, rng.randrange(10, 200)) for _ in range(rng.randrange(0, 6))]
+        history = [{"role": role, "content": snippet(rng, rng.randrange(1, 60))}
+                   for _ in range(rng.randrange(0, 6)) for role in ("user", "assistant")]
+        messages = assembler.build_messages("客户端白屏", hits, history)
+        system, *history_kept, _ = messages
+        assert message_tokens(system) <= assembler.system_budget + assembler.context_budget
+        assert sum(message_tokens(m) for m in history_kept) <= assembler.history_budget
+
+
+def test_context_is_truncated_to_budget():
+    assembler = ContextAssembler(PROMPT, system_budget=80, context_budget=60, min_snippet_tokens=10)
+    system = assembler.system_prompt(["很长的解决方案" * 50])
+    assert system.endswith("…\n")
+    assert message_tokens({"role": "system", "content": system}) <= 80 + 60
+
+
+def test_oversized_static_prompt_fails_fast():
+    with pytest.raises(ValueError, match="system_budget"):
+        ContextAssembler(PROMPT * 20, system_budget=estimate_tokens(PROMPT))
@@ -0,0 +1,70 @@
+import asyncio
+import json
+
+from infra.intelligent_distiller import DistillCheckpoint, DistillRunner, IntelligentDistiller
+
+
+def answer(question: str) -> str:
+    return json.dumps({"question": question, "answer": "1. 重启客户端 2. 清理缓存", "variants": []}, ensure_ascii=False)
+
+
+class FakeClient:
+    """按原始记录回放预设输出的 LLM 桩；输出用完后一直返回最后一个"""
+    url = "fake://llm"
+
+    def __init__(self, outputs: dict):
+        self.outputs = {raw: list(replies) for raw, replies in outputs.items()}
+        self.calls = {raw: 0 for raw in outputs}
+
+    async def complete(self, messages, **params):
+        raw = next(r for r in self.outputs if r in messages[0]['content'])
+        replies = self.outputs[raw]
+        self.calls[raw] += 1
+        return replies.pop(0) if len(replies) > 1 else replies[0]
+
+
+def run(tmp_path, client: FakeClient, records) -> dict:
+    checkpoint = DistillCheckpoint(str(tmp_path / "checkpoint.db"))
+    runner = DistillRunner(IntelligentDistiller(client), checkpoint, concurrency=2, requests_per_second=1000)
+    try:
+        return asyncio.run(runner.run(records, str(tmp_path / "kb.json")))
+    finally:
+        checkpoint.close()
+
+
+def titles(tmp_path) -> list:
+    with open(tmp_path / "kb.json", encoding="utf-8") as f:
+        return sorted(entry["title"] for entry in json.load(f))
+
+
+def test_malformed_json_is_asked_again(tmp_path):
+    client = FakeClient({"客户端白屏": ["好的，这是结果：", '```json\n' + answer("客户端白屏") + '\n```']})
+    stats = run(tmp_path, client, ["客户端白屏"])
+    assert client.calls["客户端白屏"] == 2
+    assert (stats["distilled"], stats["failed"]) == (1, 0)
+    assert titles(tmp_path) == ["客户端白屏"]
+
+
+def test_rerun_skips_finished_records(tmp_path):
+    records = ["客户端白屏", "课件加载失败"]
+    run(tmp_path, FakeClient({r: [answer(r)] for r in records}), records)
+
+    client = FakeClient({r: [answer(r)] for r in records})
+    stats = run(tmp_path, client, records)
+    assert client.calls == {"客户端白屏": 0, "课件加载失败": 0}
+    assert (stats["cached"], stats["distilled"], stats["written"]) == (2, 0, 2)
+    assert titles(tmp_path) == sorted(records)
+
+
+def test_failed_record_is_retried_on_rerun(tmp_path):
+    records = ["客户端白屏", "课件加载失败"]
+    first = FakeClient({"客户端白屏": [answer("客户端白屏")], "课件加载失败": ["not json"]})
+    stats = run(tmp_path, first, records)
+    assert (stats["distilled"], stats["failed"]) == (1, 1)
+    assert titles(tmp_path) == ["客户端白屏"]
+
+    second = FakeClient({r: [answer(r)] for r in records})
+    stats = run(tmp_path, second, records)
+    assert second.calls == {"客户端白屏": 0, "课件加载失败": 1}
+    assert (stats["cached"], stats["distilled"], stats["failed"]) == (1, 1, 0)
+    assert titles(tmp_path) == sorted(records)
@@ -0,0 +1,41 @@
+import io
+
+from PIL import Image, ImageDraw
+
+from core.image_pipeline import VisionResultCache, prepare_image, screenshot_digest
+
+
+def dialog(message: str) -> bytes:
+    """同一布局的报错弹窗，只有报错文字不同"""
+    img = Image.new('RGB', (800, 400), (240, 240, 240))
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((0, 0, 800, 40), fill=(30, 90, 200))
+    draw.text((40, 160), message, fill=(0, 0, 0))
+    draw.rectangle((600, 320, 760, 370), fill=(200, 200, 200))
+    buf = io.BytesIO()
+    img.save(buf, format='PNG')
+    return buf.getvalue()
+
+
+ACCESS_DENIED = dialog("0x80070005 access denied, run the installer as administrator")
+DIRECTX_FAILED = dialog("0xC0000142 DirectX init failed, repair the runtime")
+
+
+def test_same_layout_different_message_gets_different_digest():
+    assert prepare_image(ACCESS_DENIED).digest != prepare_image(DIRECTX_FAILED).digest
+
+
+def test_resent_screenshot_gets_same_digest():
+    assert prepare_image(ACCESS_DENIED).digest == prepare_image(ACCESS_DENIED).digest
+
+
+def test_cache_key_is_known_before_decoding():
+    # 缓存键只取决于原始字节，命中时不需要解码、缩放和重新编码
+    assert screenshot_digest(ACCESS_DENIED) == prepare_image(ACCESS_DENIED).digest
+
+
+def test_cache_does_not_reuse_reply_for_other_error():
+    cache = VisionResultCache()
+    cache.put(screenshot_digest(ACCESS_DENIED), "以管理员身份运行安装程序")
+    assert cache.get(screenshot_digest(DIRECTX_FAILED)) is None
+    assert cache.get(screenshot_digest(ACCESS_DENIED)) == "以管理员身份运行安装程序"
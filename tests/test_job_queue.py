@@ -0,0 +1,58 @@
+import asyncio
+import threading
+
+from core.job_queue import JobQueue, QueueFull, final_attempt
+from core.llm_client import LLMError
+
+
+def test_concurrent_enqueue_respects_max_depth(tmp_path):
+    queue = JobQueue(db_path=str(tmp_path / "jobs.db"), max_depth=5)
+    queue.enqueue("noop", {})
+    accepted = []
+    barrier = threading.Barrier(8)
+
+    def producer():
+        barrier.wait()
+        for _ in range(5):
+            try:
+                accepted.append(queue.enqueue("noop", {}))
+            except QueueFull:
+                pass
+
+    threads = [threading.Thread(target=producer) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(accepted) == 4
+    assert queue.stats()["queued"] == 5
+
+
+def test_final_attempt_outside_job():
+    assert final_attempt()
+
+
+def test_transient_failure_is_retried_until_max_attempts(tmp_path):
+    seen = []
+
+    def handler():
+        seen.append(final_attempt())
+        raise LLMError("upstream overloaded", 503)
+
+    async def run():
+        queue = JobQueue(db_path=str(tmp_path / "jobs.db"), workers=1, poll_interval=0.05)
+        queue.register("reply", handler)
+        queue.enqueue("reply", {}, max_attempts=2)
+        await queue.start()
+        try:
+            for _ in range(200):
+                if queue.stats()["processed"]["failed"]:
+                    break
+                await asyncio.sleep(0.05)
+        finally:
+            await queue.stop()
+        return queue.stats()["processed"]
+
+    processed = asyncio.run(run())
+    assert seen == [False, True]
+    assert processed == {"done": 0, "failed": 1, "retried": 1}
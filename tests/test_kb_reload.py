@@ -0,0 +1,125 @@
+import asyncio
+import os
+import time
+
+from core.kb_reload import KBReloader
+
+
+class FakeIndex:
+    def __init__(self, build_seconds: float = 0.0):
+        self.build_seconds = build_seconds
+        self.generation = 0
+        self.rebuilds = 0
+        self.refreshes = 0
+
+    def reload(self) -> int:
+        time.sleep(self.build_seconds)
+        self.rebuilds += 1
+        self.generation += 1
+        return self.generation
+
+    def refresh(self) -> int:
+        self.refreshes += 1
+        self.generation += 1
+        return self.generation
+
+
+def make_worker(tmp_path, build_seconds: float = 0.0, **kwargs):
+    index = FakeIndex(build_seconds)
+    reloader = KBReloader(db_path=str(tmp_path / "vector_store.db"), **kwargs)
+    reloader.register("vector", index)
+    return reloader, index
+
+
+def touch(path, content: str):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+    st = os.stat(path)
+    # 保证 mtime 一定变化，不依赖文件系统的时间精度
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+
+
+def test_admin_reload_reaches_other_workers(tmp_path):
+    async def run():
+        (a, index_a), (b, index_b) = make_worker(tmp_path), make_worker(tmp_path)
+        await a.reload(reason="admin")
+        assert await b.sync()
+        assert not await b.sync()
+        return a, b, index_a, index_b
+
+    a, b, index_a, index_b = asyncio.run(run())
+    assert (index_a.rebuilds, index_b.rebuilds, index_b.refreshes) == (1, 0, 1)
+    assert a.generation == b.generation == 1
+
+
+def test_workers_follow_without_file_watch(tmp_path):
+    kb_path = tmp_path / "kb.json"
+    touch(kb_path, "[]")
+
+    async def run():
+        (a, _), (b, index_b) = (make_worker(tmp_path, watch_interval=0, sync_interval=0.01) for _ in range(2))
+        await a.start(str(kb_path))
+        await b.start(str(kb_path))
+        try:
+            await a.reload(reason="admin")
+            for _ in range(100):
+                if index_b.refreshes:
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            await a.stop()
+            await b.stop()
+        return index_b
+
+    index_b = asyncio.run(run())
+    assert (index_b.rebuilds, index_b.refreshes) == (0, 1)
+
+
+def test_file_change_is_rebuilt_once_across_workers(tmp_path):
+    kb_path = tmp_path / "kb.json"
+    touch(kb_path, "[]")
+
+    async def run():
+        workers = [make_worker(tmp_path, watch_interval=0.05, sync_interval=0) for _ in range(2)]
+        for reloader, _ in workers:
+            await reloader.start(str(kb_path))
+        try:
+            # 管理接口在文件更新后手动触发：记录了新的 mtime，监视不会再重建一次
+            touch(kb_path, '[{"title": "a"}]')
+            await workers[0][0].reload(reason="admin")
+            await asyncio.sleep(0.3)
+        finally:
+            for reloader, _ in workers:
+                await reloader.stop()
+        return [index for _, index in workers]
+
+    index_a, index_b = asyncio.run(run())
+    assert (index_a.rebuilds, index_a.refreshes) == (1, 0)
+    assert (index_b.rebuilds, index_b.refreshes) == (0, 1)
+
+
+def test_watchers_rebuild_one_file_change_once(tmp_path):
+    kb_path = tmp_path / "kb.json"
+    touch(kb_path, "[]")
+
+    async def run():
+        # 两个 worker 同一节奏轮询，重建耗时跨过好几轮，只能有一个认领成功
+        workers = [make_worker(tmp_path, build_seconds=0.2, watch_interval=0.02, sync_interval=0) for _ in range(2)]
+        for reloader, _ in workers:
+            await reloader.start(str(kb_path))
+        try:
+            touch(kb_path, '[{"title": "a"}]')
+            for _ in range(200):
+                if sum(index.rebuilds + index.refreshes for _, index in workers) >= 2:
+                    break
+                await asyncio.sleep(0.02)
+            await asyncio.sleep(0.2)
+        finally:
+            for reloader, _ in workers:
+                await reloader.stop()
+        return workers
+
+    workers = asyncio.run(run())
+    indexes = [index for _, index in workers]
+    assert sorted((index.rebuilds, index.refreshes) for index in indexes) == [(0, 1), (1, 0)]
+    assert [reloader.generation for reloader, _ in workers] == [1, 1]
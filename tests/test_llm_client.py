@@ -0,0 +1,126 @@
+import asyncio
+
+import pytest
+
+from bench.mock_services import DEFAULT_REPLY, Fault
+from core.feishu_client import DeliveryError, FeishuClient, ResourceError, StreamingTextMessage
+from core.llm_client import LLMClient, LLMError
+
+PAYLOAD = {"model": "mock", "messages": [{"role": "user", "content": "客户端白屏"}]}
+
+
+@pytest.fixture
+def llm_client():
+    clients = []
+
+    def make(base_url, **kwargs):
+        client = LLMClient(api_key="test", base_url=f"{base_url}/openai/v1", backoff_base=0.001, **kwargs)
+        clients.append(client)
+        return client
+
+    yield make
+    for client in clients:
+        client.close()
+
+
+async def collect(client: LLMClient) -> str:
+    return "".join([piece async for piece in client.stream(PAYLOAD)])
+
+
+def test_stream_yields_full_reply(mock_services, llm_client):
+    base_url, _ = mock_services(token_delay=0)
+    assert asyncio.run(collect(llm_client(base_url))) == DEFAULT_REPLY
+
+
+def test_stream_skips_empty_and_malformed_chunks(mock_services, llm_client):
+    base_url, _ = mock_services(token_delay=0, stream_noise=True)
+    assert asyncio.run(collect(llm_client(base_url))) == DEFAULT_REPLY
+
+
+def test_retries_are_bounded(mock_services, llm_client):
+    base_url, app = mock_services(faults={"llm": Fault(error_rate=1.0)})
+    client = llm_client(base_url, max_retries=2)
+    with pytest.raises(LLMError) as exc:
+        client.complete_sync(PAYLOAD["messages"])
+    assert exc.value.status_code == 503 and exc.value.retryable
+    assert app.state.calls["llm"] == 3
+
+    with pytest.raises(LLMError):
+        asyncio.run(collect(client))
+    assert app.state.calls["llm"] == 6
+
+
+def test_retry_recovers_from_transient_errors(mock_services, llm_client):
+    base_url, app = mock_services(token_delay=0, faults={"llm": Fault(error_rate=0.5)}, seed=1)
+    client = llm_client(base_url, max_retries=10)
+    for _ in range(5):
+        assert client.complete_sync(PAYLOAD["messages"]) == DEFAULT_REPLY
+    assert app.state.calls["llm_error"] > 0
+
+
+def stream_reply(base_url, client: LLMClient, **kwargs) -> StreamingTextMessage:
+    feishu = FeishuClient(app_id="cli_test", app_secret="secret", base_url=base_url)
+
+    async def run():
+        message = StreamingTextMessage(feishu, "ou_teacher", **kwargs)
+        async for piece in client.stream(PAYLOAD):
+            await message.feed(piece)
+        await message.finish()
+        return message
+
+    return asyncio.run(run())
+
+
+def test_streaming_edits_are_throttled(mock_services, llm_client):
+    base_url, app = mock_services(token_delay=0.01)
+    chunks = -(-len(DEFAULT_REPLY) // 4)
+    message = stream_reply(base_url, llm_client(base_url), interval=0.1)
+    pushes = app.state.deliveries.count["ou_teacher"]
+    assert message.text == DEFAULT_REPLY
+    assert "ou_teacher" in app.state.deliveries.final
+    assert 2 <= pushes < chunks
+
+
+def test_streaming_edits_respect_max_edits(mock_services, llm_client):
+    base_url, app = mock_services(token_delay=0)
+    stream_reply(base_url, llm_client(base_url), interval=0, max_edits=3)
+    # 首条发送 + 中间最多 max_edits - 1 次编辑 + 最终全文一次编辑
+    assert app.state.deliveries.count["ou_teacher"] == 4
+    assert "ou_teacher" in app.state.deliveries.final
+
+
+def test_backoff_does_not_hold_concurrency_slot(mock_services, llm_client):
+    # seed=1：第一次调用返回 503，第二次成功
+    base_url, app = mock_services(faults={"llm": Fault(error_rate=0.5)}, seed=1)
+    client = llm_client(base_url, max_concurrency=1, max_retries=1)
+    client._backoff = lambda attempt: 2.0
+
+    async def run():
+        retrying = asyncio.ensure_future(client.chat(PAYLOAD))
+        while not app.state.calls["llm_error"]:
+            await asyncio.sleep(0.01)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await client.chat(PAYLOAD)
+        elapsed = loop.time() - start
+        await asyncio.gather(retrying, return_exceptions=True)
+        return elapsed
+
+    assert asyncio.run(run()) < 1.0
+
+
+def test_resource_download_failure_is_raised(mock_services):
+    base_url, app = mock_services(faults={"feishu_image": Fault(error_rate=1.0)})
+    feishu = FeishuClient(app_id="cli_test", app_secret="secret", base_url=base_url, max_retries=1)
+    # 限流重试耗尽是暂时性故障，交给任务队列重试
+    with pytest.raises(DeliveryError):
+        feishu.get_message_resource("om_1", "img_1")
+    assert app.state.calls["feishu_image"] == 2
+
+
+def test_resource_over_budget_is_not_retried(mock_services):
+    base_url, _ = mock_services()
+    feishu = FeishuClient(app_id="cli_test", app_secret="secret", base_url=base_url)
+    assert feishu.get_message_resource("om_1", "img_1")[:4] == b"\x89PNG"
+    with pytest.raises(ResourceError):
+        feishu.get_message_resource("om_1", "img_1", max_bytes=1024)
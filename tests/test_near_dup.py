@@ -0,0 +1,39 @@
+import random
+
+from core.near_dup import NearDuplicateIndex, choose_bands
+
+
+def variant_pair(rng: random.Random, replaced: int, length: int = 60):
+    """两段随机汉字文本，后 replaced 个字不同；字符二元组的 Jaccard 为 (length-1-replaced)/(length-1+replaced)"""
+    chars = [chr(0x4E00 + rng.randrange(20000)) for _ in range(length + replaced)]
+    return "".join(chars[:length]), "".join(chars[:length - replaced] + chars[length:])
+
+
+def merge_rate(replaced: int, trials: int = 200, **kwargs) -> float:
+    rng = random.Random(0)
+    merged = 0
+    for seed in range(trials):
+        index = NearDuplicateIndex(seed=seed, **kwargs)
+        for text in variant_pair(rng, replaced):
+            index.add(text)
+        merged += index.leader_of(1) == 0
+    return merged / trials
+
+
+def test_bands_put_s_curve_at_threshold():
+    assert choose_bands(0.5, 64) == 32
+    assert choose_bands(0.8, 64) == 16
+    for threshold in (0.3, 0.5, 0.7, 0.9):
+        bands = choose_bands(threshold, 64)
+        assert 1 - (1 - threshold ** (64 // bands)) ** bands >= 0.95
+
+
+def test_pairs_above_threshold_are_merged():
+    # J ≈ 0.59：16×4 分段时只有约 0.85 的合并率
+    assert merge_rate(replaced=15) >= 0.9
+    assert merge_rate(replaced=10) >= 0.98
+
+
+def test_dissimilar_pairs_stay_apart():
+    # J ≈ 0.2
+    assert merge_rate(replaced=40) <= 0.02
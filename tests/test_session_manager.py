@@ -0,0 +1,73 @@
+import sqlite3
+import threading
+
+import pytest
+
+from core.session_manager import PersistentSessionManager
+
+
+def make_manager(tmp_path, **kwargs):
+    return PersistentSessionManager(db_path=str(tmp_path / "sessions.db"), sweep_interval=0, **kwargs)
+
+
+def turn(i: int) -> list:
+    return [{"role": "user", "content": f"q{i}"}, {"role": "assistant", "content": f"a{i}"}]
+
+
+def test_window_keeps_latest_turns(tmp_path):
+    manager = make_manager(tmp_path, max_history=4)
+    for i in range(5):
+        manager.append_messages("u1", turn(i))
+    assert [m["content"] for m in manager.get_context("u1")] == ["q3", "a3", "q4", "a4"]
+
+
+def test_max_history_zero_keeps_nothing(tmp_path):
+    manager = make_manager(tmp_path, max_history=0)
+    for i in range(3):
+        manager.append_messages("u1", turn(i))
+    assert manager.get_context("u1") == []
+
+
+def test_explicit_zero_overrides_default_window(tmp_path):
+    manager = make_manager(tmp_path, max_history=10)
+    manager.append_messages("u1", turn(0))
+    manager.append_messages("u1", turn(1), max_history=0)
+    assert manager.get_context("u1") == []
+
+
+def test_max_history_setting_zero(tmp_path, monkeypatch):
+    from core.settings import get_settings
+    monkeypatch.setenv("MAX_HISTORY", "0")
+    get_settings.cache_clear()
+    manager = make_manager(tmp_path)
+    manager.append_messages("u1", turn(0))
+    assert manager.get_context("u1") == []
+
+
+def test_reads_see_writes_from_other_worker(tmp_path):
+    worker_a, worker_b = make_manager(tmp_path), make_manager(tmp_path)
+    worker_a.append_messages("u1", turn(0))
+    assert len(worker_b.get_context("u1")) == 2
+    worker_a.append_messages("u1", turn(1))
+    assert [m["content"] for m in worker_b.get_context("u1")] == ["q0", "a0", "q1", "a1"]
+
+
+def test_close_closes_every_thread_connection(tmp_path):
+    manager = make_manager(tmp_path)
+    conns = []
+
+    def use():
+        manager.get_context("u1")
+        conns.append(manager._conn())
+
+    thread = threading.Thread(target=use)
+    thread.start()
+    thread.join()
+    conns.append(manager._conn())
+    manager.close()
+    for conn in conns:
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
+    # 关闭后仍可按需重新连接
+    manager.append_messages("u1", turn(0))
+    assert len(manager.get_context("u1")) == 2
@@ -0,0 +1,28 @@
+from core.models import Message, Role, Ticket, TicketStatus
+from core.ticket_store import TicketStore
+
+
+def make_ticket(ticket_id: str) -> Ticket:
+    return Ticket(id=ticket_id, user_id="u1", category="自动识别", title="t", description="d",
+                  status=TicketStatus.AI_PROCESSING, messages=[Message(role=Role.USER, content="d")])
+
+
+def test_create_moves_change_cursor_forward(tmp_path):
+    store = TicketStore(db_path=str(tmp_path / "tickets.db"))
+    store.create(make_ticket("a"))
+    # 请求线程在其它写入提交前就构造好了模型，updated_at 早于当前游标
+    late = make_ticket("b")
+    store.append_message("a", Message(role=Role.AI, content="reply"))
+    cursor = store.latest_change_cursor()
+    store.create(late)
+    items, _ = store.changes_since(cursor)
+    assert [item.id for item in items] == ["b"]
+
+
+def test_changes_since_follows_commit_order(tmp_path):
+    store = TicketStore(db_path=str(tmp_path / "tickets.db"))
+    pending = [make_ticket(i) for i in "abc"]
+    for ticket in reversed(pending):
+        store.create(ticket)
+    items, _ = store.changes_since(None)
+    assert [item.id for item in items] == ["c", "b", "a"]
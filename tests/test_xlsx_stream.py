@@ -0,0 +1,35 @@
+import re
+
+from core.xlsx_stream import MultiPatternMatcher
+from infra.deep_extractor import SOP_RULES
+
+
+def independent_hits(rules, text):
+    """基线做法：逐条规则分别 search"""
+    return {name for name, patterns in rules.items() if any(re.search(p, text) for p in patterns)}
+
+
+def test_url_does_not_mask_following_keywords():
+    hits = MultiPatternMatcher(SOP_RULES).scan('参考 https://a.feishu.cn/wiki/abc，白平衡校准后再右上角设置')
+    assert set(hits) == {'wiki_url', 'white_balance', 'app_fix'}
+    # URL 在全角标点处结束
+    assert hits['wiki_url'] == ['https://a.feishu.cn/wiki/abc']
+
+
+def test_keywords_inside_url_are_found():
+    text = '请看 https://a.feishu.cn/wiki/x?from=ht101.com/launcher'
+    hits = MultiPatternMatcher(SOP_RULES).scan(text)
+    assert set(hits) == {'wiki_url', 'ht101', 'launcher'}
+    assert set(hits) == independent_hits(SOP_RULES, text)
+
+
+def test_rules_starting_at_same_position_are_all_reported():
+    rules = {'short': [r'launch'], 'long': [r'launcher']}
+    assert set(MultiPatternMatcher(rules).scan('open launcher now')) == {'short', 'long'}
+
+
+def test_matches_independent_search():
+    texts = ['student 端闪退，清除缓存后 launcher 正常', 'ht101.com 无法访问', '没有命中的工单', '']
+    matcher = MultiPatternMatcher(SOP_RULES)
+    for text in texts:
+        assert set(matcher.scan(text)) == independent_hits(SOP_RULES, text)